@@ -0,0 +1,319 @@
+import threading
+from itertools import chain
+from datetime import date, timedelta
+
+import numpy as np
+
+
+# Sources of the analytics: minute power samples or daily energy counters
+MINUTES = "minutes"
+DAYS = "days"
+SOURCES = [MINUTES, DAYS]
+
+# Length of the date prefix identifying a bucket, hours need minute data
+HOUR = "hour"
+BUCKET_KEY_LENGTHS = {
+    "day": 10,
+    "month": 7,
+    "year": 4,
+    "all": 0,
+}
+BUCKETS = [HOUR] + list(BUCKET_KEY_LENGTHS)
+
+# Limits of the response size
+MAX_BUCKETS = 10000
+DEFAULT_PERCENTILES = [50, 90, 99]
+DEFAULT_CURVE_POINTS = 100
+MAX_CURVE_POINTS = 1000
+
+SELECT_MINUTE_COUNTS = (
+    "SELECT date, COUNT(*) FROM high_res_samples "
+    "WHERE date >= ? AND date <= ? GROUP BY date")
+SELECT_MINUTES = (
+    "SELECT minute, produced, consumed, fed_in FROM high_res_samples "
+    "WHERE date >= ? AND date <= ? ORDER BY date, minute")
+SELECT_PACKED = (
+    "SELECT date, minutes, samples FROM high_res_packed "
+    "WHERE date >= ? AND date <= ?")
+SELECT_DAYS = (
+    "SELECT date, produced_b - produced_a, consumed_b - consumed_a, "
+    "fed_in_b - fed_in_a FROM days "
+    "WHERE date >= ? AND date <= ? ORDER BY date")
+
+
+# Returns the date strings from one day to another, both included
+def get_day_strings(from_string, to_string):
+    '''Returns the date strings from one day to another, both included.'''
+    from_date = date.fromisoformat(from_string)
+    num_days = (date.fromisoformat(to_string) - from_date).days + 1
+    return [str(from_date + timedelta(days=i)) for i in range(num_days)]
+
+
+# Splits ordered date strings into runs of consecutive days
+def get_runs(day_strings):
+    '''Splits ordered date strings into runs of consecutive days.'''
+    runs = []
+    for day_string in day_strings:
+        if runs and runs[-1][-1] == str(date.fromisoformat(day_string) - timedelta(days=1)):
+            runs[-1].append(day_string)
+        else:
+            runs.append([day_string])
+    return runs
+
+
+# Reads the minute samples of a range of days into arrays, returns the
+# minutes and the produced, consumed and fed in power (kW) of each day
+def read_minutes(db, from_string, to_string):
+    '''Reads the minute samples of a range of days into arrays.'''
+    counts = dict(db.execute(SELECT_MINUTE_COUNTS, (from_string, to_string)))
+    num_samples = sum(counts.values())
+    # Fetching the rows is the slow part, np.fromiter avoids a list of them
+    cursor = db.connection.cursor()
+    try:
+        cursor.execute(SELECT_MINUTES, (from_string, to_string))
+        samples = np.fromiter(
+            chain.from_iterable(cursor), np.float64, count=4 * num_samples)
+    finally:
+        cursor.close()
+    samples = samples.reshape(num_samples, 4)
+    days = {}
+    start = 0
+    for day_string in get_day_strings(from_string, to_string):
+        end = start + counts.get(day_string, 0)
+        days[day_string] = (
+            samples[start:end, 0].astype(np.int16),
+            samples[start:end, 1:].astype(np.float32))
+        start = end
+    return days
+
+
+# Reads the days of a range that the grabber has packed, returns the
+# minutes and the produced, consumed and fed in power (kW) of each day
+def read_packed(db, from_string, to_string):
+    '''Reads the days of a range that the grabber has packed.'''
+    return {
+        day_string: (
+            np.frombuffer(minutes, "<i2"),
+            np.frombuffer(samples, "<f4").reshape(-1, 3))
+        for day_string, minutes, samples in db.execute(SELECT_PACKED, (from_string, to_string))}
+
+
+# Minute samples of the days that are over, they are not written anymore.
+# Cold days are read from the packed rows of the grabber, only days that
+# are not packed yet are read minute by minute. Both take longer than the
+# analysis itself, so the days are kept as arrays (14 bytes per sample,
+# about 37 MB for 5 years).
+class DayCache:
+    def __init__(self):
+        self.days = {}  # (minutes, values) by date string
+        self.lock = threading.Lock()
+
+    def get(self, db, day_strings, today_string):
+        '''Returns the (minutes, values) arrays of consecutive days.'''
+        with self.lock:
+            days = {day: self.days[day] for day in day_strings if day in self.days}
+        # Read the missing days run by run, packed ones first
+        missing = [day for day in day_strings if day not in days]
+        loaded = {}
+        for run in get_runs(missing):
+            loaded.update(read_packed(db, run[0], run[-1]))
+        for run in get_runs([day for day in missing if day not in loaded]):
+            loaded.update(read_minutes(db, run[0], run[-1]))
+        days.update(loaded)
+        with self.lock:
+            self.days.update(
+                (day, arrays) for day, arrays in loaded.items() if day < today_string)
+        return [days[day] for day in day_strings]
+
+    def drop_before(self, day_string):
+        '''Forgets the days before the given one, e.g. after the retention.'''
+        with self.lock:
+            for day in [day for day in self.days if day < day_string]:
+                del self.days[day]
+
+
+# Returns the samples of a range as columns: the days with samples, the
+# index of the first sample of each, the hours each sample stands for and
+# the minute, produced, consumed and fed in of each sample. Minute samples
+# are power in kW, day samples energy in kWh.
+def load(db, source, from_string, to_string, day_cache=None, today_string=None):
+    '''Returns the samples of a range as columns.'''
+    if source == MINUTES:
+        if day_cache is None:
+            day_cache = DayCache()
+        if today_string is None:
+            today_string = str(date.today())
+        day_strings = get_day_strings(from_string, to_string)
+        days = day_cache.get(db, day_strings, today_string)
+        used = [i for i, (minutes, _) in enumerate(days) if len(minutes)]
+        lengths = [len(days[i][0]) for i in used]
+        values = np.concatenate([values for _, values in days])
+        return {
+            "days": [day_strings[i] for i in used],
+            "day_starts": np.cumsum([0] + lengths[:-1], dtype=np.int64),
+            "hours": 1.0 / 60.0,
+            "minute": np.concatenate([minutes for minutes, _ in days]),
+            "produced": values[:, 0],
+            "consumed": values[:, 1],
+            "fed_in": values[:, 2],
+        }
+    if source == DAYS:
+        rows = db.execute(SELECT_DAYS, (from_string, to_string))
+        values = np.array([row[1:] for row in rows], np.float64).reshape(len(rows), 3)
+        return {
+            "days": [row[0] for row in rows],
+            "day_starts": np.arange(len(rows)),
+            "hours": 1.0,
+            "minute": None,
+            "produced": values[:, 0],
+            "consumed": values[:, 1],
+            "fed_in": values[:, 2],
+        }
+    raise ValueError(f"Unknown analytics source '{source}'")
+
+
+# Returns the keys of the buckets and the index of the first sample of
+# each. The samples are ordered by time, so each bucket is a slice.
+def get_buckets(columns, bucket):
+    '''Returns the keys of the buckets and the index of the first sample of each.'''
+    day_strings = columns["days"]
+    day_starts = columns["day_starts"]
+    if bucket == HOUR:
+        if columns["minute"] is None:
+            raise ValueError("Hour buckets need minute samples")
+        lengths = np.diff(day_starts, append=len(columns["minute"]))
+        day_index = np.repeat(np.arange(len(day_strings)), lengths)
+        hour_ids = day_index * 24 + columns["minute"] // 60
+        starts = np.flatnonzero(np.diff(hour_ids, prepend=-1))
+        keys = [f"{day_strings[hour_id // 24]} {hour_id % 24:02d}"
+                for hour_id in hour_ids[starts].tolist()]
+    elif bucket in BUCKET_KEY_LENGTHS:
+        # Only the days are looked at, a bucket starts where the prefix changes
+        length = BUCKET_KEY_LENGTHS[bucket]
+        prefixes = [day_string[:length] for day_string in day_strings]
+        first_days = [i for i, prefix in enumerate(prefixes)
+                      if i == 0 or prefix != prefixes[i - 1]]
+        keys = [prefixes[i] or "all" for i in first_days]
+        starts = day_starts[first_days]
+    else:
+        raise ValueError(f"Unknown analytics bucket '{bucket}'")
+    if len(keys) > MAX_BUCKETS:
+        raise ValueError(f"At most {MAX_BUCKETS} buckets per request")
+    return keys, starts
+
+
+# Returns the energy KPIs of bucket sums (arrays of kWh) as lists
+def get_energy_kpis(produced, consumed, fed_in, consumed_self, prices):
+    '''Returns the energy KPIs of bucket sums (arrays of kWh) as lists.'''
+    # Like the history: 100 % if there was nothing to produce or consume
+    with np.errstate(divide="ignore", invalid="ignore"):
+        self_consumption = np.where(
+            produced > 0, consumed_self / produced * 100.0, 100.0)
+        autarky = np.where(
+            consumed > 0, consumed_self / consumed * 100.0, 100.0)
+    earned = fed_in * prices["revenue_per_fed_in_kwh"]
+    saved = consumed_self * (prices["price_per_grid_kwh"] - prices["revenue_per_fed_in_kwh"])
+    return {
+        "produced_kwh": produced.tolist(),
+        "consumed_total_kwh": consumed.tolist(),
+        "consumed_from_pv_kwh": consumed_self.tolist(),
+        "consumed_from_grid_kwh": (consumed - consumed_self).tolist(),
+        "usage_fed_in_kwh": fed_in.tolist(),
+        "self_consumption_percent": self_consumption.tolist(),
+        "autarky": autarky.tolist(),
+        "earned_feedin": earned.tolist(),
+        "earned_savings": saved.tolist(),
+        "earned_total": (earned + saved).tolist(),
+    }
+
+
+# Converts power samples in kW to W, rounded to the precision of the samples
+def to_watts(power_kw):
+    '''Converts power samples in kW to W.'''
+    return np.round(np.asarray(power_kw, np.float64) * 1000.0, 1)
+
+
+# Returns percentiles of sorted values, interpolated linearly like
+# np.percentile, which would partition the values once more
+def get_percentiles(sorted_values, percentiles):
+    '''Returns percentiles of sorted values, interpolated linearly.'''
+    positions = np.asarray(percentiles, np.float64) / 100.0 * (len(sorted_values) - 1)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, len(sorted_values) - 1)
+    weights = positions - lower
+    lower_values = sorted_values[lower].astype(np.float64)
+    upper_values = sorted_values[upper].astype(np.float64)
+    return lower_values * (1.0 - weights) + upper_values * weights
+
+
+# Returns the load duration curve of power samples (kW, descending) as
+# the hours the power was reached at least and the power in W
+def get_duration_curve(sorted_power, hours_per_sample, points):
+    '''Returns the load duration curve of power samples.'''
+    positions = np.unique(np.linspace(
+        0, len(sorted_power) - 1, min(points, len(sorted_power))).round().astype(np.int64))
+    return {
+        "hours": ((positions + 1) * hours_per_sample).tolist(),
+        "power_w": to_watts(sorted_power[positions]).tolist(),
+    }
+
+
+# Computes the KPIs of the loaded columns per bucket and for the whole
+# range, vectorized over all samples
+def compute(columns, bucket, prices, percentiles=None, points=DEFAULT_CURVE_POINTS):
+    '''Computes the KPIs of the loaded columns per bucket and for the whole range.'''
+    if percentiles is None:
+        percentiles = DEFAULT_PERCENTILES
+    produced = columns["produced"]
+    if len(produced) == 0:
+        return {"state": "nodata"}
+    consumed = columns["consumed"]
+    fed_in = columns["fed_in"]
+    hours = columns["hours"]
+    # What was produced and not fed in was consumed on site
+    consumed_self = np.minimum(np.maximum(produced - fed_in, 0), consumed)
+    keys, starts = get_buckets(columns, bucket)
+    # Minute samples are float32, the sums are not
+    sums = [np.add.reduceat(values, starts, dtype=np.float64) * hours
+            for values in (produced, consumed, fed_in, consumed_self)]
+    totals = [np.array([values.sum()]) for values in sums]
+    bucket_kpis = get_energy_kpis(*sums, prices)
+    total_kpis = {name: values[0] for name, values in
+                  get_energy_kpis(*totals, prices).items()}
+    data = {
+        "state": "ok",
+        "num_samples": len(produced),
+        "total": total_kpis,
+        "buckets": [],
+        "percentiles": None,
+        "load_duration": None,
+    }
+    if columns["minute"] is not None:
+        bucket_kpis["peak_production_w"] = to_watts(
+            np.maximum.reduceat(produced, starts)).tolist()
+        bucket_kpis["peak_consumption_w"] = to_watts(
+            np.maximum.reduceat(consumed, starts)).tolist()
+        # One sort per column serves the percentiles and the curves
+        grid = consumed - consumed_self
+        sorted_produced = np.sort(produced)
+        sorted_consumed = np.sort(consumed)
+        sorted_grid = np.sort(grid)
+        total_kpis["peak_production_w"] = float(to_watts(sorted_produced[-1]))
+        total_kpis["peak_consumption_w"] = float(to_watts(sorted_consumed[-1]))
+        data["percentiles"] = {
+            "percent": list(percentiles),
+            "production_w": to_watts(get_percentiles(sorted_produced, percentiles)).tolist(),
+            "consumption_w": to_watts(get_percentiles(sorted_consumed, percentiles)).tolist(),
+            "grid_w": to_watts(get_percentiles(sorted_grid, percentiles)).tolist(),
+        }
+        data["load_duration"] = {
+            "production": get_duration_curve(sorted_produced[::-1], hours, points),
+            "consumption": get_duration_curve(sorted_consumed[::-1], hours, points),
+            "grid": get_duration_curve(sorted_grid[::-1], hours, points),
+        }
+    names = list(bucket_kpis)
+    for i, key in enumerate(keys):
+        entry = {"date": key}
+        entry.update((name, bucket_kpis[name][i]) for name in names)
+        data["buckets"].append(entry)
+    return data
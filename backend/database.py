@@ -1,26 +1,145 @@
 import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+
+# Connection tuning
+BUSY_TIMEOUT_S = 5.0  # How long a statement waits for a lock
+BEGIN_RETRIES = 3  # Retries of a write transaction if the lock wait timed out
+MMAP_SIZE = 64 * 1024 * 1024  # Bytes of the data base file mapped into memory
+CACHE_SIZE_KIB = 8 * 1024  # Page cache per connection
 
 
 class Database:
-    def __init__(self, file_name):
+    def __init__(self, file_name, read_only=False):
         self.cursor = None
         self.connection = None
-        self.open(file_name)
+        self.open(file_name, read_only)
 
     def __del__(self):
         self.close()
 
-    def open(self, file_name):
+    def open(self, file_name, read_only=False):
         '''Opens the database connection.'''
-        self.connection = sqlite3.connect(file_name)
+        # Transactions are managed explicitly via transaction()
+        if read_only:
+            # Read only connections may be closed by a different thread
+            self.connection = sqlite3.connect(
+                f"file:{file_name}?mode=ro", uri=True,
+                isolation_level=None, timeout=BUSY_TIMEOUT_S,
+                check_same_thread=False)
+        else:
+            self.connection = sqlite3.connect(
+                file_name, isolation_level=None, timeout=BUSY_TIMEOUT_S)
+            # Readers never block the writer and vice versa in WAL mode
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self.connection.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
         self.cursor = self.connection.cursor()
 
     def close(self):
         '''Closes the data base.'''
-        self.connection.commit()
+        if self.connection is None:
+            return
+        if self.connection.in_transaction:
+            self.connection.commit()
         self.connection.close()
+        self.connection = None
 
-    def execute(self, query):
+    def execute(self, query, parameters=()):
         '''Executes a query and returns resulting rows.'''
-        self.cursor.execute(query)
+        self.cursor.execute(query, parameters)
         return self.cursor.fetchall()
+
+    def executemany(self, query, parameter_rows):
+        '''Executes a query once for each set of parameters.'''
+        self.cursor.executemany(query, parameter_rows)
+
+    def begin(self):
+        '''Starts a write transaction, retrying if the data base is locked.'''
+        for attempt in range(BEGIN_RETRIES + 1):
+            try:
+                self.cursor.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == BEGIN_RETRIES:
+                    raise
+                logging.warning(f"Database: data base is locked, "
+                                f"retrying ({attempt + 1}/{BEGIN_RETRIES})")
+                time.sleep(0.1 * (attempt + 1))
+
+    @contextmanager
+    def transaction(self):
+        '''Runs all enclosed statements in one write transaction.'''
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.cursor.execute("ROLLBACK")
+            raise
+        self.cursor.execute("COMMIT")
+
+    @contextmanager
+    def read_transaction(self):
+        '''Runs all enclosed queries on one consistent snapshot of the data base.'''
+        self.cursor.execute("BEGIN")
+        try:
+            yield self
+        except BaseException:
+            self.cursor.execute("ROLLBACK")
+            raise
+        self.cursor.execute("COMMIT")
+
+
+# Hands out long-lived connections to one data base file: a single writer
+# connection (grabber) and one read-only connection per thread (web server)
+class ConnectionManager:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.writer_db = None
+        self.writer_lock = threading.Lock()
+        self.local = threading.local()
+        self.version_db = None
+        self.version_lock = threading.Lock()
+
+    def writer(self):
+        '''Returns the writer connection, opening it on first use.'''
+        with self.writer_lock:
+            if self.writer_db is None:
+                self.writer_db = Database(self.file_name)
+            return self.writer_db
+
+    def reader(self):
+        '''Returns the read-only connection of the calling thread.'''
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = Database(self.file_name, read_only=True)
+            self.local.db = db
+        return db
+
+    def get_data_version(self):
+        '''Returns a number that changes whenever another connection commits.'''
+        # PRAGMA data_version is per connection, so all threads have to ask
+        # the same one to get comparable values
+        with self.version_lock:
+            if self.version_db is None:
+                self.version_db = Database(self.file_name, read_only=True)
+            return self.version_db.execute("PRAGMA data_version")[0][0]
+
+    def close(self):
+        '''Closes the writer and the calling thread's reader connection.'''
+        with self.version_lock:
+            if self.version_db is not None:
+                self.version_db.close()
+                self.version_db = None
+        with self.writer_lock:
+            if self.writer_db is not None:
+                self.writer_db.close()
+                self.writer_db = None
+        db = getattr(self.local, "db", None)
+        if db is not None:
+            db.close()
+            self.local.db = None
@@ -0,0 +1,215 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Project imports
+import metrics
+
+
+# Values provided by every device adapter after update()
+ENERGY_VALUES = [
+    "total_energy_produced_kwh",
+    "total_energy_consumed_kwh",
+    "total_energy_fed_in_kwh",
+]
+POWER_VALUES = [
+    "current_power_produced_kw",
+    "current_power_consumed_from_grid_kw",
+    "current_power_consumed_from_pv_kw",
+    "current_power_consumed_total_kw",
+    "current_power_fed_in_kw",
+]
+DEVICE_VALUES = ENERGY_VALUES + POWER_VALUES
+
+# Metrics of the device polls
+POLL_SECONDS = metrics.histogram(
+    "cpin_device_poll_seconds", "Duration of a device poll", ["device"])
+POLL_ERRORS = metrics.counter(
+    "cpin_device_poll_errors_total", "Device polls that failed or timed out", ["device", "reason"])
+
+# Seconds a device may take to answer before the tick goes on without it,
+# unless its adapter has a longer timeout of its own
+DEFAULT_TIMEOUT_S = 3.0
+# Seconds added to the own timeout of an adapter, so a device answering
+# just in time is not cut off
+TIMEOUT_MARGIN_S = 1.0
+
+# Latest values of every configured device
+CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS device_current ("
+    "name TEXT PRIMARY KEY, type TEXT, online INTEGER, updated STRING, "
+    "poll_ms REAL, produced REAL, consumed_grid REAL, consumed_pv REAL, "
+    "consumed_total REAL, fed_in REAL, total_produced REAL, "
+    "total_consumed REAL, total_fed_in REAL)")
+UPSERT_DEVICE = (
+    "INSERT INTO device_current VALUES "
+    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET "
+    "type = excluded.type, online = excluded.online, "
+    "updated = excluded.updated, poll_ms = excluded.poll_ms, "
+    "produced = excluded.produced, consumed_grid = excluded.consumed_grid, "
+    "consumed_pv = excluded.consumed_pv, "
+    "consumed_total = excluded.consumed_total, fed_in = excluded.fed_in, "
+    "total_produced = excluded.total_produced, "
+    "total_consumed = excluded.total_consumed, "
+    "total_fed_in = excluded.total_fed_in")
+
+
+# Returns the seconds to wait for a device per tick: the configured ones,
+# or the own timeout of its adapter (poll_timeout_s) plus a margin
+def get_timeout_s(device, configured_s=None):
+    '''Returns the seconds to wait for a device per tick.'''
+    if configured_s is not None:
+        return float(configured_s)
+    adapter_s = getattr(device, 'poll_timeout_s', None)
+    if adapter_s is None:
+        return DEFAULT_TIMEOUT_S
+    return max(DEFAULT_TIMEOUT_S, float(adapter_s) + TIMEOUT_MARGIN_S)
+
+
+# Returns a copy of the values of a device
+def get_values(device):
+    '''Returns a copy of the values of a device.'''
+    return {name: getattr(device, name) for name in DEVICE_VALUES}
+
+
+# Updates a device and returns its values and the poll duration in ms.
+# Runs in a worker thread, so the values are copied before returning.
+def poll_device(device):
+    '''Updates a device and returns its values and the poll duration in ms.'''
+    start = time.perf_counter()
+    device.update()
+    return get_values(device), (time.perf_counter() - start) * 1000.0
+
+
+# State of one device in the pool
+class DeviceState:
+    def __init__(self, name, device_type, device, timeout_s):
+        self.name = name
+        self.type = device_type
+        self.device = device
+        self.timeout_s = timeout_s
+        self.future = None  # Poll that is still running
+        self.values = None  # Values of the last good poll
+        self.online = False
+        self.updated = None  # Time of the last good poll
+        self.poll_ms = 0.0
+
+
+# Polls several devices concurrently and adds up their values. Has the
+# same attributes as a device adapter, so it can be used like a single one.
+class DevicePool:
+    def __init__(self, devices):
+        self.states = [DeviceState(*device) for device in devices]
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self.states)),
+            thread_name_prefix="device")
+        # Set once every device had a good poll, the energy totals are
+        # not known before
+        self.energy_complete = False
+        for name in ENERGY_VALUES:
+            setattr(self, name, None)
+        self.add_up()
+
+    # Polls all devices, waiting at most for the timeout of each device
+    def update(self):
+        '''Polls all devices, waiting at most for the timeout of each device.'''
+        start = time.monotonic()
+        for state in self.states:
+            # Pick up the result of a poll that finished after its timeout
+            if state.future is not None and state.future.done():
+                self.collect(state)
+            if state.future is None:
+                state.future = self.executor.submit(poll_device, state.device)
+            else:
+                logging.warning(f"Grabber: device '{state.name}' is still busy "
+                                f"with the previous poll")
+
+        # A slow device only delays the tick up to its own timeout
+        for state in sorted(self.states, key=lambda state: state.timeout_s):
+            remaining_s = start + state.timeout_s - time.monotonic()
+            wait([state.future], timeout=max(0.0, remaining_s))
+            if state.future.done():
+                self.collect(state)
+            else:
+                state.online = False
+                POLL_ERRORS.inc(state.name, "timeout")
+                logging.error(f"Grabber: device '{state.name}' did not answer "
+                              f"within {state.timeout_s} s")
+
+        if not any(state.online for state in self.states):
+            raise RuntimeError("No device answered")
+        self.add_up()
+
+    # Takes over the result of a finished poll
+    def collect(self, state):
+        '''Takes over the result of a finished poll.'''
+        future = state.future
+        state.future = None
+        try:
+            state.values, state.poll_ms = future.result()
+            state.online = True
+            state.updated = time.time()
+            POLL_SECONDS.observe(state.name, seconds=state.poll_ms / 1000.0)
+        except Exception:
+            state.online = False
+            POLL_ERRORS.inc(state.name, "error")
+            logging.exception(f"Grabber: polling device '{state.name}' failed")
+
+    # Computes the site totals from the values of all devices
+    def add_up(self):
+        '''Computes the site totals from the values of all devices.'''
+        # Energy counters keep the last good value of a device that did
+        # not answer, so the totals never drop. Until every device answered
+        # once they stay unknown, a device coming online later would add
+        # its whole lifetime counter to the current periods.
+        if all(state.values is not None for state in self.states):
+            self.energy_complete = True
+            for name in ENERGY_VALUES:
+                setattr(self, name, sum(
+                    state.values[name] for state in self.states))
+        # Power of a device that did not answer is unknown, don't count it
+        for name in POWER_VALUES:
+            setattr(self, name, sum(
+                state.values[name] for state in self.states if state.online))
+
+    # Stops the worker threads without waiting for hanging polls
+    def close(self):
+        '''Stops the worker threads without waiting for hanging polls.'''
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Creates the per device table if it does not exist
+def create_table(db):
+    '''Creates the per device table if it does not exist.'''
+    db.execute(CREATE_TABLE)
+
+
+# Stores the latest values of all devices of the pool
+def insert_device_values(db, pool):
+    '''Stores the latest values of all devices of the pool.'''
+    rows = []
+    for state in pool.states:
+        updated = "..."
+        if state.updated is not None:
+            updated = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(state.updated))
+        # No values before the first good poll
+        values = state.values or dict.fromkeys(DEVICE_VALUES, 0.0)
+        rows.append((
+            state.name, state.type, int(state.online), updated,
+            round(state.poll_ms, 1),
+            values["current_power_produced_kw"],
+            values["current_power_consumed_from_grid_kw"],
+            values["current_power_consumed_from_pv_kw"],
+            values["current_power_consumed_total_kw"],
+            values["current_power_fed_in_kw"],
+            values["total_energy_produced_kwh"],
+            values["total_energy_consumed_kwh"],
+            values["total_energy_fed_in_kwh"]))
+    db.executemany(UPSERT_DEVICE, rows)
+
+
+# Returns the rows of all devices
+def get_devices(db):
+    '''Returns the rows of all devices.'''
+    return db.execute("SELECT * FROM device_current ORDER BY name")
@@ -1,5 +1,19 @@
-import requests
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+# Project imports
+import metrics
+
+
+# Timeout of a request to the datamanager in seconds
+REQUEST_TIMEOUT_S = 5
+
+# Latency of the requests to the datamanager, per end point
+REQUEST_SECONDS = metrics.histogram(
+    "cpin_fronius_request_seconds", "Latency of a request to the Fronius datamanager", ["endpoint"])
 
 
 # Fronius Symo/Gn24 devices
@@ -19,6 +33,19 @@ class Fronius:
 
         self.has_meter = config.config_data['fronius']['has_meter'] # True / False - Smart Meter active?
 
+        # Keep-alive connections to the datamanager, reused on every tick
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount("http://", adapter)
+        # Fetches the inverter data while the meter data is fetched
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fronius")
+
+        # Seconds an update may take, inverter and meter are fetched at once
+        self.poll_timeout_s = REQUEST_TIMEOUT_S
+
+        # Latency of the last request to each end point in ms
+        self.latency_ms = {"inverter": 0.0, "meter": 0.0}
+
         # Initialize with default values
         self.total_energy_produced_kwh = 0.0
         self.total_energy_consumed_kwh = 0.0
@@ -100,20 +127,35 @@ class Fronius:
         self.current_power_consumed_from_pv_kw = cur_consumption_from_pv
         self.current_power_consumed_total_kw = cur_consumption_total
 
+    def fetch(self, endpoint, url):
+        '''Requests the JSON data of an end point. Returns it with the latency in ms.'''
+        start = time.perf_counter()
+        response = self.session.get(url, timeout=REQUEST_TIMEOUT_S)
+        response.raise_for_status()
+        data = response.json()
+        seconds = time.perf_counter() - start
+        REQUEST_SECONDS.observe(endpoint, seconds=seconds)
+        return data, seconds * 1000.0
+
     def update(self):
         '''Updates all device stats.'''
         try:
-            # Query inverter data
-            r_inverter = requests.get(self.url_inverter, timeout=5)
-            r_inverter.raise_for_status()
-            # Query smart meter data
             if self.has_meter:
-                r_meter = requests.get(self.url_meter, timeout=5)
-                r_meter.raise_for_status()
-                # Extract and process relevant data
-                self.copy_data(r_inverter.json(), r_meter.json())
+                # Query inverter and smart meter data at the same time
+                inverter_future = self.executor.submit(self.fetch, "inverter", self.url_inverter)
+                meter_data, self.latency_ms["meter"] = self.fetch("meter", self.url_meter)
+                inverter_data, self.latency_ms["inverter"] = inverter_future.result()
             else:
-                self.copy_data(r_inverter.json(), "{}") # Null meter data
+                inverter_data, self.latency_ms["inverter"] = self.fetch("inverter", self.url_inverter)
+                meter_data = "{}" # Null meter data
+
+            if logging.getLogger().level == logging.DEBUG:
+                logging.debug(f"Fronius device: request latency: "
+                              f"inverter {self.latency_ms['inverter']:.0f} ms, "
+                              f"meter {self.latency_ms['meter']:.0f} ms")
+
+            # Extract and process relevant data
+            self.copy_data(inverter_data, meter_data)
         except requests.exceptions.Timeout:
             logging.error(f"Fronius device: Timeout requesting "
                           f"'{self.url_inverter}' or '{self.url_meter}'")
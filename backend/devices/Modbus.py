@@ -1,15 +1,21 @@
+import asyncio
 import logging
 import time
 from pymodbus.client import ModbusTcpClient, ModbusSerialClient
-from pymodbus.constants import Endian
-from pymodbus.payload import BinaryPayloadDecoder
+
+# Project imports
+from devices import modbus_plan
+from devices import modbus_async
+from devices import rtu_bus
 
 
 class Modbus:
     def __init__(self, config):
         # Get configuration from config file
         modbus_config = config.config_data['modbus']
-        self.connection_type = modbus_config.get('connection_type', 'tcp')  # 'tcp' or 'rtu'
+        self.connection_type = modbus_config.get('connection_type', 'tcp')  # 'tcp', 'tcp_async' or 'rtu'
+        self.is_async = self.connection_type.lower() == 'tcp_async'
+        self.is_rtu = self.connection_type.lower() == 'rtu'
         
         # TCP connection parameters
         self.host = modbus_config.get('host', '192.168.1.100')
@@ -21,10 +27,16 @@ class Modbus:
         self.parity = modbus_config.get('parity', 'N')
         self.stopbits = modbus_config.get('stopbits', 1)
         self.bytesize = modbus_config.get('bytesize', 8)
+        # Units on a shared RTU bus are polled in the background
+        self.priority = modbus_config.get('priority', rtu_bus.DEFAULT_PRIORITY)
+        grabber_config = config.config_data.get('grabber') or {}
+        self.poll_s = modbus_config.get('poll_s', grabber_config.get('interval_s', 5))
         
         # Common Modbus parameters
         self.unit_id = modbus_config.get('unit_id', 1)
         self.timeout = modbus_config.get('timeout', 3)
+        # Requests in flight on an async connection
+        self.max_pipeline = modbus_config.get('max_pipeline', modbus_async.DEFAULT_MAX_PIPELINE)
         
         # Register mapping - these will vary by inverter model
         self.register_map = modbus_config.get('register_map', {
@@ -39,6 +51,16 @@ class Modbus:
         # Endianness configuration
         self.word_order = modbus_config.get('word_order', 'big')
         self.byte_order = modbus_config.get('byte_order', 'big')
+
+        # Registers are read in as few contiguous blocks as possible
+        self.read_plan = modbus_plan.plan_reads(
+            self.register_map,
+            modbus_config.get('max_gap', modbus_plan.DEFAULT_MAX_GAP),
+            modbus_config.get('max_block_size', modbus_plan.DEFAULT_MAX_BLOCK_SIZE))
+        # The decoding of each block is compiled once, too
+        modbus_plan.compile_blocks(self.read_plan, self.byte_order, self.word_order)
+        logging.info(f"Modbus device: reading {len(self.register_map)} registers "
+                     f"in {len(self.read_plan)} block(s)")
         
         # Initialize data values
         self.total_energy_produced_kwh = 0.0
@@ -52,6 +74,12 @@ class Modbus:
         
         # Initialize client
         self.client = self._create_client()
+        if self.is_rtu:
+            self.bus_unit = self.client.add_unit(
+                self.unit_id, self.register_map, self.priority, self.poll_s,
+                modbus_config.get('max_gap', modbus_plan.DEFAULT_MAX_GAP),
+                modbus_config.get('max_block_size', modbus_plan.DEFAULT_MAX_BLOCK_SIZE),
+                self.byte_order, self.word_order)
         
         # Test connection by doing an initial update
         try:
@@ -61,6 +89,16 @@ class Modbus:
             logging.error(f"Modbus device: Error connecting to the device: {str(e)}")
             raise
     
+    @property
+    def poll_timeout_s(self):
+        """Seconds an update may take."""
+        if self.is_async:
+            return self.timeout * 2
+        if self.is_rtu:
+            return self.timeout
+        # The blocks are read one after another
+        return self.timeout * len(self.read_plan)
+
     def _create_client(self):
         """Create and return the appropriate Modbus client based on connection type."""
         if self.connection_type.lower() == 'tcp':
@@ -70,9 +108,21 @@ class Modbus:
                 port=self.port,
                 timeout=self.timeout
             )
-        elif self.connection_type.lower() == 'rtu':
-            logging.info(f"Modbus device: Creating RTU client for {self.port_name}")
-            return ModbusSerialClient(
+        elif self.is_async:
+            # Devices behind the same gateway share one persistent connection
+            logging.info(f"Modbus device: Using async TCP connection to {self.host}:{self.port}")
+            return modbus_async.get_connection(
+                self.host, self.port, self.timeout, self.max_pipeline)
+        elif self.is_rtu:
+            # All units on the same serial port share one bus scheduler
+            return rtu_bus.get_bus(self.port_name, self.baudrate, self._create_serial_client)
+        else:
+            raise ValueError(f"Unsupported Modbus connection type: {self.connection_type}")
+
+    def _create_serial_client(self):
+        """Create the client of the serial port."""
+        logging.info(f"Modbus device: Creating RTU client for {self.port_name}")
+        return ModbusSerialClient(
                 method='rtu',
                 port=self.port_name,
                 baudrate=self.baudrate,
@@ -81,94 +131,124 @@ class Modbus:
                 bytesize=self.bytesize,
                 timeout=self.timeout
             )
-        else:
-            raise ValueError(f"Unsupported Modbus connection type: {self.connection_type}")
-    
-    def _get_endian(self, order):
-        """Convert string endian specification to Endian enum."""
-        if order.lower() == 'big':
-            return Endian.BIG
-        elif order.lower() == 'little':
-            return Endian.LITTLE
-        else:
-            raise ValueError(f"Invalid endian order: {order}")
     
-    def _read_register(self, register_config):
-        """Read a register based on its configuration."""
-        address = register_config['address']
-        length = register_config['length']
-        data_type = register_config['type']
-        scale = register_config.get('scale', 1.0)
-        
-        # Read holding registers
-        result = self.client.read_holding_registers(address, length, slave=self.unit_id)
-        
+    def _read_block(self, block):
+        """Read the registers of a block from its register table."""
+        if block.table == modbus_plan.INPUT:
+            return self.client.read_input_registers(block.address, block.count, slave=self.unit_id)
+        return self.client.read_holding_registers(block.address, block.count, slave=self.unit_id)
+
+    def _read_values(self):
+        """Read all registers of the map. Returns the decoded values by name."""
+        values = {}
+        read_plan = []
+        for block in self.read_plan:
+            result = self._read_block(block)
+            if modbus_plan.is_illegal_address(result) and len(block.entries) > 1:
+                # Some devices reject reads of unmapped registers in a gap,
+                # read the registers of this block one by one from now on
+                logging.warning(f"Modbus device: block read at address {block.address} "
+                                f"failed ({result}), splitting it up")
+                singles = modbus_plan.split_block(block)
+                for single in singles:
+                    values.update(self._decode(single, self._read_block(single)))
+                read_plan.extend(singles)
+                continue
+            values.update(self._decode(block, result))
+            read_plan.append(block)
+        self.read_plan = read_plan
+        return values
+
+    def _read_values_async(self):
+        """Read all blocks at once over the async connection."""
+        return modbus_async.run(self._read_blocks_async(), self.timeout * 2)
+
+    async def _read_blocks_async(self):
+        """Pipeline the reads of all blocks. Returns the decoded values by name."""
+        async def read(block):
+            function_code = modbus_async.READ_HOLDING_REGISTERS
+            if block.table == modbus_plan.INPUT:
+                function_code = modbus_async.READ_INPUT_REGISTERS
+            return await self.client.read_registers(
+                function_code, self.unit_id, block.address, block.count)
+
+        results = await asyncio.gather(
+            *(read(block) for block in self.read_plan), return_exceptions=True)
+        values = {}
+        read_plan = []
+        for block, result in zip(self.read_plan, results):
+            if modbus_plan.is_illegal_address(result) and len(block.entries) > 1:
+                # Same fallback as _read_values
+                logging.warning(f"Modbus device: block read at address {block.address} "
+                                f"failed ({result}), splitting it up")
+                singles = modbus_plan.split_block(block)
+                for single, registers in zip(singles, await asyncio.gather(
+                        *(read(single) for single in singles))):
+                    values.update(modbus_plan.decode_block(single, registers))
+                read_plan.extend(singles)
+                continue
+            if isinstance(result, Exception):
+                raise result
+            values.update(modbus_plan.decode_block(block, result))
+            read_plan.append(block)
+        self.read_plan = read_plan
+        return values
+
+    def _decode(self, block, result):
+        """Decode all values of a block from its read response."""
         if result.isError():
-            raise Exception(f"Error reading register at address {address}: {result}")
-        
-        # Decode the result based on data type
-        decoder = BinaryPayloadDecoder.fromRegisters(
-            result.registers,
-            byteorder=self._get_endian(self.byte_order),
-            wordorder=self._get_endian(self.word_order)
-        )
-        
-        # Extract value based on data type
-        if data_type == 'uint16':
-            value = decoder.decode_16bit_uint()
-        elif data_type == 'int16':
-            value = decoder.decode_16bit_int()
-        elif data_type == 'uint32':
-            value = decoder.decode_32bit_uint()
-        elif data_type == 'int32':
-            value = decoder.decode_32bit_int()
-        elif data_type == 'float32':
-            value = decoder.decode_32bit_float()
-        else:
-            raise ValueError(f"Unsupported data type: {data_type}")
-        
-        # Apply scaling factor
-        return value * scale
+            raise Exception(f"Error reading register at address {block.address}: {result}")
+        return modbus_plan.decode_block(block, result.registers)
     
     def update(self):
         """Updates all device stats by reading from Modbus registers."""
         try:
-            # Connect if not connected
-            if not self.client.connected:
-                self.client.connect()
-                # Small delay to ensure connection is established
-                time.sleep(0.1)
-            
-            # Read all configured registers
-            register_map = self.register_map
+            if self.is_async:
+                # The connection reconnects by itself, with backoff
+                values = self._read_values_async()
+            elif self.is_rtu:
+                # Latest values polled by the bus, waits for the first ones
+                if not self.bus_unit.ready.wait(self.timeout):
+                    raise ConnectionError(f"Unit {self.unit_id} on {self.port_name} did not answer")
+                values = self.bus_unit.get_values()
+            else:
+                # Connect if not connected
+                if not self.client.connected:
+                    self.client.connect()
+                    # Small delay to ensure connection is established
+                    time.sleep(0.1)
+
+                # Read all configured registers
+                values = self._read_values()
             
             # Read total energy produced
-            if 'total_energy_produced' in register_map:
-                self.total_energy_produced_kwh = self._read_register(register_map['total_energy_produced'])
+            if 'total_energy_produced' in values:
+                self.total_energy_produced_kwh = values['total_energy_produced']
             
             # Read total energy consumed (if available)
-            if 'total_energy_consumed' in register_map:
-                self.total_energy_consumed_kwh = self._read_register(register_map['total_energy_consumed'])
+            if 'total_energy_consumed' in values:
+                self.total_energy_consumed_kwh = values['total_energy_consumed']
             
             # Read total energy fed in (if available)
-            if 'total_energy_fed_in' in register_map:
-                self.total_energy_fed_in_kwh = self._read_register(register_map['total_energy_fed_in'])
+            if 'total_energy_fed_in' in values:
+                self.total_energy_fed_in_kwh = values['total_energy_fed_in']
             
             # Read current power produced
-            if 'current_power_produced' in register_map:
-                self.current_power_produced_kw = self._read_register(register_map['current_power_produced'])
+            if 'current_power_produced' in values:
+                self.current_power_produced_kw = values['current_power_produced']
             
             # Read current power consumed from grid (if available)
-            if 'current_power_consumed_grid' in register_map:
-                self.current_power_consumed_from_grid_kw = self._read_register(register_map['current_power_consumed_grid'])
+            self.current_power_fed_in_kw = 0
+            if 'current_power_consumed_grid' in values:
+                self.current_power_consumed_from_grid_kw = values['current_power_consumed_grid']
                 # Some inverters report negative values for power fed to grid
                 if self.current_power_consumed_from_grid_kw < 0:
                     self.current_power_fed_in_kw = -self.current_power_consumed_from_grid_kw
                     self.current_power_consumed_from_grid_kw = 0
             
             # Read current power fed in (if available as separate register)
-            if 'current_power_fed_in' in register_map and self.current_power_fed_in_kw == 0:
-                self.current_power_fed_in_kw = self._read_register(register_map['current_power_fed_in'])
+            if 'current_power_fed_in' in values and self.current_power_fed_in_kw == 0:
+                self.current_power_fed_in_kw = values['current_power_fed_in']
             
             # Calculate derived values
             # Power consumed from PV = Power produced - Power fed in
@@ -194,6 +274,6 @@ class Modbus:
         except Exception as e:
             logging.error(f"Modbus device: Error updating data: {str(e)}")
             # Try to close the connection to clean up
-            if self.client.connected:
+            if self.connection_type.lower() == 'tcp' and self.client.connected:
                 self.client.close()
             raise 
\ No newline at end of file
@@ -0,0 +1,192 @@
+import time
+import random
+import struct
+import asyncio
+import logging
+import threading
+
+
+# Modbus function codes
+READ_HOLDING_REGISTERS = 3
+READ_INPUT_REGISTERS = 4
+
+# Requests that may be sent before the first response arrives
+DEFAULT_MAX_PIPELINE = 4
+
+# Delays between two connection attempts in seconds
+BACKOFF_MIN_S = 0.1
+BACKOFF_MAX_S = 30.0
+
+# Timeouts in a row after which the connection counts as half open and is
+# closed, so it is opened again with the usual backoff
+MAX_CONSECUTIVE_TIMEOUTS = 3
+
+# Modbus TCP header: transaction id, protocol id, length, unit id
+MBAP = struct.Struct(">HHHB")
+# Read request: function code, address, count
+READ_REQUEST = struct.Struct(">BHH")
+
+
+# Exception response of a Modbus device
+class ModbusError(Exception):
+    def __init__(self, message, exception_code):
+        super().__init__(message)
+        self.exception_code = exception_code
+
+
+# Event loop shared by all async connections, running in its own thread
+loop = None
+loop_lock = threading.Lock()
+
+# Connections by (host, port), shared by devices behind the same gateway
+connections = {}
+
+
+# Returns the shared event loop, starting it on first use
+def get_loop():
+    '''Returns the shared event loop, starting it on first use.'''
+    global loop
+    with loop_lock:
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="modbus", daemon=True).start()
+        return loop
+
+
+# Runs a coroutine on the shared event loop and returns its result
+def run(coroutine, timeout_s=None):
+    '''Runs a coroutine on the shared event loop and returns its result.'''
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop()).result(timeout_s)
+
+
+# Returns the connection to the given end point, creating it on first use
+def get_connection(host, port, timeout_s, max_pipeline=DEFAULT_MAX_PIPELINE):
+    '''Returns the connection to the given end point, creating it on first use.'''
+    with loop_lock:
+        key = (host, port)
+        if key not in connections:
+            connections[key] = AsyncModbusConnection(host, port, timeout_s, max_pipeline)
+        return connections[key]
+
+
+# Persistent Modbus TCP connection. Requests are pipelined and matched to
+# their responses by the transaction id of the Modbus TCP header.
+class AsyncModbusConnection:
+    def __init__(
+            self,
+            host,
+            port,
+            timeout_s,
+            max_pipeline=DEFAULT_MAX_PIPELINE,
+            clock=time.monotonic,
+            jitter=random.uniform):
+        self.host = host
+        self.port = port
+        self.timeout_s = timeout_s
+        self.clock = clock
+        self.jitter = jitter
+        self.pipeline = asyncio.Semaphore(max_pipeline)
+        self.connect_lock = asyncio.Lock()
+        self.writer = None
+        self.pending = {}  # Response futures by transaction id
+        self.last_transaction_id = 0
+
+        # Reconnection with exponential backoff
+        self.backoff_s = 0.0
+        self.next_attempt = 0.0
+
+        # Statistics
+        self.num_connects = 0
+        self.num_requests = 0
+        self.num_timeouts = 0
+        self.consecutive_timeouts = 0
+
+    @property
+    def connected(self):
+        return self.writer is not None
+
+    async def connect(self):
+        '''Opens the connection unless it is open or backing off.'''
+        async with self.connect_lock:
+            if self.writer is not None:
+                return
+            wait_s = self.next_attempt - self.clock()
+            if wait_s > 0:
+                raise ConnectionError(f"Modbus connection to {self.host}:{self.port} "
+                                      f"is down, next attempt in {wait_s:.1f} s")
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout_s)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.back_off()
+                raise ConnectionError(f"Connecting to {self.host}:{self.port} failed: {e}") from e
+            self.writer = writer
+            self.backoff_s = 0.0
+            self.num_connects += 1
+            asyncio.get_running_loop().create_task(self.receive(reader, writer))
+            logging.info(f"Modbus device: connected to {self.host}:{self.port}")
+
+    def back_off(self):
+        '''Schedules the next connection attempt with exponential backoff and jitter.'''
+        self.backoff_s = min(BACKOFF_MAX_S, max(BACKOFF_MIN_S, self.backoff_s * 2.0))
+        # Full jitter keeps devices behind one gateway from reconnecting in lockstep
+        self.next_attempt = self.clock() + self.jitter(0.0, self.backoff_s)
+
+    def drop(self, writer, error):
+        '''Closes a broken connection and fails all requests waiting on it.'''
+        if writer is not self.writer:
+            return
+        logging.warning(f"Modbus device: connection to {self.host}:{self.port} lost: {error}")
+        self.writer = None
+        writer.close()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Connection lost: {error}"))
+        self.pending.clear()
+        self.back_off()
+
+    async def receive(self, reader, writer):
+        '''Hands the responses to the requests waiting for them.'''
+        try:
+            while True:
+                transaction_id, _, length, _ = MBAP.unpack(await reader.readexactly(MBAP.size))
+                pdu = await reader.readexactly(length - 1)
+                future = self.pending.pop(transaction_id, None)
+                if future is not None and not future.done():
+                    future.set_result(pdu)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self.drop(writer, e)
+
+    async def read_registers(self, function_code, unit_id, address, count):
+        '''Reads a block of registers. Returns the register values.'''
+        async with self.pipeline:
+            await self.connect()
+            self.last_transaction_id = self.last_transaction_id % 0xFFFF + 1
+            transaction_id = self.last_transaction_id
+            future = asyncio.get_running_loop().create_future()
+            self.pending[transaction_id] = future
+            self.writer.write(MBAP.pack(transaction_id, 0, READ_REQUEST.size + 1, unit_id)
+                              + READ_REQUEST.pack(function_code, address, count))
+            self.num_requests += 1
+            try:
+                pdu = await asyncio.wait_for(future, self.timeout_s)
+            except asyncio.TimeoutError:
+                # A late response is dropped, the connection stays open
+                # unless it has stopped answering at all
+                self.pending.pop(transaction_id, None)
+                self.num_timeouts += 1
+                self.consecutive_timeouts += 1
+                if self.consecutive_timeouts >= MAX_CONSECUTIVE_TIMEOUTS and self.writer is not None:
+                    self.consecutive_timeouts = 0
+                    self.drop(self.writer, f"{MAX_CONSECUTIVE_TIMEOUTS} timeouts in a row")
+                raise TimeoutError(f"No response from unit {unit_id} for address {address}")
+            self.consecutive_timeouts = 0
+        if pdu[0] & 0x80:
+            raise ModbusError(f"Unit {unit_id} returned exception code {pdu[1]} "
+                              f"for address {address}", pdu[1])
+        return list(struct.unpack(f">{pdu[1] // 2}H", pdu[2:2 + pdu[1]]))
+
+    async def close(self):
+        '''Closes the connection.'''
+        if self.writer is not None:
+            self.drop(self.writer, "closed")
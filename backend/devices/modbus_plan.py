@@ -0,0 +1,148 @@
+import struct
+from operator import itemgetter
+
+
+# Register tables that can be read
+HOLDING = "holding"
+INPUT = "input"
+TABLES = [HOLDING, INPUT]
+
+# Unmapped registers that may be read to join two blocks
+DEFAULT_MAX_GAP = 10
+# Modbus allows at most 125 registers per read request
+DEFAULT_MAX_BLOCK_SIZE = 125
+# Exception code of a device that rejects a read of unmapped registers
+ILLEGAL_DATA_ADDRESS = 2
+
+# Struct format and number of registers of each data type
+DATA_TYPES = {
+    'uint16': ('H', 1),
+    'int16': ('h', 1),
+    'uint32': ('I', 2),
+    'int32': ('i', 2),
+    'float32': ('f', 2),
+    'uint64': ('Q', 4),
+    'int64': ('q', 4),
+    'float64': ('d', 4),
+}
+
+
+# One contiguous read of registers, holding the entries decoded from it
+class Block:
+    def __init__(self, table, address, count):
+        self.table = table
+        self.address = address
+        self.count = count
+        self.entries = []  # (name, register config)
+        self.decode_plan = None
+
+    def __repr__(self):
+        return f"Block({self.table}, {self.address}, {self.count})"
+
+
+# Groups the registers of the map into the fewest contiguous block reads
+def plan_reads(register_map, max_gap=DEFAULT_MAX_GAP, max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    '''Groups the registers of the map into the fewest contiguous block reads.'''
+    for register_config in register_map.values():
+        if register_config.get('table', HOLDING) not in TABLES:
+            raise ValueError(f"Unsupported register table: {register_config['table']}")
+    blocks = []
+    for table in TABLES:
+        registers = sorted(
+            ((name, register_config) for name, register_config in register_map.items()
+             if register_config.get('table', HOLDING) == table),
+            key=lambda register: register[1]['address'])
+        block = None
+        for name, register_config in registers:
+            address = register_config['address']
+            end = address + register_config['length']
+            if (block is not None
+                    and address - (block.address + block.count) <= max_gap
+                    and max(end, block.address + block.count) - block.address <= max_block_size):
+                # Extend the current block
+                block.count = max(end, block.address + block.count) - block.address
+            else:
+                block = Block(table, address, register_config['length'])
+                blocks.append(block)
+            block.entries.append((name, register_config))
+    return blocks
+
+
+# Makes sure the given byte or word order is supported
+def check_order(order):
+    '''Makes sure the given byte or word order is supported.'''
+    if order.lower() not in ('big', 'little'):
+        raise ValueError(f"Invalid endian order: {order}")
+    return order.lower()
+
+
+# Values of a block, compiled once into struct formats, offsets and scales
+class DecodePlan:
+    def __init__(self, block, byte_order, word_order):
+        self.byte_order = byte_order = check_order(byte_order)
+        self.word_order = word_order
+        indices = []
+        formats = []
+        self.names = []
+        self.scales = []
+        for name, register_config in block.entries:
+            data_type = register_config['type']
+            if data_type not in DATA_TYPES:
+                raise ValueError(f"Unsupported data type: {data_type}")
+            value_format, length = DATA_TYPES[data_type]
+            if register_config['length'] < length:
+                raise ValueError(f"Register '{name}' is too short for {data_type}")
+            # Register indices of the value, most significant word first
+            offset = register_config['address'] - block.address
+            words = list(range(offset, offset + length))
+            if check_order(register_config.get('word_order', word_order)) == 'little':
+                words.reverse()
+            indices.extend(words)
+            formats.append(value_format)
+            self.names.append(name)
+            self.scales.append(register_config.get('scale', 1.0))
+
+        # Picks the words of all values in order from the block response
+        self.get_words = itemgetter(*indices) if len(indices) > 1 else lambda registers: (registers[indices[0]],)
+        # Packing little endian words swaps the bytes of each register
+        self.words = struct.Struct(("<" if byte_order == 'little' else ">") + f"{len(indices)}H")
+        self.values = struct.Struct(">" + "".join(formats))
+
+    def decode(self, registers):
+        '''Decodes all values from the registers of the block in one pass.'''
+        values = self.values.unpack(self.words.pack(*self.get_words(registers)))
+        return {name: value * scale for name, value, scale in zip(self.names, values, self.scales)}
+
+
+# Compiles the decode plans of the given blocks
+def compile_blocks(blocks, byte_order, word_order):
+    '''Compiles the decode plans of the given blocks.'''
+    for block in blocks:
+        block.decode_plan = DecodePlan(block, byte_order, word_order)
+    return blocks
+
+
+# Decodes all values of a block from the registers of its read response
+def decode_block(block, registers):
+    '''Decodes all values of a block from the registers of its read response.'''
+    return block.decode_plan.decode(registers)
+
+
+# Splits a block into one block per register
+def split_block(block):
+    '''Splits a block into one block per register.'''
+    blocks = []
+    for name, register_config in block.entries:
+        single = Block(block.table, register_config['address'], register_config['length'])
+        single.entries.append((name, register_config))
+        single.decode_plan = None if block.decode_plan is None else DecodePlan(
+            single, block.decode_plan.byte_order, block.decode_plan.word_order)
+        blocks.append(single)
+    return blocks
+
+
+# Returns True if a block read was rejected for its addresses. Only then
+# splitting the block helps, a timeout says nothing about the registers.
+def is_illegal_address(result):
+    '''Returns True if a block read was rejected for its addresses.'''
+    return getattr(result, 'exception_code', None) == ILLEGAL_DATA_ADDRESS
@@ -0,0 +1,221 @@
+import time
+import logging
+import threading
+
+# Project imports
+from devices import modbus_plan
+
+
+# Lowest priority, used if a unit does not set one
+DEFAULT_PRIORITY = 0
+
+# Poll intervals without a good read after which the values of a job are
+# stale and the unit counts as not answering
+STALE_POLLS = 3
+
+# Seconds between two log lines with the bus statistics
+STATS_LOG_INTERVAL_S = 300.0
+
+# Buses by serial port name, shared by all units on the same RS485 line
+buses = {}
+buses_lock = threading.Lock()
+
+
+# Returns the silent interval between two RTU frames in seconds
+def get_silent_interval_s(baudrate):
+    '''Returns the silent interval between two RTU frames in seconds.'''
+    # 3.5 characters of 11 bits, fixed to 1.75 ms above 19200 baud
+    if baudrate > 19200:
+        return 0.00175
+    return 3.5 * 11.0 / baudrate
+
+
+# Returns the bus of the given serial port, creating it on first use
+def get_bus(port_name, baudrate, create_client):
+    '''Returns the bus of the given serial port, creating it on first use.'''
+    with buses_lock:
+        if port_name not in buses:
+            buses[port_name] = RtuBus(create_client(), baudrate)
+            buses[port_name].start()
+        return buses[port_name]
+
+
+# Block of registers of one unit that is read at its own rate
+class PollJob:
+    def __init__(self, unit, block, poll_s):
+        self.unit = unit
+        self.block = block
+        self.poll_s = poll_s
+        self.next_due = 0.0  # Poll right away
+        self.values = None  # Values of the last good read
+        self.last_read = None  # Time of the last good read
+
+
+# Slave on the bus with its poll jobs and statistics
+class BusUnit:
+    def __init__(self, unit_id, priority, clock=time.monotonic):
+        self.unit_id = unit_id
+        self.priority = priority
+        self.clock = clock
+        self.jobs = []
+        self.ready = threading.Event()  # Set once every job has values
+
+        # Statistics
+        self.num_reads = 0
+        self.num_errors = 0
+        self.latency_ms = 0.0  # Moving average
+        self.max_latency_ms = 0.0
+
+    def record(self, latency_ms, error):
+        '''Adds a read to the statistics.'''
+        self.num_reads += 1
+        if error:
+            self.num_errors += 1
+        self.latency_ms = latency_ms if self.num_reads == 1 else 0.9 * self.latency_ms + 0.1 * latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+
+    def get_error_rate(self):
+        '''Returns the share of failed reads.'''
+        return self.num_errors / self.num_reads if self.num_reads else 0.0
+
+    def get_values(self):
+        '''Returns the latest values of all registers of the unit.'''
+        values = {}
+        now = self.clock()
+        for job in self.jobs:
+            if job.values is None:
+                raise ConnectionError(f"Unit {self.unit_id} has not answered yet")
+            # A unit that stopped answering must not report frozen values
+            if now - job.last_read > STALE_POLLS * job.poll_s:
+                raise ConnectionError(f"Unit {self.unit_id} has not answered for "
+                                      f"{now - job.last_read:.0f} s")
+            values.update(job.values)
+        return values
+
+
+# Owns a serial port and polls the registers of all units on the bus. Each
+# job is due after its poll interval; among the due jobs the highest
+# priority goes first, then the one waiting longest.
+class RtuBus:
+    def __init__(self, client, baudrate, clock=time.monotonic, sleep=time.sleep):
+        self.client = client
+        self.silent_interval_s = get_silent_interval_s(baudrate)
+        self.clock = clock
+        self.sleep = sleep
+        self.units = []
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.last_frame_end = 0.0
+        self.last_stats_log = clock()
+        self.run = True
+
+    def add_unit(self, unit_id, register_map, priority, poll_s, max_gap, max_block_size,
+                 byte_order, word_order):
+        '''Adds a slave to the bus. Registers may set their own poll_s.'''
+        unit = BusUnit(unit_id, priority, self.clock)
+        # Registers of the same rate are read together
+        rates = {}
+        for name, register_config in register_map.items():
+            rates.setdefault(register_config.get('poll_s', poll_s), {})[name] = register_config
+        for rate, registers in sorted(rates.items()):
+            blocks = modbus_plan.plan_reads(registers, max_gap, max_block_size)
+            for block in modbus_plan.compile_blocks(blocks, byte_order, word_order):
+                unit.jobs.append(PollJob(unit, block, float(rate)))
+        with self.lock:
+            self.units.append(unit)
+            self.jobs.extend(unit.jobs)
+        logging.info(f"Modbus device: unit {unit_id} polls {len(unit.jobs)} block(s) "
+                     f"at {sorted(rates)} s")
+        return unit
+
+    def start(self):
+        '''Starts polling in a background thread.'''
+        threading.Thread(target=self.loop, name="rtu-bus", daemon=True).start()
+
+    def stop(self):
+        '''Stops polling.'''
+        self.run = False
+
+    def loop(self):
+        '''Polls the due jobs until stopped.'''
+        while self.run:
+            try:
+                self.sleep(self.step())
+            except Exception:
+                logging.exception("Modbus device: RTU bus poll failed")
+                self.sleep(1.0)
+
+    def step(self):
+        '''Runs the most important due job. Returns the seconds until the next one.'''
+        now = self.clock()
+        with self.lock:
+            due = [job for job in self.jobs if job.next_due <= now]
+            if not due:
+                next_due = min((job.next_due for job in self.jobs), default=now + 1.0)
+                return max(0.0, next_due - now)
+            job = max(due, key=lambda job: (job.unit.priority, -job.next_due))
+        self.poll(job)
+        # Missed polls are not made up, the bus would never catch up
+        job.next_due = max(job.next_due + job.poll_s, now)
+        self.log_stats()
+        return 0.0
+
+    def read(self, unit_id, block):
+        '''Reads a block. The silent interval must have passed.'''
+        try:
+            if not self.client.connected:
+                self.client.connect()
+            if block.table == modbus_plan.INPUT:
+                return self.client.read_input_registers(block.address, block.count, slave=unit_id)
+            return self.client.read_holding_registers(block.address, block.count, slave=unit_id)
+        finally:
+            self.last_frame_end = self.clock()
+
+    def poll(self, job):
+        '''Reads the block of a job and takes over its values.'''
+        unit = job.unit
+        # Keep the silent interval to the previous frame
+        silence_s = self.last_frame_end + self.silent_interval_s - self.clock()
+        if silence_s > 0:
+            self.sleep(silence_s)
+        start = self.clock()
+        try:
+            result = self.read(unit.unit_id, job.block)
+        except Exception as e:
+            result = e
+        unit.record((self.clock() - start) * 1000.0, isinstance(result, Exception) or result.isError())
+
+        if isinstance(result, Exception) or result.isError():
+            if modbus_plan.is_illegal_address(result) and len(job.block.entries) > 1:
+                # Some devices reject reads of unmapped registers in a gap
+                logging.warning(f"Modbus device: block read of unit {unit.unit_id} at address "
+                                f"{job.block.address} failed ({result}), splitting it up")
+                self.split(job)
+            else:
+                logging.error(f"Modbus device: reading unit {unit.unit_id} at address "
+                              f"{job.block.address} failed: {result}")
+            return
+        job.values = modbus_plan.decode_block(job.block, result.registers)
+        job.last_read = self.clock()
+        if all(job.values is not None for job in unit.jobs):
+            unit.ready.set()
+
+    def split(self, job):
+        '''Replaces a job by one job per register.'''
+        singles = [PollJob(job.unit, block, job.poll_s) for block in modbus_plan.split_block(job.block)]
+        with self.lock:
+            self.jobs.remove(job)
+            self.jobs.extend(singles)
+            job.unit.jobs.remove(job)
+            job.unit.jobs.extend(singles)
+
+    def log_stats(self):
+        '''Logs the latency and error rate of each unit now and then.'''
+        now = self.clock()
+        if now - self.last_stats_log < STATS_LOG_INTERVAL_S:
+            return
+        self.last_stats_log = now
+        for unit in self.units:
+            logging.info(f"Modbus device: unit {unit.unit_id}: {unit.num_reads} reads, "
+                         f"{unit.get_error_rate() * 100.0:.1f}% errors, "
+                         f"latency {unit.latency_ms:.0f} ms (max. {unit.max_latency_ms:.0f} ms)")
@@ -0,0 +1,117 @@
+import zlib
+
+# Project imports
+import history
+
+
+# Table of the minute power samples in CSV exports
+MINUTES = "minutes"
+EXPORT_TABLES = history.HISTORICAL_TABLES + [MINUTES]
+
+# Length of the keys of each table, longer range bounds are cut to it
+KEY_LENGTHS = {
+    "hours": 13,
+    "days": 10,
+    "months": 7,
+    "years": 4,
+    MINUTES: 10,
+}
+
+# Rows fetched from the data base and written per chunk
+CHUNK_ROWS = 1000
+GZIP_LEVEL = 6
+
+# Header of the exported energy counters and power samples
+COUNTER_HEADER = "date;production;consumption;feed_in\n"
+MINUTE_HEADER = "date;time;production;consumption;feed_in\n"
+
+
+# Returns the query and parameters selecting the rows of an export. The
+# range covers all keys from the start up to and including the ones
+# starting with the end, e.g. "2022-03" to "2022-04" are two months.
+def get_query(table, from_key="", to_key=""):
+    '''Returns the query and parameters selecting the rows of an export.'''
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table '{table}'")
+    if table == MINUTES:
+        query = "SELECT date, minute, produced, consumed, fed_in FROM high_res_samples"
+        order = " ORDER BY date, minute"
+    else:
+        query = f"SELECT * FROM {table}"
+        order = " ORDER BY date"
+    if table == "all_time":
+        return query, ()
+    conditions = []
+    parameters = []
+    key_length = KEY_LENGTHS[table]
+    if from_key:
+        conditions.append("date >= ?")
+        parameters.append(from_key[:key_length])
+    if to_key:
+        conditions.append("date < ?")
+        parameters.append(history.get_prefix_end(to_key[:key_length]))
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return query + order, tuple(parameters)
+
+
+# Yields the rows of a query in chunks, without loading all of them
+def iterate_chunks(db, query, parameters):
+    '''Yields the rows of a query in chunks, without loading all of them.'''
+    cursor = db.connection.cursor()
+    try:
+        cursor.execute(query, parameters)
+        while True:
+            rows = cursor.fetchmany(CHUNK_ROWS)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+
+# Formats the rows of an energy counter table
+def format_counter_rows(rows):
+    '''Formats the rows of an energy counter table.'''
+    return "".join(
+        f"{row[0]};{row[2] - row[1]};{row[4] - row[3]};{row[6] - row[5]}\n"
+        for row in rows)
+
+
+# Formats the rows of the minute power samples
+def format_minute_rows(rows):
+    '''Formats the rows of the minute power samples.'''
+    return "".join(
+        f"{row[0]};{row[1] // 60:02d}:{row[1] % 60:02d};{row[2]};{row[3]};{row[4]}\n"
+        for row in rows)
+
+
+# Yields the CSV text of an export chunk by chunk
+def generate_csv(db, table, from_key="", to_key=""):
+    '''Yields the CSV text of an export chunk by chunk.'''
+    # Checked before the first chunk, so errors can still be answered
+    query, parameters = get_query(table, from_key, to_key)
+
+    def chunks():
+        if table == MINUTES:
+            yield MINUTE_HEADER
+            format_rows = format_minute_rows
+        else:
+            yield COUNTER_HEADER
+            format_rows = format_counter_rows
+        for rows in iterate_chunks(db, query, parameters):
+            yield format_rows(rows)
+
+    return chunks()
+
+
+# Compresses text chunks into one gzip stream
+def gzip_chunks(chunks, level=GZIP_LEVEL):
+    '''Compresses text chunks into one gzip stream.'''
+    # wbits 31 writes the gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
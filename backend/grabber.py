@@ -1,24 +1,78 @@
 import os
+import copy
 import time
 import logging
 import importlib
 import signal
 from os.path import exists
-from datetime import date, datetime
+from datetime import datetime
 
 # Project imports
 from config import Config
-from database import Database
+from database import ConnectionManager
+import schema
+import device_pool
+import metrics
+import high_res
+import outbox
+import history
+import real_time
+import rollup
+import stats
 import version
+from scheduler import Scheduler, POLICY_SKIP
 
 
+# Data base file
+DB_FILE_NAME = "data/db.sqlite"
+
 # Real time (24h) data
-NUM_REAL_TIME_VALUES = 24*60  # 24h * 60 Minutes
-real_time_seconds_counter = 0
+last_minute_id = None  # Minute of the last real time capture
+retention = rollup.DEFAULT_RETENTION
+retention_date_string = None
+packed_date_string = None  # Last day checked by the packing of past days
+enqueued_hour_string = None  # Hour of the last check for completed hours
 config = None
+connections = ConnectionManager(DB_FILE_NAME)
+db = None
 run = True
 
 
+# Metrics of the grabber
+TICK_SECONDS = metrics.histogram(
+    "cpin_grabber_tick_seconds", "Duration of a grabber tick (poll and write)")
+WRITE_SECONDS = metrics.histogram(
+    "cpin_db_write_seconds", "Duration of the data base write stages of a tick", ["stage"])
+TICK_ERRORS = metrics.counter(
+    "cpin_grabber_tick_errors_total", "Ticks that failed")
+
+
+# Upsert statements. These are built once so sqlite3 can reuse the
+# prepared statements from its statement cache on every tick.
+UPSERT_HISTORICAL = {
+    name: (f"INSERT INTO {name} VALUES (?, ?, ?, ?, ?, ?, ?) "
+           f"ON CONFLICT(date) DO UPDATE SET "
+           f"produced_b = excluded.produced_b, "
+           f"consumed_b = excluded.consumed_b, "
+           f"fed_in_b = excluded.fed_in_b")
+    for name in history.HISTORICAL_TABLES
+}
+UPSERT_CURRENT = (
+    "INSERT INTO current VALUES ('cur', ?, ?, ?, ?, ?) "
+    "ON CONFLICT(date) DO UPDATE SET "
+    "produced = excluded.produced, "
+    "consumed_grid = excluded.consumed_grid, "
+    "consumed_pv = excluded.consumed_pv, "
+    "consumed_total = excluded.consumed_total, "
+    "fed_in = excluded.fed_in")
+UPSERT_HIGH_SCORE = (
+    "INSERT INTO highscores (type, date, value) "
+    "VALUES ('production', ?, ?) "
+    "ON CONFLICT(type) DO UPDATE SET "
+    "date = excluded.date, value = excluded.value "
+    "WHERE excluded.value > highscores.value")
+
+
 # Helper function to insert new values into the DB
 def insert_historical_values(
         db,
@@ -28,23 +82,9 @@ def insert_historical_values(
         consumed,
         fed_in):
     '''Helper function to insert new values into the DB.'''
-    query = f"SELECT * FROM {table_name} WHERE date='{date_string}'"
-    rows = db.execute(query)
-
-    if len(rows) == 0:
-        # Create new row
-        query = (f"INSERT INTO {table_name} VALUES ('{date_string}',"
-                 f"{str(produced)}, {str(produced)}, "
-                 f"{str(consumed)}, {str(consumed)}, "
-                 f"{str(fed_in)}, {str(fed_in)})")
-        db.execute(query)
-    else:
-        # Update existing row
-        query = (f"UPDATE {table_name} SET "
-                 f"produced_b = {str(produced)}, "
-                 f"consumed_b = {str(consumed)}, "
-                 f"fed_in_b = {str(fed_in)} WHERE date='{date_string}'")
-        db.execute(query)
+    db.execute(
+        UPSERT_HISTORICAL[table_name],
+        (date_string, produced, produced, consumed, consumed, fed_in, fed_in))
 
 
 # Helper function to insert current values into the DB
@@ -56,25 +96,9 @@ def insert_current_values(
         consumed_total,
         fed_in):
     '''Helper function to insert current values into the DB.'''
-    rows = db.execute("SELECT * FROM current WHERE date='cur'")
-
-    if len(rows) == 0:
-        # Create day row
-        query = (f"INSERT INTO current VALUES ('cur', "
-                 f"{str(produced)}, {str(consumed_grid)}, "
-                 f"{str(consumed_pv)}, {str(consumed_total)}, "
-                 f"{str(fed_in)})")
-        db.execute(query)
-    else:
-        # Update existing row
-        query = (f"UPDATE current SET "
-                 f"produced = {str(produced)}, "
-                 f"consumed_grid = {str(consumed_grid)}, "
-                 f"consumed_pv = {str(consumed_pv)}, "
-                 f"consumed_total = {str(consumed_total)}, "
-                 f"fed_in = {str(fed_in)} "
-                 f"WHERE date='cur'")
-        db.execute(query)
+    db.execute(
+        UPSERT_CURRENT,
+        (produced, consumed_grid, consumed_pv, consumed_total, fed_in))
 
 
 # Helper function to insert the high score values into the DB
@@ -83,143 +107,119 @@ def insert_high_scores(
         date_str,
         current_production_kw):
     '''Helper function to insert high score values into the DB.'''
-    # Make sure table exists
-    query = ("CREATE TABLE IF NOT EXISTS highscores "
-             "(type STRING PRIMARY KEY, date STRING, value REAL)")
-    db.execute(query)
-    # Get current value
-    query = "SELECT * FROM highscores WHERE type IS 'production'"
-    rows = db.execute(query)
-    if not rows:
-        cur_high_score_value = 0.0
-        query = ("INSERT INTO highscores (type,date,value) "
-                 "VALUES('production','...',0.0);")
-        db.execute(query)
-    else:
-        cur_high_score_value = rows[0][2]
-    # Check if we have a high score
-    if current_production_kw > cur_high_score_value:
-        query = (f"UPDATE highscores SET "
-                 f"value = {str(current_production_kw)}, "
-                 f"date = '{date_str}' WHERE type IS 'production'")
-        db.execute(query)
+    # Only replaces the stored value if the new one is higher
+    db.execute(UPSERT_HIGH_SCORE, (date_str, current_production_kw))
 
 
 # Helper function to insert new values into the DB
-def insert_real_time_values(db, time_string2, produced, consumed, fed_in):
+def insert_real_time_values(
+        db,
+        minute_id,
+        time_string2,
+        produced,
+        consumed,
+        fed_in):
     '''Helper function to insert new values into the DB.'''
-    # Insert new data
-    query = (f"INSERT INTO real_time (time, produced, consumed, fed_in) "
-             f"VALUES('{time_string2}', {produced}, {consumed}, {fed_in})")
-    db.execute(query)
-    # Limit data
-    query = (f"DELETE FROM real_time WHERE ID IN ("
-             f"SELECT ID FROM real_time "
-             f"ORDER BY ID DESC "
-             f"LIMIT -1 OFFSET {NUM_REAL_TIME_VALUES})")
-    db.execute(query)
+    # Overwrites the ring buffer slot of this minute
+    real_time.insert_sample(
+        db, minute_id, time_string2, produced, consumed, fed_in)
 
 
 # Helper function to insert high res values into the DB
 def insert_high_res_values(
         db,
         day_string,
-        time_string,
+        minute,
         produced,
         consumed,
         fed_in):
     '''Helper function to insert high res values into the DB.'''
-    # Make sure table exists
-    query = ("create table if not exists high_res "
-             "(date STRING PRIMARY KEY, hrvalues STRING)")
-    db.execute(query)
-
-    # Get current entry
-    query = (f"SELECT * FROM high_res WHERE date='{day_string}'")
-    rows = db.execute(query)
-    old_values = ""
-    if not rows:
-        # Create new row
-        query = (f"INSERT INTO high_res (date,hrvalues) "
-                 f"VALUES ('{day_string}', '');")
-        db.execute(query)
-    else:
-        old_values = rows[0][1]
+    high_res.insert_sample(db, day_string, minute, produced, consumed, fed_in)
+    rollup.update_buckets(db, day_string, minute)
 
-    # Append new values to old values
-    new_value = (f"[\"{time_string}\","
-                 f"{str(round(produced, 3))},"
-                 f"{str(round(consumed, 3))},"
-                 f"{str(round(fed_in, 3))}],")
-    old_values += new_value
 
-    # Update DB
-    query = (f"UPDATE high_res SET "
-             f"hrvalues = '{old_values}' "
-             f"WHERE date='{day_string}'")
-    db.execute(query)
+# Helper function to remove expired data once per day
+def apply_retention(db, day_string):
+    '''Helper function to remove expired data once per day.'''
+    global retention_date_string
+    if day_string != retention_date_string:
+        rollup.apply_retention(db, retention)
+        retention_date_string = day_string
+
+
+# Helper function to queue the completed hours for the peaq storage
+def enqueue_completed_hours(db, now, hour_string):
+    '''Helper function to queue the completed hours for the peaq storage.'''
+    global enqueued_hour_string
+    # Once per hour, queued in the transaction of the tick that wrote the
+    # last counters, so no completed hour is lost
+    if hour_string != enqueued_hour_string:
+        num_enqueued = outbox.enqueue_completed_hours(db, now)
+        if num_enqueued:
+            logging.debug(f"Grabber: queued {num_enqueued} hours for the peaq storage")
+        enqueued_hour_string = hour_string
+
+
+# Helper function to pack the samples of the days that are over
+def pack_days(db, day_string):
+    '''Helper function to pack the samples of the days that are over.'''
+    global packed_date_string
+    # Starts from the oldest day after a restart and catches up over a
+    # few ticks, then checks once per tick if a day was completed
+    packed_date_string = high_res.pack_days(db, packed_date_string, day_string)
 
 
 # Helper function to create a new DB
 def create_new_db():
     '''Helper function to create a new DB.'''
-    new_db = Database("data/db.sqlite")
-
-    # Historical data tables
-    table_names = ["days", "months", "years", "all_time"]
-    for name in table_names:
-        query = (f"create table if not exists {name} ("
-                 "date STRING PRIMARY KEY,"
-                 "produced_a REAL, produced_b REAL,"
-                 "consumed_a REAL, consumed_b REAL,"
-                 "fed_in_a REAL, fed_in_b REAL)")
-        new_db.execute(query)
-
-    # Add initial all time row
-    query = ("INSERT INTO all_time VALUES ('all_time',0,0,0,0,0,0)")
-    new_db.execute(query)
-
-    # Current data table
-    query = ("create table if not exists current"
-             "(date STRING PRIMARY KEY, "
-             "produced REAL, consumed_grid REAL, consumed_pv REAL, "
-             "consumed_total REAL, fed_in REAL)")
-    new_db.execute(query)
-
-    # Real time data table
-    query = ("create table if not exists real_time"
-             "(ID INTEGER PRIMARY KEY AUTOINCREMENT, "
-             "time STRING, produced REAL, consumed REAL, fed_in REAL)")
-    new_db.execute(query)
-    # Insert null data
-    for x in range(NUM_REAL_TIME_VALUES):  # 24h * 60 minutes
-        query = (f"INSERT INTO real_time VALUES"
-                 f"('{str(x)}', '...', '0.0', '0.0', '0.0')")
-        new_db.execute(query)
-
-    # Add highscores
-    query = ("CREATE TABLE IF NOT EXISTS highscores "
-             "(type STRING PRIMARY KEY, date STRING, value REAL)")
-    new_db.execute(query)
-    query = ("INSERT INTO highscores (type,date,value) "
-             "VALUES('production','...',0.0);")
-    new_db.execute(query)
-
-    # Add high res data table
-    query = ("CREATE TABLE IF NOT EXISTS high_res "
-             "(date STRING PRIMARY KEY, hrvalues STRING)")
-    new_db.execute(query)
+    new_db = connections.writer()
+    with new_db.transaction():
+        schema.create(new_db)
 
 
 # Loads the device class with the given name
-def load_device_plugin(device_name):
+def load_device_plugin(device_name, device_config=None):
     '''Loads the device class with the given name.'''
     module = importlib.import_module("devices." + device_name)
     class_ = getattr(module, device_name)
-    device = class_(config)
+    device = class_(device_config or config)
     return device
 
 
+# Returns the configuration seen by one entry of the device list
+def get_device_config(entry):
+    '''Returns the configuration seen by one entry of the device list.'''
+    # Device specific sections of the entry (e.g. 'fronius:') replace the
+    # global ones, so each device adapter reads its own settings
+    device_config = copy.copy(config)
+    device_config.config_data = dict(config.config_data)
+    for key, value in entry.items():
+        if key not in ("type", "name", "timeout_s"):
+            device_config.config_data[key] = value
+    return device_config
+
+
+# Loads all configured devices into a device pool
+def load_devices():
+    '''Loads all configured devices into a device pool.'''
+    entries = config.config_data.get('devices')
+    if not entries:
+        # Single device configuration
+        device_config = config.config_data['device']
+        entries = [{'type': device_config['type'], 'timeout_s': device_config.get('timeout_s')}]
+    devices = []
+    for entry in entries:
+        device_type = entry['type']
+        name = entry.get('name', device_type)
+        if name in [device[0] for device in devices]:
+            raise ValueError(f"Device name '{name}' is used more than once")
+        logging.info(f"Grabber: Loading device adapter '{device_type}' as '{name}'")
+        device = load_device_plugin(device_type, get_device_config(entry))
+        timeout_s = device_pool.get_timeout_s(device, entry.get('timeout_s'))
+        devices.append((name, device_type, device, timeout_s))
+    return device_pool.DevicePool(devices)
+
+
 # Sets the time zone environment variable
 def set_time_zone(tz):
     '''Sets the time zone environment variable.'''
@@ -233,74 +233,127 @@ def set_time_zone(tz):
 
 
 # Updates data in the data base
-def update_data(device):
+def update_data(pool):
     '''Updates data in the data base.'''
-    global real_time_seconds_counter
-
-    # Download new data from the actual PV device
-    device.update()
-
-    # Open connection to data base
-    db = Database("data/db.sqlite")
+    with TICK_SECONDS.time():
+        # Download new data from all PV devices at once
+        pool.update()
+        if not pool.energy_complete:
+            logging.warning("Grabber: not every device answered yet, "
+                            "energy counters are not written")
+
+        # Write everything captured in this tick in one transaction
+        with db.transaction():
+            write_tick(pool, time.time(), pool.energy_complete)
+            with WRITE_SECONDS.time("devices"):
+                device_pool.insert_device_values(db, pool)
+            commit_start = time.perf_counter()
+        WRITE_SECONDS.observe("commit", seconds=time.perf_counter() - commit_start)
+
+
+# Writes the values of one tick to the data base. The energy counters are
+# only written once they are complete, the power values always.
+def write_tick(device, timestamp, write_energy=True):
+    '''Writes the values of one tick to the data base.'''
+    global last_minute_id
 
     # Time strings
-    year_string = date.today().strftime("%Y")
-    month_string = year_string + "-" + date.today().strftime("%m")
-    day_string = month_string + "-" + date.today().strftime("%d")
-
-    # Capture daily data
-    insert_historical_values(
-        db,
-        "days",
-        day_string,
-        device.total_energy_produced_kwh,
-        device.total_energy_consumed_kwh,
-        device.total_energy_fed_in_kwh)
-
-    # Capture monthly data
-    insert_historical_values(
-        db,
-        "months", month_string,
-        device.total_energy_produced_kwh,
-        device.total_energy_consumed_kwh,
-        device.total_energy_fed_in_kwh)
-
-    # Capture yearly data
-    insert_historical_values(
-        db,
-        "years",
-        year_string,
-        device.total_energy_produced_kwh,
-        device.total_energy_consumed_kwh,
-        device.total_energy_fed_in_kwh)
-
-    # Capture all time data
-    insert_historical_values(
-        db,
-        "all_time",
-        "all_time",
-        device.total_energy_produced_kwh,
-        device.total_energy_consumed_kwh,
-        device.total_energy_fed_in_kwh)
+    now = datetime.fromtimestamp(timestamp)
+    year_string = now.strftime("%Y")
+    month_string = year_string + "-" + now.strftime("%m")
+    day_string = month_string + "-" + now.strftime("%d")
+    hour_string = day_string + "-" + now.strftime("%H")
+
+    # Energy totals of a pool are unknown until every device answered
+    if write_energy:
+        with WRITE_SECONDS.time("historical"):
+            # Capture hourly data
+            insert_historical_values(
+                db,
+                "hours",
+                hour_string,
+                device.total_energy_produced_kwh,
+                device.total_energy_consumed_kwh,
+                device.total_energy_fed_in_kwh)
+
+            # Capture daily data
+            insert_historical_values(
+                db,
+                "days",
+                day_string,
+                device.total_energy_produced_kwh,
+                device.total_energy_consumed_kwh,
+                device.total_energy_fed_in_kwh)
+
+            # Capture monthly data
+            insert_historical_values(
+                db,
+                "months", month_string,
+                device.total_energy_produced_kwh,
+                device.total_energy_consumed_kwh,
+                device.total_energy_fed_in_kwh)
+
+            # Capture yearly data
+            insert_historical_values(
+                db,
+                "years",
+                year_string,
+                device.total_energy_produced_kwh,
+                device.total_energy_consumed_kwh,
+                device.total_energy_fed_in_kwh)
+
+            # Capture all time data
+            insert_historical_values(
+                db,
+                "all_time",
+                "all_time",
+                device.total_energy_produced_kwh,
+                device.total_energy_consumed_kwh,
+                device.total_energy_fed_in_kwh)
 
     # Store the current values
-    insert_current_values(
-        db,
-        device.current_power_produced_kw,
-        device.current_power_consumed_from_grid_kw,
-        device.current_power_consumed_from_pv_kw,
-        device.current_power_consumed_total_kw,
-        device.current_power_fed_in_kw)
+    with WRITE_SECONDS.time("current"):
+        insert_current_values(
+            db,
+            device.current_power_produced_kw,
+            device.current_power_consumed_from_grid_kw,
+            device.current_power_consumed_from_pv_kw,
+            device.current_power_consumed_total_kw,
+            device.current_power_fed_in_kw)
 
     # Store the high scores
-    insert_high_scores(db, day_string, device.current_power_produced_kw)
+    with WRITE_SECONDS.time("highscores"):
+        insert_high_scores(db, day_string, device.current_power_produced_kw)
+
+    # Keep the statistics up to date
+    if write_energy:
+        with WRITE_SECONDS.time("statistics"):
+            stats.update(
+                db,
+                day_string,
+                month_string,
+                year_string,
+                device.current_power_produced_kw,
+                device.total_energy_produced_kwh)
+
+        # Hand the completed hours over to the peaq storage updater
+        with WRITE_SECONDS.time("outbox"):
+            enqueue_completed_hours(db, now, hour_string)
+
+    # Remove data that is older than its retention period
+    with WRITE_SECONDS.time("retention"):
+        apply_retention(db, day_string)
+
+    # Pack the samples of the days that are over for the analytics
+    with WRITE_SECONDS.time("packing"):
+        pack_days(db, day_string)
 
     # Store the real time data
-    real_time_seconds_counter = real_time_seconds_counter - \
-        config.config_data['grabber']['interval_s']
-    if real_time_seconds_counter <= 0:
+    # Capture once per wall clock minute, on the first tick of the minute
+    minute_id = real_time.current_minute_id(timestamp)
+    if minute_id != last_minute_id:
         # Time string
-        time_string = datetime.now().strftime("%H:%M")
+        time_string = now.strftime("%H:%M")
         # Store in data base
         if logging.getLogger().level == logging.DEBUG:
             logging.debug((f"Grabber: capturing real time data({time_string}:"
@@ -308,22 +361,25 @@ def update_data(device):
                            f"{device.current_power_consumed_total_kw}, "
                            f"{device.current_power_fed_in_kw})"))
 
-        insert_real_time_values(
-            db,
-            time_string,
-            device.current_power_produced_kw,
-            device.current_power_consumed_total_kw,
-            device.current_power_fed_in_kw)
+        with WRITE_SECONDS.time("real_time"):
+            insert_real_time_values(
+                db,
+                minute_id,
+                time_string,
+                device.current_power_produced_kw,
+                device.current_power_consumed_total_kw,
+                device.current_power_fed_in_kw)
 
-        insert_high_res_values(
-            db,
-            day_string,
-            time_string,
-            device.current_power_produced_kw,
-            device.current_power_consumed_total_kw,
-            device.current_power_fed_in_kw)
+        with WRITE_SECONDS.time("high_res"):
+            insert_high_res_values(
+                db,
+                day_string,
+                now.hour * 60 + now.minute,
+                device.current_power_produced_kw,
+                device.current_power_consumed_total_kw,
+                device.current_power_fed_in_kw)
 
-        real_time_seconds_counter = 60  # Reset counter to one minute
+        last_minute_id = minute_id
 
 
 # This is called when SIGTERM is received
@@ -337,6 +393,8 @@ def handler_stop_signals(signum, frame):
 def main():
     '''Main loop.'''
     global config
+    global db
+    global retention
     global run
 
     # Set up signal handlers
@@ -366,21 +424,35 @@ def main():
     # Set time zone
     set_time_zone(config.config_data.get("time_zone"))
 
-    # Dynamically load the device
+    # Retention of the power samples
+    retention = rollup.get_retention(config.config_data)
+
+    # Dynamically load the devices
     try:
-        device_name = config.config_data['device']['type']
-        logging.info(f"Grabber: Loading device adapter '{device_name}'")
-        device = load_device_plugin(device_name)
+        pool = load_devices()
     except Exception:
         logging.exception("creating the device adapter failed")
         exit()
 
     # Prepare the data base
     logging.info("Grabber: Checking if data base exists")
-    if not exists("data/db.sqlite"):
+    if not exists(DB_FILE_NAME):
         logging.info("Grabber: Data base does not exist. Creating new one")
         create_new_db()
 
+    # Keep the data base open for the whole runtime of the grabber
+    db = connections.writer()
+    schema.upgrade(db)
+    with db.transaction():
+        # Forget devices that are no longer configured
+        db.execute("DELETE FROM device_current")
+
+    # Ticks run on fixed deadlines, aligned to the wall clock
+    scheduler = Scheduler(
+        config.config_data['grabber']['interval_s'],
+        config.config_data['grabber'].get('overrun_policy', POLICY_SKIP))
+    scheduler.wait_for_first_tick()
+
     # Grabber main loop
     logging.debug("Grabber: Entering main loop")
     while run:
@@ -389,13 +461,19 @@ def main():
             logging.debug(f"Grabber: {time_string}: Updating device data")
 
         try:
-            update_data(device)
+            update_data(pool)
         except Exception:
+            TICK_ERRORS.inc()
             logging.exception("Updating data from device failed")
 
-        time.sleep(config.config_data['grabber']['interval_s'])
+        # Hand the metrics to the web server now and then
+        metrics.save(metrics.GRABBER_METRICS_FILE_NAME)
+
+        scheduler.wait()
 
     # Exit
+    pool.close()
+    connections.close()
     logging.info("Grabber: Exiting main loop")
     logging.info("Grabber: Shutting down gracefully")
 
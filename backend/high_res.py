@@ -0,0 +1,247 @@
+import sys
+import json
+import struct
+import logging
+from array import array
+from itertools import chain
+
+
+# High resolution data is stored as one row per day and minute
+CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS high_res_samples ("
+    "date TEXT, minute INTEGER, "
+    "produced REAL, consumed REAL, fed_in REAL, "
+    "PRIMARY KEY (date, minute)) WITHOUT ROWID")
+UPSERT_SAMPLE = (
+    "INSERT INTO high_res_samples VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT(date, minute) DO UPDATE SET "
+    "produced = excluded.produced, "
+    "consumed = excluded.consumed, "
+    "fed_in = excluded.fed_in")
+SELECT_DAY = (
+    "SELECT minute, produced, consumed, fed_in FROM high_res_samples "
+    "WHERE date = ? ORDER BY minute")
+SELECT_RANGE = (
+    "SELECT date, minute, produced, consumed, fed_in FROM high_res_samples "
+    "WHERE date >= ? AND date <= ? ORDER BY date, minute")
+
+# Samples of the days that are over, packed into one row per day as
+# little endian int16 minutes and float32 (produced, consumed, fed_in)
+# triples. Loading a long range of days for the analytics from these rows
+# is much faster than fetching a row per minute.
+CREATE_PACKED_TABLE = (
+    "CREATE TABLE IF NOT EXISTS high_res_packed ("
+    "date TEXT PRIMARY KEY, num_samples INTEGER, minutes BLOB, samples BLOB)")
+INSERT_PACKED = "INSERT OR REPLACE INTO high_res_packed VALUES (?, ?, ?, ?)"
+SELECT_NEXT_DAY = (
+    "SELECT MIN(date) FROM high_res_samples WHERE date > ? AND date < ?")
+
+# Days packed per call of pack_days(), so a backfill is spread over ticks
+PACK_DAYS_PER_CALL = 10
+
+# Compact binary format of the samples of several days (little endian):
+#   header: "CPHR", u8 version, u16 scale (per kW), u16 number of days
+#   per day: 10 bytes date "YYYY-MM-DD", u16 number of samples, then the
+#   minute, produced, consumed and fed_in columns one after another. Each
+#   column holds the differences to the previous value (starting at 0) as
+#   zigzag varints, values are multiplied by the scale and rounded.
+BINARY_MAGIC = b"CPHR"
+BINARY_VERSION = 1
+BINARY_SCALE = 1000  # kW -> W
+BINARY_HEADER = struct.Struct("<4sBHH")
+BINARY_DAY = struct.Struct("<10sH")
+
+
+# Converts a minute of the day to a "HH:MM" string
+def minute_to_time_string(minute):
+    '''Converts a minute of the day to a "HH:MM" string.'''
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+# Converts a "H:MM" or "HH:MM" string to the minute of the day
+def time_string_to_minute(time_string):
+    '''Converts a "H:MM" or "HH:MM" string to the minute of the day.'''
+    hours, minutes = time_string.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+# Creates the high res table if it does not exist
+def create_table(db):
+    '''Creates the high res table if it does not exist.'''
+    db.execute(CREATE_TABLE)
+
+
+# Creates the table of the packed days if it does not exist
+def create_packed_table(db):
+    '''Creates the table of the packed days if it does not exist.'''
+    db.execute(CREATE_PACKED_TABLE)
+
+
+# Stores one sample for the given day and minute
+def insert_sample(db, day_string, minute, produced, consumed, fed_in):
+    '''Stores one sample for the given day and minute.'''
+    db.execute(UPSERT_SAMPLE, (day_string, minute, produced, consumed, fed_in))
+
+
+# Returns all samples of a day as [time, produced, consumed, fed_in] lists
+def get_day(db, day_string):
+    '''Returns all samples of a day as [time, produced, consumed, fed_in] lists.'''
+    rows = db.execute(SELECT_DAY, (day_string,))
+    return [[minute_to_time_string(row[0]),
+             round(row[1], 3), round(row[2], 3), round(row[3], 3)]
+            for row in rows]
+
+
+# Returns the samples of a day as JSON string (or "" if there are none)
+def get_day_json(db, day_string):
+    '''Returns the samples of a day as JSON string (or "" if there are none).'''
+    samples = get_day(db, day_string)
+    if not samples:
+        return ""
+    return json.dumps(samples, separators=(",", ":"))
+
+
+# Appends the differences of consecutive values as zigzag varints
+def write_deltas(buffer, values):
+    '''Appends the differences of consecutive values as zigzag varints.'''
+    previous = 0
+    for value in values:
+        delta = value - previous
+        previous = value
+        # Zigzag maps small negative and positive numbers to small ones
+        delta = delta * 2 if delta >= 0 else -delta * 2 - 1
+        while delta >= 0x80:
+            buffer.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        buffer.append(delta)
+
+
+# Reads the given number of values written by write_deltas()
+def read_deltas(data, offset, count):
+    '''Reads the given number of values written by write_deltas().'''
+    values = []
+    previous = 0
+    for i in range(count):
+        delta = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            delta |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+        previous += (delta >> 1) ^ -(delta & 1)
+        values.append(previous)
+    return values, offset
+
+
+# Encodes (date, minute, produced, consumed, fed_in) rows ordered by date
+# and minute into the compact binary format
+def encode_binary(rows, scale=BINARY_SCALE):
+    '''Encodes rows ordered by date and minute into the compact binary format.'''
+    days = {}
+    for row in rows:
+        days.setdefault(row[0], []).append(row[1:])
+    buffer = bytearray(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, scale, len(days)))
+    for day_string, samples in days.items():
+        buffer += BINARY_DAY.pack(day_string.encode("ascii"), len(samples))
+        write_deltas(buffer, [sample[0] for sample in samples])
+        for column in range(1, 4):
+            write_deltas(buffer, [round(sample[column] * scale) for sample in samples])
+    return bytes(buffer)
+
+
+# Decodes the compact binary format into the samples of each day, in the
+# [time, produced, consumed, fed_in] form of get_day()
+def decode_binary(data):
+    '''Decodes the compact binary format into the samples of each day.'''
+    magic, version, scale, num_days = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("Not a compact high res data block")
+    offset = BINARY_HEADER.size
+    days = {}
+    for i in range(num_days):
+        day_string, count = BINARY_DAY.unpack_from(data, offset)
+        offset += BINARY_DAY.size
+        columns = []
+        for column in range(4):
+            values, offset = read_deltas(data, offset, count)
+            columns.append(values)
+        days[day_string.decode("ascii")] = [
+            [minute_to_time_string(minute), produced / scale, consumed / scale, fed_in / scale]
+            for minute, produced, consumed, fed_in in zip(*columns)]
+    return days
+
+
+# Returns the samples of a date range in the compact binary format
+def get_range_binary(db, from_string, to_string):
+    '''Returns the samples of a date range in the compact binary format.'''
+    return encode_binary(db.execute(SELECT_RANGE, (from_string, to_string)))
+
+
+# Packs the samples of a day that is over into one row
+def pack_day(db, day_string):
+    '''Packs the samples of a day that is over into one row.'''
+    rows = db.execute(SELECT_DAY, (day_string,))
+    minutes = array("h", (row[0] for row in rows))
+    samples = array("f", chain.from_iterable(row[1:] for row in rows))
+    if sys.byteorder == "big":
+        minutes.byteswap()
+        samples.byteswap()
+    db.execute(INSERT_PACKED, (day_string, len(rows), minutes.tobytes(), samples.tobytes()))
+
+
+# Packs the days with samples after one day (None: from the start) and
+# before another that are not packed yet, at most the given number per
+# call. Returns the last day that was checked.
+def pack_days(db, after_string, before_string, limit=PACK_DAYS_PER_CALL):
+    '''Packs the days with samples in a range that are not packed yet.'''
+    day_string = after_string
+    num_packed = 0
+    while num_packed < limit:
+        # Each step is an index seek, even for days that are packed already
+        next_string = db.execute(SELECT_NEXT_DAY, (day_string or "", before_string))[0][0]
+        if next_string is None:
+            break
+        day_string = next_string
+        if not db.execute("SELECT 1 FROM high_res_packed WHERE date = ?", (day_string,)):
+            pack_day(db, day_string)
+            num_packed += 1
+    if num_packed:
+        logging.debug(f"High res: packed {num_packed} days up to {day_string}")
+    return day_string
+
+
+# Parses the samples of a legacy high_res row
+def parse_legacy_values(day_string, hrvalues):
+    '''Parses the samples of a legacy high_res row.'''
+    try:
+        values = json.loads("[" + hrvalues.rstrip(",") + "]")
+    except ValueError:
+        logging.warning(f"High res: skipping malformed legacy data of {day_string}")
+        return
+    for value in values:
+        yield (day_string, time_string_to_minute(value[0]),
+               value[1], value[2], value[3])
+
+
+# Converts the legacy high_res table (one JSON string per day)
+def convert_legacy_table(db):
+    '''Converts the legacy high_res table (one JSON string per day).'''
+    rows = db.execute("SELECT name FROM sqlite_master "
+                      "WHERE type='table' AND name='high_res'")
+    if not rows:
+        return 0
+    create_table(db)
+    num_days = 0
+    # Fetch and convert one day at a time to keep memory usage flat
+    cursor = db.connection.execute("SELECT date, hrvalues FROM high_res")
+    for day_string, hrvalues in cursor:
+        if hrvalues:
+            # Later samples of the same minute overwrite earlier ones
+            db.executemany(UPSERT_SAMPLE, parse_legacy_values(str(day_string), hrvalues))
+        num_days += 1
+    db.execute("DROP TABLE high_res")
+    logging.info(f"High res: converted {num_days} days of legacy data")
+    return num_days
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+
+# Tables holding the a/b energy counters of a time period
+HISTORICAL_TABLES = ["hours", "days", "months", "years", "all_time"]
+
+# Hourly rows are keyed by "YYYY-MM-DD-HH"
+SELECT_LATEST_COMPLETED_HOUR = (
+    "SELECT * FROM hours WHERE date < ? ORDER BY date DESC LIMIT 1")
+SELECT_HOURS_SINCE = (
+    "SELECT * FROM hours WHERE date > ? AND date < ? ORDER BY date")
+
+
+# Returns the key of the hour containing the given time
+def get_hour_string(now=None):
+    '''Returns the key of the hour containing the given time.'''
+    if now is None:
+        now = datetime.now()
+    return now.strftime("%Y-%m-%d-%H")
+
+
+# Returns the row of the last hour before the current one (or None)
+def get_latest_completed_hour(db, now=None):
+    '''Returns the row of the last hour before the current one (or None).'''
+    rows = db.execute(SELECT_LATEST_COMPLETED_HOUR, (get_hour_string(now),))
+    return rows[0] if rows else None
+
+
+# Returns the rows of all completed hours after the given hour key
+def get_hours_since(db, hour_string, now=None):
+    '''Returns the rows of all completed hours after the given hour key.'''
+    return db.execute(SELECT_HOURS_SINCE, (hour_string, get_hour_string(now)))
+
+
+# Returns the exclusive upper bound of all keys starting with the prefix
+def get_prefix_end(prefix):
+    '''Returns the exclusive upper bound of all keys starting with the prefix.'''
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+# Makes sure the given name is one of the historical counter tables
+def check_table(table):
+    '''Makes sure the given name is one of the historical counter tables.'''
+    if table not in HISTORICAL_TABLES:
+        raise ValueError(f"Unknown historical table '{table}'")
+
+
+# Returns the row with the given key (or None)
+def get_row(db, table, key):
+    '''Returns the row with the given key (or None).'''
+    check_table(table)
+    rows = db.execute(f"SELECT * FROM {table} WHERE date = ?", (key,))
+    return rows[0] if rows else None
+
+
+# Returns all rows whose key starts with the prefix (all rows if empty)
+def get_rows(db, table, prefix=""):
+    '''Returns all rows whose key starts with the prefix (all rows if empty).'''
+    check_table(table)
+    if not prefix:
+        return db.execute(f"SELECT * FROM {table} ORDER BY date")
+    # A key range can be served from the primary key, unlike LIKE 'prefix%'
+    return db.execute(
+        f"SELECT * FROM {table} WHERE date >= ? AND date < ? ORDER BY date",
+        (prefix, get_prefix_end(prefix)))
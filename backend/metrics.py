@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Snapshot of the grabber metrics, read by the server
+GRABBER_METRICS_FILE_NAME = "data/metrics-grabber.json"
+SAVE_INTERVAL_S = 15.0
+
+# All metrics of this process by name
+registry = {}
+last_save = 0.0
+
+
+# Returns the label part of a sample line, e.g. {type="current"}
+def format_labels(label_names, label_values, extra=""):
+    '''Returns the label part of a sample line, e.g. {type="current"}.'''
+    labels = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+# Monotonically increasing count of events
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}  # Count by label values
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        '''Adds to the count of the given labels.'''
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get_samples(self):
+        '''Returns the sample lines in Prometheus text format.'''
+        return [f"{self.name}{format_labels(self.label_names, labels)} {value}"
+                for labels, value in sorted(self.values.items())]
+
+    def to_dict(self):
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+    def load(self, data):
+        self.values = {tuple(labels): value for labels, value in data}
+
+
+# Distribution of durations in fixed buckets
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}  # [bucket counts..., sum] by label values
+        self.lock = threading.Lock()
+
+    def observe(self, *label_values, seconds):
+        '''Adds a duration to the distribution of the given labels.'''
+        index = bisect_left(BUCKETS_S, seconds)
+        with self.lock:
+            values = self.values.get(label_values)
+            if values is None:
+                # One count per bucket plus +Inf, then the sum
+                values = self.values[label_values] = [0] * (len(BUCKETS_S) + 1) + [0.0]
+            values[index] += 1
+            values[-1] += seconds
+
+    @contextmanager
+    def time(self, *label_values):
+        '''Measures the duration of the with block.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*label_values, seconds=time.perf_counter() - start)
+
+    def get_samples(self):
+        '''Returns the sample lines in Prometheus text format.'''
+        lines = []
+        for labels, values in sorted(self.values.items()):
+            count = 0
+            for bound, bucket_count in zip(BUCKETS_S + ("+Inf",), values):
+                count += bucket_count
+                le = format_labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {values[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {count}")
+        return lines
+
+    def to_dict(self):
+        return [[list(labels), values] for labels, values in self.values.items()]
+
+    def load(self, data):
+        self.values = {tuple(labels): values for labels, values in data}
+
+
+# Registers a metric, or returns the one registered under its name
+def register(metric):
+    '''Registers a metric, or returns the one registered under its name.'''
+    return registry.setdefault(metric.name, metric)
+
+
+# Returns the counter with the given name
+def counter(name, help_text, label_names=()):
+    '''Returns the counter with the given name.'''
+    return register(Counter(name, help_text, label_names))
+
+
+# Returns the histogram with the given name
+def histogram(name, help_text, label_names=()):
+    '''Returns the histogram with the given name.'''
+    return register(Histogram(name, help_text, label_names))
+
+
+# Renders the given metrics in Prometheus text format
+def render(metrics):
+    '''Renders the given metrics in Prometheus text format.'''
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.get_samples())
+    return "\n".join(lines) + "\n"
+
+
+# Writes the metrics of this process to a file, at most every SAVE_INTERVAL_S
+def save(file_name, force=False):
+    '''Writes the metrics of this process to a file, at most every SAVE_INTERVAL_S.'''
+    global last_save
+    now = time.monotonic()
+    if not force and now - last_save < SAVE_INTERVAL_S:
+        return
+    last_save = now
+    data = [{"name": metric.name, "kind": metric.kind, "help": metric.help,
+             "labels": list(metric.label_names), "values": metric.to_dict()}
+            for metric in registry.values()]
+    try:
+        # Replace the file at once, so a reader never sees half of it
+        with open(file_name + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(data, file, separators=(",", ":"))
+        os.replace(file_name + ".tmp", file_name)
+    except OSError:
+        logging.exception("Metrics: saving the metrics failed")
+
+
+# Reads the metrics written by another process (empty if there are none)
+def load(file_name):
+    '''Reads the metrics written by another process (empty if there are none).'''
+    try:
+        with open(file_name, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return []
+    metrics = []
+    for entry in data:
+        class_ = Histogram if entry["kind"] == Histogram.kind else Counter
+        metric = class_(entry["name"], entry["help"], entry["labels"])
+        metric.load(entry["values"])
+        metrics.append(metric)
+    return metrics
+
+
+# Returns the metrics of this process together with those of another one
+def collect(file_name):
+    '''Returns the metrics of this process together with those of another one.'''
+    # Modules imported by both processes register the same metrics, each
+    # name is taken from the process that actually recorded something
+    merged = {name: metric for name, metric in registry.items() if metric.values}
+    for metric in load(file_name):
+        merged.setdefault(metric.name, metric)
+    return list(merged.values())
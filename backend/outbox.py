@@ -0,0 +1,230 @@
+import sys
+import json
+import time
+import logging
+from os.path import exists
+from collections.abc import Mapping
+
+# Project imports
+from database import Database
+import history
+
+
+# Submissions to the peaq storage, one per completed hour. The grabber
+# queues each hour when it is completed, the peaq storage updater sends
+# them. Each item is keyed by its storage item type, so an hour is never
+# queued twice.
+CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS outbox ("
+    "key TEXT PRIMARY KEY, hour TEXT, payload TEXT, status TEXT, "
+    "attempts INTEGER, next_attempt REAL, last_error TEXT, "
+    "enqueued TEXT, confirmed TEXT, confirmation TEXT) WITHOUT ROWID")
+CREATE_INDEX = (
+    "CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (hour) "
+    "WHERE status = 'pending'")
+INSERT_ITEM = (
+    "INSERT OR IGNORE INTO outbox VALUES "
+    "(?, ?, ?, 'pending', 0, 0.0, NULL, ?, NULL, NULL)")
+SELECT_DUE = (
+    "SELECT key, payload, attempts FROM outbox "
+    "WHERE status = 'pending' AND next_attempt <= ? ORDER BY hour LIMIT ?")
+
+# Item states: waiting to be sent, being sent, stored on the chain. An
+# item stays 'sending' if the process died during the transaction.
+PENDING = "pending"
+SENDING = "sending"
+CONFIRMED = "confirmed"
+
+# Seconds to wait before the next attempt, doubling with each failure
+BACKOFF_BASE_S = 60
+BACKOFF_MAX_S = 3600
+# Items sent per drain, a drain also stops early on a stop signal
+MAX_ITEMS_PER_DRAIN = 24
+# Failed items per drain, more failures in a row mean the chain is not
+# reachable and the remaining items can wait for the next drain
+MAX_FAILURES_PER_DRAIN = 3
+
+
+# Creates the outbox table if it does not exist
+def create_table(db):
+    '''Creates the outbox table if it does not exist.'''
+    db.execute(CREATE_TABLE)
+    db.execute(CREATE_INDEX)
+
+
+# Returns the storage item type of an hour ("YYYY-MM-DD-HH")
+def get_key(hour_string):
+    '''Returns the storage item type of an hour.'''
+    return f"cpin-production-{hour_string}"
+
+
+# Returns the stored value of a row of the hours table
+def get_payload(row):
+    '''Returns the stored value of a row of the hours table.'''
+    produced = row[2] - row[1]
+    fed_in = row[6] - row[5]
+    return json.dumps({"outputAC": fed_in, "outputDC": produced})
+
+
+# Returns the current time as text, like the other timestamps in the DB
+def get_time_string(now_s):
+    '''Returns the current time as text.'''
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now_s))
+
+
+# Queues all hours completed since the newest queued one, or the latest
+# completed hour if the outbox is empty. Returns the number of new items.
+def enqueue_completed_hours(db, now=None):
+    '''Queues all hours completed since the newest queued one.'''
+    newest = db.execute("SELECT MAX(hour) FROM outbox")[0][0]
+    if newest is None:
+        row = history.get_latest_completed_hour(db, now)
+        rows = [] if row is None else [row]
+    else:
+        rows = history.get_hours_since(db, newest, now)
+    enqueued = get_time_string(time.time())
+    db.executemany(INSERT_ITEM, [
+        (get_key(row[0]), row[0], get_payload(row), enqueued) for row in rows])
+    return len(rows)
+
+
+# Puts items back into the queue that were being sent when the process
+# stopped. Their attempt was counted, so they are looked up before resending.
+def reset_interrupted(db):
+    '''Puts items back into the queue that were being sent when the process stopped.'''
+    db.execute("UPDATE outbox SET status = ? WHERE status = ?", (PENDING, SENDING))
+
+
+# Returns the seconds to wait after the given number of failed attempts
+def get_backoff_s(attempts):
+    '''Returns the seconds to wait after the given number of failed attempts.'''
+    return min(BACKOFF_BASE_S * 2 ** max(attempts - 1, 0), BACKOFF_MAX_S)
+
+
+# Returns the transaction hash of a written transaction. The SDK returns
+# the web3 receipt of EVM transactions, which may have been reverted, and
+# the attributes of the ExtrinsicReceipt of substrate ones. It raises on
+# failed extrinsics itself. Any other receipt is an error, as it can't be
+# told whether the item was stored.
+def get_confirmation(result):
+    '''Returns the transaction hash of a written transaction.'''
+    receipt = getattr(result, "receipt", None)
+    if receipt is None:
+        raise RuntimeError("Transaction was not sent, the SDK has no signer")
+    if not isinstance(receipt, Mapping):
+        raise RuntimeError(f"Unrecognised transaction receipt of type {type(receipt).__name__}")
+    if "transactionHash" in receipt:
+        tx_hash = receipt["transactionHash"]
+        if receipt.get("status") != 1:
+            raise RuntimeError(f"Transaction {tx_hash!r} was reverted (status {receipt.get('status')})")
+    elif "extrinsic_hash" in receipt:
+        tx_hash = receipt["extrinsic_hash"]
+        if receipt.get("_ExtrinsicReceipt__is_success") is False:
+            raise RuntimeError(f"Extrinsic {tx_hash} failed")
+    else:
+        raise RuntimeError(f"Unrecognised transaction receipt with keys {sorted(receipt)}")
+    if isinstance(tx_hash, bytes):
+        # HexBytes.hex() adds "0x" only in some versions
+        tx_hash = "0x" + bytes(tx_hash).hex()
+    if not isinstance(tx_hash, str) or not tx_hash:
+        raise RuntimeError(f"Unrecognised transaction hash {tx_hash!r}")
+    return tx_hash
+
+
+# Returns True if the item is already stored on the chain with the given
+# payload, e.g. because the confirmation of an earlier attempt was lost
+def is_stored(storage, key, payload, wss_url):
+    '''Returns True if the item is already stored on the chain.'''
+    try:
+        return storage.get_item(item_type=key, wss_base_url=wss_url).get(key) == payload
+    except Exception:
+        # Raises GetItemError if there is no such item
+        return False
+
+
+# Sends one item to the storage and records the outcome. Returns True if
+# the item is confirmed.
+def send_item(db, storage, key, payload, attempts, wss_url=None, clock=time.time):
+    '''Sends one item to the storage and records the outcome.'''
+    # The attempt is counted before the transaction, so a crash during it
+    # leads to a lookup instead of a blind resend
+    with db.transaction():
+        db.execute("UPDATE outbox SET status = ?, attempts = attempts + 1 WHERE key = ?",
+                   (SENDING, key))
+    try:
+        if attempts > 0 and wss_url is not None and is_stored(storage, key, payload, wss_url):
+            confirmation = "found on chain"
+        else:
+            confirmation = get_confirmation(storage.add_item(item_type=key, item=payload))
+    except Exception as e:
+        next_attempt = clock() + get_backoff_s(attempts + 1)
+        with db.transaction():
+            db.execute(
+                "UPDATE outbox SET status = ?, next_attempt = ?, last_error = ? WHERE key = ?",
+                (PENDING, next_attempt, str(e)[:500], key))
+        logging.warning(f"Peaq Storage Updater: sending {key} failed "
+                        f"(attempt {attempts + 1}, next in {get_backoff_s(attempts + 1)} s): {e}")
+        return False
+    with db.transaction():
+        db.execute(
+            "UPDATE outbox SET status = ?, last_error = NULL, confirmed = ?, "
+            "confirmation = ? WHERE key = ?",
+            (CONFIRMED, get_time_string(clock()), confirmation, key))
+    logging.info(f"Peaq Storage Updater: stored {key} ({confirmation})")
+    return True
+
+
+# Sends the items that are due, oldest first, so the queue catches up in
+# bulk after an outage. Stops early once should_continue() returns False.
+# Returns the numbers of confirmed and failed items.
+def drain(db, storage, wss_url=None, limit=MAX_ITEMS_PER_DRAIN, clock=time.time,
+          should_continue=None):
+    '''Sends the items that are due, oldest first.'''
+    sent = 0
+    failed = 0
+    for key, payload, attempts in db.execute(SELECT_DUE, (clock(), limit)):
+        if should_continue is not None and not should_continue():
+            break
+        if send_item(db, storage, key, payload, attempts, wss_url, clock):
+            sent += 1
+        else:
+            failed += 1
+            if failed >= MAX_FAILURES_PER_DRAIN:
+                break
+    return sent, failed
+
+
+# Returns the number of items in each state and the oldest unconfirmed hour
+def get_status(db):
+    '''Returns the number of items in each state and the oldest unconfirmed hour.'''
+    counts = dict(db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status"))
+    oldest = db.execute(
+        "SELECT MIN(hour) FROM outbox WHERE status != ?", (CONFIRMED,))[0][0]
+    return counts, oldest
+
+
+# Prints the state of the outbox of the given data base file (default:
+# data/db.sqlite)
+def main():
+    '''Prints the state of the outbox of the given data base file.'''
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S')
+    file_name = sys.argv[1] if len(sys.argv) > 1 else "data/db.sqlite"
+    if not exists(file_name):
+        logging.error(f"Outbox: data base {file_name} does not exist")
+        exit(1)
+    db = Database(file_name, read_only=True)
+    counts, oldest = get_status(db)
+    logging.info(f"Outbox: {counts}, oldest unconfirmed hour: {oldest}")
+    for row in db.execute(
+            "SELECT key, attempts, last_error FROM outbox WHERE status != ? "
+            "ORDER BY hour LIMIT 10", (CONFIRMED,)):
+        logging.info(f"Outbox: {row[0]}: {row[1]} attempts, last error: {row[2]}")
+    db.close()
+
+
+# Main entry point of the application
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
 import os
 import time
 import logging
-import importlib
 import signal
 from os.path import exists
-from datetime import date, datetime
+from datetime import datetime
 
 # Project imports
 from config import Config
-from database import Database
+from database import ConnectionManager
+import outbox
 import version
 
 from eth_account import Account
@@ -20,33 +20,10 @@ from peaq_sdk.types import ChainType, CustomDocumentFields, Verification, Servic
 NUM_REAL_TIME_VALUES = 24*60  # 24h * 60 Minutes
 real_time_seconds_counter = 0
 config = None
+connections = ConnectionManager("data/db.sqlite")
 run = True
 
 
-# Returns JSON response containing history details
-def get_json_data_history_details(table, date_search_string):
-    '''Returns JSON response containing history details.'''
-    db = Database("data/db.sqlite")
-    if len(date_search_string) > 0:
-        rows = db.execute(
-            f"SELECT * FROM {table} WHERE date LIKE '{date_search_string}%'")
-    else:
-        rows = db.execute(
-            f"SELECT * FROM {table}")
-    # Build results
-    data = []
-    for row in rows:
-        produced = row[2] - row[1]
-        consumed = row[4] - row[3]
-        fed_in = row[6] - row[5]
-        data.append({
-            "date": row[0],
-            "output_ac": fed_in,
-            "output_dc": produced,
-        })
-    return json.dumps(data)
-
-
 # Sets the time zone environment variable
 def set_time_zone(tz):
     '''Sets the time zone environment variable.'''
@@ -59,23 +36,46 @@ def set_time_zone(tz):
         logging.info(f"Peaq Storage Updater: Time is now {time.strftime('%X %x %Z')}")
 
 
-# Updates data in the data base
-def update_data(sdk, dcValue, acValue, year, month, day, hour):
-    '''Updates data in the data base.'''
-    try:
-        key = f'cpin-production-{year}-{month}-{day}-{hour}'
-        value = f'{{"outputAC": {acValue}, "outputDC": {dcValue}}}'
-        result = sdk.storage.add_item(item_type=key, item=value)
-        if result.receipt.is_success:
-            logging.exception('Storage update success')
-            for event in receipt.triggered_events:
-                logging.exception(f'* {event.value}')
-        else:
-            logging.exception('Tx Failed: ', receipt.error_message)
+# Sends the items of the outbox that are due. The grabber queues them.
+def update_data(sdk, wss_url):
+    '''Sends the items of the outbox that are due.'''
+    db = connections.writer()
+    sent, failed = outbox.drain(db, sdk.storage, wss_url, should_continue=lambda: run)
+    if sent or failed:
+        counts, oldest = outbox.get_status(db)
+        logging.info(f"Peaq Storage Updater: {sent} items stored, {failed} failed, "
+                     f"{counts.get(outbox.PENDING, 0)} pending since {oldest}")
 
+
+# Creates the DID if it does not exist yet, returns True on success
+def init_did(sdk, did_name, wss_url, admin_address, admin_signature, facility_info_url):
+    '''Creates the DID if it does not exist yet, returns True on success.'''
+    try:
+        try:
+            sdk.did.read(name=did_name, wss_base_url=wss_url)
+            return True
+        except Exception:
+            logging.info(f"Peaq Storage Updater: creating DID {did_name}")
+        custom_fields = CustomDocumentFields(
+            verifications=[
+                Verification(type='EcdsaSecp256k1RecoveryMethod2020')
+            ],
+            signature=Signature(
+                type='EcdsaSecp256k1RecoveryMethod2020',
+                issuer=admin_address,
+                hash=admin_signature
+            ),
+            services=[
+                Service(id='#admin', type='admin', data=admin_address),
+                Service(id='#ipfs', type='facilityInfo', serviceEndpoint=facility_info_url)
+            ]
+        )
+        result = sdk.did.create(name=did_name, custom_document_fields=custom_fields)
+        logging.info(f"Peaq Storage Updater: DID created ({outbox.get_confirmation(result)})")
+        return True
     except Exception:
-        logging.exception("Storage update failed")
-        exit()
+        logging.exception("Peaq Storage Updater: DID init failed")
+        return False
 
 
 # This is called when SIGTERM is received
@@ -134,44 +134,27 @@ def main():
         seed=private_key,
     )
 
-    # Create did if not exists
-    try:
-        try:
-            result = sdk.did.read(name=did_name, wss_base_url=peaq_wss_url)
-        except:
-            custom_fields = CustomDocumentFields(
-                verifications=[
-                    Verification(type='EcdsaSecp256k1RecoveryMethod2020')
-                ],
-                signature=Signature(
-                    type='EcdsaSecp256k1RecoveryMethod2020',
-                    issuer=admin_address, 
-                    hash=admin_signature
-                ),
-                services=[
-                    Service(id='#admin', type='admin', data=admin_address)
-                    Service(id='#ipfs', type='facilityInfo', serviceEndpoint=facility_info_url)
-                ]
-            )
-            result = sdk.did.create(name=did_name, custom_document_fields=custom_fields)
-            if result.receipt.is_success:
-                logging.exception('DID init success')
-                for event in receipt.triggered_events:
-                    logging.exception(f'* {event.value}')
-            else:
-                logging.exception('Tx Failed: ', result.message)
-
-    except Exception:
-        logging.exception("DID init failed")
-        exit()
-
     # Prepare the data base
     logging.info("Peaq Storage Updater: Checking if data base exists")
     if not exists("data/db.sqlite"):
-        logging.exception("Peaq Storage Updater: Data base does not exist.")
+        logging.error("Peaq Storage Updater: Data base does not exist.")
         exit()
-
-    # Peaq Storage Updater main loop
+    db = connections.writer()
+    with db.transaction():
+        outbox.create_table(db)
+        outbox.reset_interrupted(db)
+
+    # Create did if not exists, the network may not be up yet
+    attempts = 0
+    while run and not init_did(sdk, did_name, peaq_wss_url, admin_address,
+                               admin_signature, facility_info_url):
+        attempts += 1
+        retry_time = time.monotonic() + outbox.get_backoff_s(attempts)
+        while run and time.monotonic() < retry_time:
+            time.sleep(1.0)
+
+    # Peaq Storage Updater main loop. Failed submissions stay in the
+    # outbox and are retried, hours missed meanwhile are sent in bulk.
     logging.debug("Peaq Storage Updater: Entering main loop")
     while run:
         if logging.getLogger().level == logging.DEBUG:
@@ -179,8 +162,7 @@ def main():
             logging.debug(f"Peaq Storage Updater: {time_string}: Updating device data")
 
         try:
-            data = get_json_data_history_details("hours", "")
-            update_data(sdk, data[-1]['output_dc'], data[-1]['output_ac'], data[-1]['date'].split('-')[0], data[-1]['date'].split('-')[1], data[-1]['date'].split('-')[2], data[-1]['date'].split('-')[3])
+            update_data(sdk, peaq_wss_url)
         except Exception:
             logging.exception("Peaq Storage Updater: failed")
 
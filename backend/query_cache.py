@@ -0,0 +1,116 @@
+import time
+import threading
+from concurrent.futures import Future
+
+# Project imports
+import metrics
+
+
+# Seconds a response of each query type stays valid, unless the data base
+# changes earlier. Types that are not listed are not cached.
+DEFAULT_TTLS_S = {
+    "current": 3,
+    "real_time": 5,
+    "dates": 60,
+    "historical": 60,
+    "days_in_month": 60,
+    "months_in_year": 60,
+    "years_in_all_time": 60,
+    "statistics": 60,
+    "power": 60,
+    "devices": 3,
+    "batch": 3,
+    "high_res": 60,
+    "analytics": 60,
+}
+
+# Responses kept at most, the oldest ones are dropped first
+MAX_ENTRIES = 256
+# Total size of the kept responses in bytes. High res ranges and analytics
+# of long ranges can be several MB each, a Pi may only have 1 GB of memory.
+MAX_BYTES = 16 * 1024 * 1024
+# Responses larger than this share of MAX_BYTES are not kept at all
+MAX_ENTRY_SHARE = 8
+
+# Metrics of the cache
+LOOKUPS = metrics.counter(
+    "cpin_query_cache_lookups_total", "Query cache lookups by result", ["type", "result"])
+
+
+# Cached response of one query
+class Entry:
+    def __init__(self, generation, expires, value):
+        self.generation = generation
+        self.expires = expires
+        self.value = value
+        self.size = len(value)  # Responses are text or bytes
+
+
+# Caches query responses until their TTL ends or the data base changes.
+# Concurrent requests for the same query wait for a single computation.
+class QueryCache:
+    def __init__(self, get_generation, ttls_s=None, clock=time.monotonic, max_bytes=MAX_BYTES):
+        self.get_generation = get_generation
+        self.ttls_s = dict(DEFAULT_TTLS_S if ttls_s is None else ttls_s)
+        self.clock = clock
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.num_bytes = 0  # Total size of the entries
+        self.in_flight = {}  # Futures of the running computations by key
+        self.lock = threading.Lock()
+
+    def get(self, key, query_type, compute):
+        '''Returns the cached response of the query, computing it if needed.'''
+        ttl_s = self.ttls_s.get(query_type, 0)
+        if ttl_s <= 0:
+            return compute()
+        generation = self.get_generation()
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is not None and entry.generation == generation
+                    and entry.expires > self.clock()):
+                LOOKUPS.inc(query_type, "hit")
+                return entry.value
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+
+        if not leader:
+            # Somebody else is computing the same response right now
+            LOOKUPS.inc(query_type, "shared")
+            return future.result()
+
+        LOOKUPS.inc(query_type, "miss")
+        try:
+            value = compute()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.in_flight[key]
+            self.remove(key)
+            entry = Entry(generation, self.clock() + ttl_s, value)
+            if entry.size <= self.max_bytes // MAX_ENTRY_SHARE:
+                self.purge(generation)
+                self.entries[key] = entry
+                self.num_bytes += entry.size
+                while len(self.entries) > MAX_ENTRIES or self.num_bytes > self.max_bytes:
+                    self.remove(next(iter(self.entries)))
+        future.set_result(value)
+        return value
+
+    def remove(self, key):
+        '''Removes an entry if there is one. The lock must be held.'''
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.num_bytes -= entry.size
+
+    def purge(self, generation):
+        '''Removes the entries that can't be used anymore. The lock must be held.'''
+        now = self.clock()
+        for key in [key for key, entry in self.entries.items()
+                    if entry.expires <= now or entry.generation != generation]:
+            self.remove(key)
@@ -0,0 +1,110 @@
+import time
+import logging
+
+
+# Real time (24h) data
+NUM_REAL_TIME_VALUES = 24*60  # 24h * 60 Minutes
+
+# Cursors from here on are Unix timestamps, smaller ones minute IDs
+UNIX_TIMESTAMP_MIN = 1000000000
+
+# The real time table is a ring buffer with one slot per minute. The ID
+# column holds the minute since the epoch, the slot is ID modulo 1440.
+CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS real_time ("
+    "slot INTEGER PRIMARY KEY, ID INTEGER, "
+    "time STRING, produced REAL, consumed REAL, fed_in REAL)")
+INIT_SLOTS = (
+    "INSERT OR IGNORE INTO real_time "
+    "WITH RECURSIVE slots(slot) AS ("
+    "SELECT 0 UNION ALL SELECT slot + 1 FROM slots WHERE slot < ?) "
+    "SELECT slot, 0, '...', 0.0, 0.0, 0.0 FROM slots")
+UPDATE_SLOT = (
+    "UPDATE real_time SET ID = ?, time = ?, "
+    "produced = ?, consumed = ?, fed_in = ? "
+    "WHERE slot = ?")
+# Two slot ranges cover a window that wraps around the end of the buffer
+SELECT_WINDOW = (
+    "SELECT ID, time, produced, consumed, fed_in FROM real_time "
+    "WHERE (slot BETWEEN ? AND ? OR slot BETWEEN ? AND ?) AND ID >= ? "
+    "ORDER BY ID DESC")
+
+
+# Returns the current minute since the epoch
+def current_minute_id(timestamp=None):
+    '''Returns the current minute since the epoch.'''
+    if timestamp is None:
+        timestamp = time.time()
+    return int(timestamp // 60)
+
+
+# Creates the ring buffer table with all slots
+def create_table(db):
+    '''Creates the ring buffer table with all slots.'''
+    db.execute(CREATE_TABLE)
+    db.execute(INIT_SLOTS, (NUM_REAL_TIME_VALUES - 1,))
+
+
+# Stores the sample of one minute in its slot
+def insert_sample(db, minute_id, time_string, produced, consumed, fed_in):
+    '''Stores the sample of one minute in its slot.'''
+    db.execute(UPDATE_SLOT, (
+        minute_id, time_string, produced, consumed, fed_in,
+        minute_id % NUM_REAL_TIME_VALUES))
+
+
+# Returns the samples of the last minutes, newest first
+def get_latest(db, num_minutes, minute_id=None):
+    '''Returns the samples of the last minutes, newest first.'''
+    if minute_id is None:
+        minute_id = current_minute_id()
+    num_minutes = max(1, min(num_minutes, NUM_REAL_TIME_VALUES))
+    first_id = minute_id - num_minutes + 1
+    first_slot = first_id % NUM_REAL_TIME_VALUES
+    last_slot = minute_id % NUM_REAL_TIME_VALUES
+    if first_slot <= last_slot:
+        ranges = (first_slot, last_slot, first_slot, last_slot)
+    else:
+        ranges = (first_slot, NUM_REAL_TIME_VALUES - 1, 0, last_slot)
+    return db.execute(SELECT_WINDOW, ranges + (first_id,))
+
+
+# Returns the samples after the given minute ID within the last minutes,
+# newest first, and the cursor to ask for the following ones
+def get_since(db, since_id, num_minutes, minute_id=None):
+    '''Returns the samples after the given minute ID and the next cursor.'''
+    if minute_id is None:
+        minute_id = current_minute_id()
+    # Unix timestamps are accepted as well
+    if since_id >= UNIX_TIMESTAMP_MIN:
+        since_id = current_minute_id(since_id)
+    num_minutes = min(num_minutes, minute_id - since_id)
+    rows = get_latest(db, num_minutes, minute_id) if num_minutes > 0 else []
+    if rows:
+        return rows, rows[0][0]
+    # The sample of the current minute may still be written
+    return rows, max(since_id, minute_id - 1)
+
+
+# Converts the legacy real time table (AUTOINCREMENT rows)
+def convert_legacy_table(db):
+    '''Converts the legacy real time table (AUTOINCREMENT rows).'''
+    columns = [row[1] for row in db.execute("PRAGMA table_info(real_time)")]
+    if "slot" in columns:
+        return 0
+    db.execute("ALTER TABLE real_time RENAME TO real_time_legacy")
+    create_table(db)
+    # The legacy rows carry no date, so the newest row is assumed to be
+    # the current minute and all others one minute apart
+    rows = db.execute(
+        "SELECT time, produced, consumed, fed_in FROM real_time_legacy "
+        "ORDER BY ID DESC LIMIT ?", (NUM_REAL_TIME_VALUES,))
+    minute_id = current_minute_id()
+    samples = [
+        (minute_id - i, row[0], row[1], row[2], row[3])
+        for i, row in enumerate(rows) if row[0] != "..."]
+    for sample in samples:
+        insert_sample(db, *sample)
+    db.execute("DROP TABLE real_time_legacy")
+    logging.info(f"Real time: converted {len(samples)} legacy samples")
+    return len(samples)
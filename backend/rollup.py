@@ -0,0 +1,185 @@
+import json
+import base64
+import logging
+from datetime import date, timedelta
+
+# Project imports
+import high_res
+
+
+# Resolutions in minutes. Minute data lives in high_res_samples, the
+# coarser ones are rolled up incrementally into the rollups table.
+MINUTE = 1
+QUARTER_HOUR = 15
+HOUR = 60
+RESOLUTIONS = [MINUTE, QUARTER_HOUR, HOUR]
+ROLLUP_RESOLUTIONS = [QUARTER_HOUR, HOUR]
+
+# Each row holds the sums of all minute samples of one bucket
+CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS rollups ("
+    "resolution INTEGER, date TEXT, slot INTEGER, num_samples INTEGER, "
+    "produced REAL, consumed REAL, fed_in REAL, "
+    "PRIMARY KEY (resolution, date, slot)) WITHOUT ROWID")
+# Recomputes one bucket from its minute samples, so storing a minute
+# again (e.g. after a restart or in the repeated DST hour) counts it once
+UPDATE_BUCKET = (
+    "INSERT OR REPLACE INTO rollups "
+    "SELECT ?, date, ?, COUNT(*), SUM(produced), SUM(consumed), SUM(fed_in) "
+    "FROM high_res_samples WHERE date = ? AND minute >= ? AND minute < ? "
+    "GROUP BY date")
+SELECT_RANGE = (
+    "SELECT date, slot, produced / num_samples, consumed / num_samples, "
+    "fed_in / num_samples FROM rollups "
+    "WHERE resolution = ? AND date >= ? AND date <= ? ORDER BY date, slot")
+SELECT_MINUTE_RANGE = (
+    "SELECT date, minute, produced, consumed, fed_in FROM high_res_samples "
+    "WHERE date >= ? AND date <= ? ORDER BY date, minute")
+REBUILD = (
+    "INSERT INTO rollups "
+    "SELECT ?, date, minute / ?, COUNT(*), "
+    "SUM(produced), SUM(consumed), SUM(fed_in) "
+    "FROM high_res_samples GROUP BY date, minute / ?")
+
+# Default retention: everything is kept forever
+DEFAULT_RETENTION = {
+    MINUTE: None,
+    QUARTER_HOUR: None,
+    HOUR: None,
+}
+
+
+# Reads the retention policy from the configuration
+def get_retention(config_data):
+    '''Reads the retention policy from the configuration.'''
+    settings = config_data.get('rollup') or {}
+    retention = dict(DEFAULT_RETENTION)
+    minute_days = settings.get('minute_retention_days', 0)
+    if minute_days:
+        retention[MINUTE] = ("days", int(minute_days))
+    quarter_hour_months = settings.get('quarter_hour_retention_months', 0)
+    if quarter_hour_months:
+        retention[QUARTER_HOUR] = ("months", int(quarter_hour_months))
+    return retention
+
+
+# Returns the first day that is still kept at the given resolution
+def get_cutoff_date(retention, resolution, today=None):
+    '''Returns the first day that is still kept at the given resolution.'''
+    if today is None:
+        today = date.today()
+    policy = retention.get(resolution)
+    if policy is None:
+        return None
+    unit, amount = policy
+    if unit == "days":
+        return today - timedelta(days=amount)
+    month_index = today.year * 12 + today.month - 1 - amount
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+# Creates the rollup table if it does not exist
+def create_table(db):
+    '''Creates the rollup table if it does not exist.'''
+    db.execute(CREATE_TABLE)
+
+
+# Recomputes all rollups from the minute samples
+def rebuild(db):
+    '''Recomputes all rollups from the minute samples.'''
+    db.execute("DELETE FROM rollups")
+    for resolution in ROLLUP_RESOLUTIONS:
+        db.execute(REBUILD, (resolution, resolution, resolution))
+
+
+# Updates all rollup buckets containing a minute sample that was stored
+def update_buckets(db, day_string, minute):
+    '''Updates all rollup buckets containing a minute sample that was stored.'''
+    for resolution in ROLLUP_RESOLUTIONS:
+        slot = minute // resolution
+        db.execute(UPDATE_BUCKET, (
+            resolution, slot, day_string, slot * resolution, (slot + 1) * resolution))
+
+
+# Deletes all data that is older than its retention period
+def apply_retention(db, retention, today=None):
+    '''Deletes all data that is older than its retention period.'''
+    for resolution in RESOLUTIONS:
+        cutoff = get_cutoff_date(retention, resolution, today)
+        if cutoff is None:
+            continue
+        if resolution == MINUTE:
+            db.execute("DELETE FROM high_res_samples WHERE date < ?",
+                       (str(cutoff),))
+            db.execute("DELETE FROM high_res_packed WHERE date < ?",
+                       (str(cutoff),))
+        else:
+            db.execute("DELETE FROM rollups WHERE resolution = ? AND date < ?",
+                       (resolution, str(cutoff)))
+        logging.debug(f"Rollup: removed {resolution} min data before {cutoff}")
+
+
+# Returns the oldest day that is kept at each resolution. It changes
+# when the retention deletes data, so it tags what is left of old periods.
+def get_oldest_dates(db):
+    '''Returns the oldest day that is kept at each resolution.'''
+    oldest = [db.execute("SELECT MIN(date) FROM high_res_samples")[0][0]]
+    for resolution in ROLLUP_RESOLUTIONS:
+        oldest.append(db.execute(
+            "SELECT MIN(date) FROM rollups WHERE resolution = ?", (resolution,))[0][0])
+    return oldest
+
+
+# Picks the coarsest kept resolution that still yields the requested points
+def pick_resolution(retention, from_date, to_date, points, today=None):
+    '''Picks the coarsest kept resolution that still yields the requested points.'''
+    span_minutes = ((to_date - from_date).days + 1) * 24 * 60
+    wanted = max(1, span_minutes // max(1, points))
+    kept = [resolution for resolution in RESOLUTIONS
+            if get_cutoff_date(retention, resolution, today) is None
+            or get_cutoff_date(retention, resolution, today) <= from_date]
+    if not kept:
+        # Nothing covers the whole range, use the coarsest one
+        return RESOLUTIONS[-1]
+    fitting = [resolution for resolution in kept if resolution <= wanted]
+    return fitting[-1] if fitting else kept[0]
+
+
+# Returns (date, minute, produced, consumed, fed_in) rows of a date range
+def get_rows(db, resolution, from_string, to_string):
+    '''Returns (date, minute, produced, consumed, fed_in) rows of a date range.'''
+    if resolution == MINUTE:
+        return db.execute(SELECT_MINUTE_RANGE, (from_string, to_string))
+    rows = db.execute(SELECT_RANGE, (resolution, from_string, to_string))
+    return [(row[0], row[1] * resolution, row[2], row[3], row[4]) for row in rows]
+
+
+# Returns [date, time, produced, consumed, fed_in] rows of a date range
+def get_series(db, resolution, from_string, to_string):
+    '''Returns [date, time, produced, consumed, fed_in] rows of a date range.'''
+    rows = get_rows(db, resolution, from_string, to_string)
+    return [[row[0], high_res.minute_to_time_string(row[1]),
+             round(row[2], 3), round(row[3], 3), round(row[4], 3)]
+            for row in rows]
+
+
+# Returns the finest available samples of a day as JSON string (or "")
+def get_day_json(db, day_string):
+    '''Returns the finest available samples of a day as JSON string (or "").'''
+    for resolution in RESOLUTIONS:
+        series = get_series(db, resolution, day_string, day_string)
+        if series:
+            samples = [row[1:] for row in series]
+            return json.dumps(samples, separators=(",", ":"))
+    return ""
+
+
+# Returns the finest available samples of a day in the compact binary
+# format as base64 text (or "")
+def get_day_base64(db, day_string):
+    '''Returns the finest available samples of a day in the compact format as base64.'''
+    for resolution in RESOLUTIONS:
+        rows = get_rows(db, resolution, day_string, day_string)
+        if rows:
+            return base64.b64encode(high_res.encode_binary(rows)).decode("ascii")
+    return ""
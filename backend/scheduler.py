@@ -0,0 +1,83 @@
+import time
+import logging
+
+# Project imports
+import metrics
+
+
+# What to do with deadlines that passed while a tick was still running
+POLICY_SKIP = "skip"  # Continue with the next deadline in the future
+POLICY_CATCH_UP = "catch_up"  # Run the missed ticks right away
+
+# Metrics of the deadlines
+OVERRUNS = metrics.counter(
+    "cpin_grabber_overruns_total", "Ticks that overran their deadline")
+SKIPPED = metrics.counter(
+    "cpin_grabber_skipped_ticks_total", "Ticks skipped after an overrun")
+
+
+# Fires ticks on absolute deadlines of a monotonic clock, so the period
+# does not drift by the time spent polling the device and writing the DB
+class Scheduler:
+    def __init__(
+            self,
+            interval_s,
+            policy=POLICY_SKIP,
+            max_catch_up=3,
+            clock=time.monotonic,
+            sleep=time.sleep,
+            wall_clock=time.time):
+        if policy not in (POLICY_SKIP, POLICY_CATCH_UP):
+            raise ValueError(f"Unsupported overrun policy: {policy}")
+        self.interval_s = interval_s
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.sleep = sleep
+
+        # Statistics
+        self.num_ticks = 0
+        self.num_overruns = 0
+        self.num_skipped = 0
+        self.last_overrun_s = 0.0
+
+        # Place the deadlines on multiples of the interval on the wall
+        # clock (e.g. hh:mm:00, hh:mm:05, ...) so minute boundaries are hit
+        phase_s = (interval_s - wall_clock() % interval_s) % interval_s
+        self.next_deadline = clock() + phase_s
+
+    def wait_for_first_tick(self):
+        '''Sleeps until the first, wall clock aligned deadline.'''
+        delay_s = self.next_deadline - self.clock()
+        if delay_s > 0:
+            self.sleep(delay_s)
+
+    def wait(self):
+        '''Sleeps until the next deadline. Returns the number of skipped ticks.'''
+        self.num_ticks += 1
+        self.next_deadline += self.interval_s
+        now = self.clock()
+        if now <= self.next_deadline:
+            self.sleep(self.next_deadline - now)
+            return 0
+
+        # The last tick overran one or more deadlines
+        late_s = now - self.next_deadline
+        missed = int(late_s // self.interval_s) + 1
+        self.num_overruns += 1
+        self.last_overrun_s = late_s
+        if self.policy == POLICY_CATCH_UP:
+            # Run the tick of the passed deadline now, but never more
+            # than max_catch_up ticks back to back
+            skipped = max(0, missed - self.max_catch_up)
+            self.next_deadline += skipped * self.interval_s
+        else:
+            skipped = missed
+            self.next_deadline += skipped * self.interval_s
+            self.sleep(self.next_deadline - now)
+        self.num_skipped += skipped
+        OVERRUNS.inc()
+        SKIPPED.inc(amount=skipped)
+        logging.warning(f"Scheduler: tick overran its deadline by "
+                        f"{late_s * 1000.0:.0f} ms, skipping {skipped} tick(s)")
+        return skipped
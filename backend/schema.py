@@ -0,0 +1,214 @@
+import sys
+import logging
+from os.path import exists
+
+# Project imports
+from database import Database
+import device_pool
+import high_res
+import history
+import outbox
+import real_time
+import rollup
+import stats
+
+
+# Version of the data base layout, stored in PRAGMA user_version
+SCHEMA_VERSION = 10
+
+
+# Returns the schema version of the data base
+def get_version(db):
+    '''Returns the schema version of the data base.'''
+    return db.execute("PRAGMA user_version")[0][0]
+
+
+# Sets the schema version of the data base
+def set_version(db, version):
+    '''Sets the schema version of the data base.'''
+    db.execute(f"PRAGMA user_version = {int(version)}")
+
+
+# Creates a table holding the a/b energy counters of a time period
+def create_historical_table(db, name):
+    '''Creates a table holding the a/b energy counters of a time period.'''
+    # The rows are stored in key order (WITHOUT ROWID), so a key range
+    # scan returns complete rows without a second lookup
+    query = (f"create table if not exists {name} ("
+             "date TEXT PRIMARY KEY,"
+             "produced_a REAL, produced_b REAL,"
+             "consumed_a REAL, consumed_b REAL,"
+             "fed_in_a REAL, fed_in_b REAL) WITHOUT ROWID")
+    db.execute(query)
+
+
+# Creates all tables of a new DB
+def create(db):
+    '''Creates all tables of a new DB.'''
+    # Historical data tables
+    for name in history.HISTORICAL_TABLES:
+        create_historical_table(db, name)
+
+    # Add initial all time row
+    query = ("INSERT INTO all_time VALUES ('all_time',0,0,0,0,0,0)")
+    db.execute(query)
+
+    # Current data table
+    query = ("create table if not exists current"
+             "(date STRING PRIMARY KEY, "
+             "produced REAL, consumed_grid REAL, consumed_pv REAL, "
+             "consumed_total REAL, fed_in REAL)")
+    db.execute(query)
+
+    # Real time data table
+    real_time.create_table(db)
+
+    # Add highscores
+    query = ("CREATE TABLE IF NOT EXISTS highscores "
+             "(type STRING PRIMARY KEY, date STRING, value REAL)")
+    db.execute(query)
+    query = ("INSERT INTO highscores (type,date,value) "
+             "VALUES('production','...',0.0);")
+    db.execute(query)
+
+    # Add high res data and rollup tables
+    high_res.create_table(db)
+    high_res.create_packed_table(db)
+    rollup.create_table(db)
+
+    # Latest values of each device
+    device_pool.create_table(db)
+
+    # Statistics maintained by the grabber
+    stats.create_table(db)
+
+    # Queue of the peaq storage submissions
+    outbox.create_table(db)
+
+    set_version(db, SCHEMA_VERSION)
+
+
+# Version 1: tables added after the first release
+def migrate_to_1(db):
+    '''Version 1: tables added after the first release.'''
+    db.execute("CREATE TABLE IF NOT EXISTS highscores "
+               "(type STRING PRIMARY KEY, date STRING, value REAL)")
+    db.execute("INSERT OR IGNORE INTO highscores (type,date,value) "
+               "VALUES('production','...',0.0)")
+
+
+# Version 2: high res data as one row per minute
+def migrate_to_2(db):
+    '''Version 2: high res data as one row per minute.'''
+    high_res.create_table(db)
+    high_res.convert_legacy_table(db)
+
+
+# Version 3: real time data as 1440 slot ring buffer
+def migrate_to_3(db):
+    '''Version 3: real time data as 1440 slot ring buffer.'''
+    real_time.convert_legacy_table(db)
+
+
+# Version 4: hourly counters ("YYYY-MM-DD-HH")
+def migrate_to_4(db):
+    '''Version 4: hourly counters ("YYYY-MM-DD-HH").'''
+    create_historical_table(db, "hours")
+
+
+# Version 5: 15 minute and hourly rollups of the high res data
+def migrate_to_5(db):
+    '''Version 5: 15 minute and hourly rollups of the high res data.'''
+    rollup.create_table(db)
+    rollup.rebuild(db)
+
+
+# Version 6: historical tables with text keys, clustered by key
+def migrate_to_6(db):
+    '''Version 6: historical tables with text keys, clustered by key.'''
+    for name in history.HISTORICAL_TABLES:
+        # Year keys were stored as integers due to the STRING column type
+        db.execute(f"ALTER TABLE {name} RENAME TO {name}_legacy")
+        create_historical_table(db, name)
+        db.execute(f"INSERT INTO {name} SELECT CAST(date AS TEXT), "
+                   f"produced_a, produced_b, consumed_a, consumed_b, "
+                   f"fed_in_a, fed_in_b FROM {name}_legacy")
+        db.execute(f"DROP TABLE {name}_legacy")
+
+
+# Version 7: latest values of each device of a multi device site
+def migrate_to_7(db):
+    '''Version 7: latest values of each device of a multi device site.'''
+    device_pool.create_table(db)
+
+
+# Version 8: statistics maintained by the grabber
+def migrate_to_8(db):
+    '''Version 8: statistics maintained by the grabber.'''
+    stats.create_table(db)
+    stats.rebuild(db)
+
+
+# Version 9: queue of the peaq storage submissions
+def migrate_to_9(db):
+    '''Version 9: queue of the peaq storage submissions.'''
+    outbox.create_table(db)
+
+
+# Version 10: packed high res samples of the days that are over
+def migrate_to_10(db):
+    '''Version 10: packed high res samples of the days that are over.'''
+    high_res.create_packed_table(db)
+
+
+# All migrations in order
+MIGRATIONS = [
+    (1, migrate_to_1),
+    (2, migrate_to_2),
+    (3, migrate_to_3),
+    (4, migrate_to_4),
+    (5, migrate_to_5),
+    (6, migrate_to_6),
+    (7, migrate_to_7),
+    (8, migrate_to_8),
+    (9, migrate_to_9),
+    (10, migrate_to_10),
+]
+
+
+# Upgrades the data base to the current schema version
+def upgrade(db):
+    '''Upgrades the data base to the current schema version.'''
+    version = get_version(db)
+    for target_version, migration in MIGRATIONS:
+        if version >= target_version:
+            continue
+        logging.info(f"Schema: upgrading data base to version {target_version}")
+        # Each step is atomic, so an interrupted upgrade can simply be rerun
+        with db.transaction():
+            migration(db)
+            set_version(db, target_version)
+        version = target_version
+
+
+# Upgrades the given data base file (default: data/db.sqlite)
+def main():
+    '''Upgrades the given data base file (default: data/db.sqlite).'''
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S')
+    file_name = sys.argv[1] if len(sys.argv) > 1 else "data/db.sqlite"
+    if not exists(file_name):
+        logging.error(f"Schema: data base {file_name} does not exist")
+        exit(1)
+    db = Database(file_name)
+    logging.info(f"Schema: {file_name} is at version {get_version(db)}")
+    upgrade(db)
+    logging.info(f"Schema: {file_name} is at version {get_version(db)}")
+    db.close()
+
+
+# Main entry point of the application
+if __name__ == "__main__":
+    main()
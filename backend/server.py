@@ -1,18 +1,77 @@
+import os
+import gzip
 import json
-from datetime import date
+import time
+import base64
+import hashlib
+from datetime import date, datetime
 import logging
 import traceback
-from flask import Flask, request, send_from_directory, make_response
+from flask import Flask, Response, request, send_from_directory, make_response
 from flask_compress import Compress
 
 # Project imports
 from config import Config
-from database import Database
+from database import ConnectionManager
+import analytics
+import device_pool
+import export
+import high_res
+import history
+import metrics
+import query_cache
+import real_time
+import rollup
+import stats
+import stream
 import version
 
 
 # Globals
 config = None
+connections = ConnectionManager("data/db.sqlite")
+# Responses are reused until the grabber commits new data
+cache = query_cache.QueryCache(connections.get_data_version)
+# Fingerprint of version and configuration, part of the ETags
+config_hash = None
+# Minute samples of closed days for the analytics, as NumPy arrays
+day_cache = analytics.DayCache()
+# Pushes the dashboard data to the open /stream connections (set up in main)
+broadcaster = None
+
+# Random id of this process, the data version restarts with each process
+INSTANCE_ID = os.urandom(4).hex()
+# Seconds browsers may reuse the data of a period that is over
+CLOSED_PERIOD_MAX_AGE_S = 86400
+# Query types answered from the power samples, whose old periods change
+# when the retention deletes or coarsens the samples. The history of a day
+# contains its power samples, too.
+RETAINED_TYPES = ["power", "analytics"]
+RETAINED_TABLES = ["days"]
+# Suffixes Flask-Compress appends to the ETag of a compressed response
+COMPRESSION_SUFFIXES = [":gzip", ":br", ":deflate", ":zstd"]
+# Worker threads of waitress for ordinary requests, streams get their own
+NUM_REQUEST_THREADS = 4
+
+
+# Metrics of the web server
+QUERY_TYPES = [
+    "current", "dates", "historical", "real_time", "days_in_month",
+    "months_in_year", "years_in_all_time", "statistics", "power", "devices",
+    "name", "analytics"]
+QUERY_SECONDS = metrics.histogram(
+    "cpin_query_seconds", "Duration of /query requests", ["type"])
+QUERY_ERRORS = metrics.counter(
+    "cpin_query_errors_total", "Failed /query requests", ["type"])
+BATCH_SECONDS = metrics.histogram(
+    "cpin_batch_seconds", "Duration of /batch requests")
+
+# Queries a single /batch request may contain
+MAX_BATCH_QUERIES = 16
+# Days a single /high_res request may cover
+MAX_HIGH_RES_DAYS = 366
+# Days a single analytics query may cover
+MAX_ANALYTICS_DAYS = 10 * 366
 
 
 # Main Flask web server application
@@ -20,24 +79,6 @@ app = Flask(__name__)
 Compress(app)
 
 
-# Converts the given rows to a CSV string
-def rows_to_csv(rows):
-    '''Converts the given rows to a CSV string.'''
-    # Header
-    csv = "date;production;consumption;feed_in\n"
-    # Data
-    for row in rows:
-        csv += row[0]  # Date
-        csv += ";"
-        csv += str(row[2] - row[1])  # Production
-        csv += ";"
-        csv += str(row[4] - row[3])  # Consumption
-        csv += ";"
-        csv += str(row[6] - row[5])  # Feed-in
-        csv += "\n"
-    return csv
-
-
 @app.route('/')
 # Serves the index.html
 def get_index():
@@ -53,37 +94,43 @@ def get_file(path):
 
 
 @app.route('/csv')
-# Returns a .csv export from the database
+# Streams a .csv export from the database
+# .../csv?table=days&date=2022-08
+# .../csv?table=minutes&from=2022-08-01&to=2022-08-07
 def get_csv():
-    '''Returns a .csv export from the database.'''
+    '''Streams a .csv export from the database.'''
     try:
         # Gather parameters
         _table = request.args['table']
         _date = request.args.get('date', "")
+        _from = request.args.get('from', _date)
+        _to = request.args.get('to', _date)
 
-        # Gather CSV contents
-        rows = None
-        db = Database("data/db.sqlite")
-
-        # Build and execute query
-        query = f"SELECT * FROM {_table}"
-        if len(_date) > 0:
-            query += f" WHERE date LIKE '{_date}%'"
-        rows = db.execute(query)
+        # Rows are read and sent in chunks, memory use does not grow
+        # with the size of the export
+        db = connections.reader()
+        chunks = export.generate_csv(db, _table, _from, _to)
 
         # Build file name
-        file_name = (
-            f"CpinData_{_date}.csv" if len(_date) > 0
-            else "CpinData_All.csv")
-
-        # Convert rows to CSV
-        csv = rows_to_csv(rows)
-
-        # Build HTML response
-        response = make_response(csv)
+        if len(_from) == 0 and len(_to) == 0:
+            period = "All"
+        elif _from == _to:
+            period = _from
+        else:
+            period = f"{_from}_{_to}"
+        if _table == export.MINUTES:
+            period = "Minutes_" + period
+        file_name = f"CpinData_{period}.csv"
+
+        # Build the streamed response, compressed on the fly if possible
+        if request.accept_encodings["gzip"] > 0:
+            response = Response(export.gzip_chunks(chunks), mimetype="text/csv")
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(chunks, mimetype="text/csv")
+        response.headers["Vary"] = "Accept-Encoding"
         cd = f"attachment; filename={file_name}"
         response.headers["Content-Disposition"] = cd
-        response.mimetype = "text/csv"
         return response
 
     except Exception:
@@ -96,7 +143,7 @@ def get_csv():
 # Returns JSON response containing current data
 def get_json_data_current():
     '''Returns JSON response containing current data'''
-    db = Database("data/db.sqlite")
+    db = connections.reader()
     # Current
     rows_cur = db.execute("SELECT * FROM current")
     # All time
@@ -115,11 +162,11 @@ def get_json_data_current():
         consumed_self_rel_alltime = 100.0
 
     # Today
-    day_string = str(date.today())
-    rows_today = db.execute(f"SELECT * FROM days WHERE date='{day_string}'")
-    produced_today = rows_today[0][2] - rows_today[0][1]
-    consumed_today = rows_today[0][4] - rows_today[0][3]
-    fed_in_today = rows_today[0][6] - rows_today[0][5]
+    day_string = str(get_today())
+    row_today = history.get_row(db, "days", day_string)
+    produced_today = row_today[2] - row_today[1]
+    consumed_today = row_today[4] - row_today[3]
+    fed_in_today = row_today[6] - row_today[5]
 
     # Compute todays autarky
     consumed_self_today = produced_today - fed_in_today
@@ -159,43 +206,30 @@ def get_json_data_current():
     return json.dumps(data)
 
 
-# Returns JSON response containing available years
+# Returns JSON response containing the statistics
 def get_json_data_statistics():
     '''Returns JSON response containing inverter statistics.'''
     # Date based data
     start_date = config.config_data['device']['start_date']
-    num_days = (date.today() - start_date).days
-    # Averages
-    db = Database("data/db.sqlite")
-    rows_all_time = db.execute("SELECT * FROM all_time")
-    total_production_kwh = rows_all_time[0][2]
-    average_production_kwhpd = total_production_kwh / num_days
-    # Best day
-    rows_best_day = db.execute(
-        "SELECT date, MAX(produced_b-produced_a) AS produced_kwh FROM days")
-    # Best month
-    rows_best_month = db.execute(
-        "SELECT date, MAX(produced_b-produced_a) AS produced_kwh FROM months")
-    # Best year
-    rows_best_year = db.execute(
-        "SELECT date, MAX(produced_b-produced_a) AS produced_kwh FROM years")
-    # Highest production
-    rows_highest_prod = db.execute(
-        "SELECT * FROM highscores WHERE type IS 'production'")
+    num_days = (get_today() - start_date).days
+    # Maintained by the grabber with each tick
+    db = connections.reader()
+    row = stats.get(db)
+    average_production_kwhpd = row[9] / num_days
     # Assemble result data set
     data = {
         "state": "ok",
         "start_of_operation": str(start_date),
         "days_of_operation": num_days,
         "average_daily_production_kwh": average_production_kwhpd,
-        "best_day_date": rows_best_day[0][0],
-        "best_day_production_kwh": rows_best_day[0][1],
-        "best_month_date": rows_best_month[0][0],
-        "best_month_production_kwh": rows_best_month[0][1],
-        "best_year_date": rows_best_year[0][0],
-        "best_year_production_kwh": rows_best_year[0][1],
-        "highest_production_w": rows_highest_prod[0][2] * 1000.0,
-        "highest_production_date": rows_highest_prod[0][1],
+        "best_day_date": row[1],
+        "best_day_production_kwh": row[2],
+        "best_month_date": row[3],
+        "best_month_production_kwh": row[4],
+        "best_year_date": row[5],
+        "best_year_production_kwh": row[6],
+        "highest_production_w": row[8] * 1000.0,
+        "highest_production_date": row[7],
     }
     return json.dumps(data)
 
@@ -203,12 +237,13 @@ def get_json_data_statistics():
 # Returns JSON response containing available years
 def get_json_data_dates():
     '''Returns JSON response containing available years.'''
-    db = Database("data/db.sqlite")
+    db = connections.reader()
     rows = db.execute("SELECT min(date) FROM years")
+    # The years table is empty until the grabber wrote its first energy totals
     data = {
         "state": "ok",
-        "year_min": rows[0][0],
-        "year_max": int(date.today().strftime("%Y")),
+        "year_min": None if rows[0][0] is None else int(rows[0][0]),
+        "year_max": int(get_today().strftime("%Y")),
     }
     return json.dumps(data)
 
@@ -216,13 +251,8 @@ def get_json_data_dates():
 # Returns JSON response containing history details
 def get_json_data_history_details(table, date_search_string):
     '''Returns JSON response containing history details.'''
-    db = Database("data/db.sqlite")
-    if len(date_search_string) > 0:
-        rows = db.execute(
-            f"SELECT * FROM {table} WHERE date LIKE '{date_search_string}%'")
-    else:
-        rows = db.execute(
-            f"SELECT * FROM {table}")
+    db = connections.reader()
+    rows = history.get_rows(db, table, date_search_string)
     # Build results
     data = []
     for row in rows:
@@ -239,31 +269,121 @@ def get_json_data_history_details(table, date_search_string):
     return json.dumps(data)
 
 
-# Returns JSON response containing monthly data for a year
-def get_json_data_real_time(hours):
-    '''Returns JSON response containing monthly data for a year.'''
+# Returns JSON response containing the real time samples of the last hours.
+# With a cursor (minute ID or Unix timestamp) only newer samples are
+# returned, together with the cursor for the next request.
+def get_json_data_real_time(hours, since=None):
+    '''Returns JSON response containing the real time samples of the last hours.'''
     num_results = int(hours) * 60
-    db = Database("data/db.sqlite")
-    rows = db.execute(f"SELECT * FROM real_time "
-                      f"ORDER BY ID DESC LIMIT {num_results}")
-    return json.dumps(rows)
+    db = connections.reader()
+    if since is None:
+        rows = real_time.get_latest(db, num_results)
+        return json.dumps(rows)
+    rows, cursor = real_time.get_since(db, int(since), num_results)
+    data = {
+        "state": "ok",
+        "cursor": cursor,
+        "values": rows
+    }
+    return json.dumps(data)
 
 
-# Returns JSON response containing historical data
-def get_json_data_history(table, search_date):
+# Returns JSON response containing power samples of a date range
+def get_json_data_power(from_string, to_string, points):
+    '''Returns JSON response containing power samples of a date range.'''
+    from_date = date.fromisoformat(from_string)
+    to_date = date.fromisoformat(to_string)
+    retention = rollup.get_retention(config.config_data)
+    resolution = rollup.pick_resolution(
+        retention, from_date, to_date, int(points))
+    db = connections.reader()
+    data = {
+        "state": "ok",
+        "resolution_min": resolution,
+        "values": rollup.get_series(db, resolution, from_string, to_string)
+    }
+    return json.dumps(data)
+
+
+# Returns JSON response containing the latest values of each device
+def get_json_data_devices():
+    '''Returns JSON response containing the latest values of each device.'''
+    db = connections.reader()
+    data = []
+    for row in device_pool.get_devices(db):
+        data.append({
+            "name": row[0],
+            "type": row[1],
+            "online": bool(row[2]),
+            "updated": row[3],
+            "poll_ms": row[4],
+            "currently_produced_w": row[5] * 1000.0,  # kW -> W
+            "currently_consumed_grid_w": row[6] * 1000.0,  # kW -> W
+            "currently_consumed_pv_w": row[7] * 1000.0,  # kW -> W
+            "currently_consumed_total_w": row[8] * 1000.0,  # kW -> W
+            "currently_fed_in_w": row[9] * 1000.0,  # kW -> W
+            "total_produced_kwh": row[10],
+            "total_consumed_kwh": row[11],
+            "total_fed_in_kwh": row[12]
+        })
+    return json.dumps(data)
+
+
+# Returns JSON response containing the KPIs of a date range per bucket and
+# in total, computed from the minute samples or the daily energy counters
+def get_json_data_analytics(from_string, to_string, source, bucket, points, percentiles):
+    '''Returns JSON response containing the KPIs of a date range.'''
+    num_days = (date.fromisoformat(to_string) - date.fromisoformat(from_string)).days + 1
+    if num_days > MAX_ANALYTICS_DAYS:
+        raise ValueError(f"At most {MAX_ANALYTICS_DAYS} days per analytics query")
+    if bucket not in analytics.BUCKETS:
+        raise ValueError(f"Unknown analytics bucket '{bucket}'")
+    points = max(1, min(int(points), analytics.MAX_CURVE_POINTS))
+    if percentiles:
+        percentiles = [float(percentile) for percentile in percentiles.split(",")]
+        if not all(0.0 <= percentile <= 100.0 for percentile in percentiles):
+            raise ValueError("Percentiles must be between 0 and 100")
+    else:
+        percentiles = analytics.DEFAULT_PERCENTILES
+    # Only the days before the current one of the grabber are over
+    today = get_today()
+    if source == analytics.MINUTES:
+        # The grabber deletes the minutes before the cutoff
+        retention = rollup.get_retention(config.config_data)
+        cutoff = rollup.get_cutoff_date(retention, rollup.MINUTE, today)
+        if cutoff is not None:
+            day_cache.drop_before(str(cutoff))
+            from_string = max(from_string, str(cutoff))
+    if from_string > to_string:
+        data = {
+            "state": "nodata"
+        }
+        return json.dumps(data)
+    prices = {name: float(value) for name, value in config.config_data['prices'].items()}
+    db = connections.reader()
+    columns = analytics.load(db, source, from_string, to_string, day_cache, str(today))
+    data = analytics.compute(columns, bucket, prices, percentiles, points)
+    if data["state"] == "ok":
+        data.update({"from": from_string, "to": to_string, "source": source, "bucket": bucket})
+    return json.dumps(data)
+
+
+# Returns JSON response containing historical data. The high res data of
+# a day is a JSON string, or the compact binary format in base64.
+def get_json_data_history(table, search_date, high_res_format="json"):
     '''Returns JSON response containing historical data.'''
-    db = Database("data/db.sqlite")
-    rows = db.execute(f"SELECT * FROM {table} WHERE date='{search_date}'")
+    db = connections.reader()
+    row = history.get_row(db, table, search_date)
     # No data?
-    if not rows:
+    if row is None:
         data = {
             "state": "nodata"
         }
         return json.dumps(data)
     # Compute data from sqlite columns
-    produced = rows[0][2] - rows[0][1]
-    consumed = rows[0][4] - rows[0][3]
-    fed_in = rows[0][6] - rows[0][5]
+    produced = row[2] - row[1]
+    consumed = row[4] - row[3]
+    fed_in = row[6] - row[5]
     # Compute feed in
     consumed_self = produced - fed_in
     consumed_grid = consumed - consumed_self
@@ -292,13 +412,10 @@ def get_json_data_history(table, search_date):
 
     # High resolution data (only for days)
     daily_high_res_data = ""
-    if table == "days":
-        rows = db.execute(f"SELECT * FROM high_res WHERE date='{search_date}'")
-        if rows:
-            hrdata = rows[0][1]
-            if hrdata[-1] == ',':
-                hrdata = hrdata[:-1]
-            daily_high_res_data = "[" + hrdata + "]"
+    if table == "days" and high_res_format == "base64":
+        daily_high_res_data = rollup.get_day_base64(db, search_date)
+    elif table == "days":
+        daily_high_res_data = rollup.get_day_json(db, search_date)
 
     # Build response data
     data = {
@@ -325,48 +442,301 @@ def get_json_data_history(table, search_date):
 # .../query?type=current
 # .../query?type=dates
 # .../query?type=historical&table=days&date=2022-08-03
+# .../query?type=power&from=2022-08-01&to=2022-08-07&points=500
+# .../query?type=real_time&h=24&since=28700000
+# .../query?type=devices
+# .../query?type=analytics&from=2022-01-01&to=2022-12-31&bucket=month
 # etc.
 @app.route("/query", methods=['GET'])
 def handle_request():
     '''Answers all query requests.'''
+    # Unknown types share one label, so clients can't add time series
+    _type = request.args.get('type', '')
+    label = _type if _type in QUERY_TYPES else "unknown"
+    with QUERY_SECONDS.time(label):
+        etag, cache_control = get_validators(label)
+        if etag_matches(etag):
+            # The browser has this response already, no need to compute it
+            response = make_response("", 304)
+        else:
+            data = answer_query(label)
+            if data is None:
+                data = {"state": "error"}
+                return json.dumps(data)
+            response = make_response(data)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control
+        return response
+
+
+# Returns the current day in the configured time zone, like the grabber
+# that writes the data of this day
+def get_today():
+    '''Returns the current day in the configured time zone.'''
+    return datetime.fromtimestamp(time.time()).date()
+
+
+# Returns True if the query answers power samples, which the retention
+# deletes or coarsens
+def is_retained(_type):
+    '''Returns True if the query answers power samples.'''
+    if _type == "historical":
+        return request.args.get('table') in RETAINED_TABLES
+    return _type in RETAINED_TYPES
+
+
+# Returns True if the query covers a period that is over
+def is_closed_period(_type):
+    '''Returns True if the query covers a period that is over.'''
+    today = get_today()
+    _date = request.args.get('date', '')
+    if _type == "historical":
+        current = {
+            "days": str(today),
+            "months": today.strftime("%Y-%m"),
+            "years": today.strftime("%Y"),
+        }.get(request.args.get('table'))
+        return current is not None and _date < current
+    elif _type == "days_in_month":
+        return _date < today.strftime("%Y-%m")
+    elif _type == "months_in_year":
+        return _date < today.strftime("%Y")
+    elif _type in ("power", "analytics"):
+        return request.args.get('to', request.args.get('from', '')) < str(today)
+    return False
+
+
+# Returns the ETag and Cache-Control header of a query
+def get_validators(_type):
+    '''Returns the ETag and Cache-Control header of a query.'''
+    global config_hash
+    if config_hash is None:
+        # Prices etc. are part of the responses
+        text = version.get_version() + json.dumps(config.config_data, sort_keys=True, default=str)
+        config_hash = hashlib.sha1(text.encode()).hexdigest()[:8]
+    key = json.dumps(sorted(request.args.items()))
+    key_hash = hashlib.sha1(key.encode()).hexdigest()[:16]
+    if is_closed_period(_type):
+        # Data of a closed period does not change anymore, except for the
+        # power samples removed by the retention
+        if is_retained(_type):
+            oldest = json.dumps(rollup.get_oldest_dates(connections.reader()))
+            key_hash = hashlib.sha1(oldest.encode()).hexdigest()[:8] + "-" + key_hash
+        return (f"{config_hash}-{key_hash}",
+                f"public, max-age={CLOSED_PERIOD_MAX_AGE_S}")
+    # Anything else is valid until the grabber commits new data
+    generation = connections.get_data_version()
+    return (f"{config_hash}-{INSTANCE_ID}-{generation}-{key_hash}",
+            "no-cache")
+
+
+# Returns True if the browser sent the given ETag in If-None-Match
+def etag_matches(etag):
+    '''Returns True if the browser sent the given ETag in If-None-Match.'''
+    for tag in request.if_none_match.as_set():
+        for suffix in COMPRESSION_SUFFIXES:
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)]
+        if tag == etag:
+            return True
+    return False
+
+
+# Answers a query request (None on errors)
+def answer_query(label):
+    '''Answers a query request (None on errors).'''
     try:
         _type = request.args['type']
         logging.debug(f"Server: REST request of type '{_type}' received")
-
-        if _type == "current":
-            data = get_json_data_current()
-            return data
-        elif _type == "dates":
-            data = get_json_data_dates()
-            return data
-        elif _type == "historical":
-            table = request.args['table']
-            _date = request.args['date']
-            data = get_json_data_history(table, _date)
-            return data
-        elif _type == "real_time":
-            hours = request.args['h']
-            data = get_json_data_real_time(hours)
-            return data
-        elif _type == "days_in_month":
-            _month = request.args['date']
-            data = get_json_data_history_details("days", _month)
-            return data
-        elif _type == "months_in_year":
-            _year = request.args['date']
-            data = get_json_data_history_details("months", _year)
-            return data
-        elif _type == "years_in_all_time":
-            data = get_json_data_history_details("years", "")
-            return data
-        elif _type == "statistics":
-            data = get_json_data_statistics()
-            return data
+        key = tuple(sorted(request.args.items()))
+        return cache.get(key, label, lambda: get_query_data(request.args))
 
     except Exception:
+        QUERY_ERRORS.inc(label)
         logging.exception("Error while handling HTTP request")
-        data = {"state": "error"}
-        return json.dumps(data)
+        return None
+
+
+# Returns the JSON response of a query
+def get_query_data(args):
+    '''Returns the JSON response of a query.'''
+    _type = args['type']
+    if _type == "current":
+        data = get_json_data_current()
+        return data
+    elif _type == "dates":
+        data = get_json_data_dates()
+        return data
+    elif _type == "historical":
+        table = args['table']
+        _date = args['date']
+        high_res_format = args.get('high_res', "json")
+        data = get_json_data_history(table, _date, high_res_format)
+        return data
+    elif _type == "real_time":
+        hours = args['h']
+        since = args.get('since')
+        data = get_json_data_real_time(hours, since)
+        return data
+    elif _type == "days_in_month":
+        _month = args['date']
+        data = get_json_data_history_details("days", _month)
+        return data
+    elif _type == "months_in_year":
+        _year = args['date']
+        data = get_json_data_history_details("months", _year)
+        return data
+    elif _type == "years_in_all_time":
+        data = get_json_data_history_details("years", "")
+        return data
+    elif _type == "statistics":
+        data = get_json_data_statistics()
+        return data
+    elif _type == "power":
+        _from = args['from']
+        _to = args.get('to', _from)
+        points = args.get('points', 1440)
+        data = get_json_data_power(_from, _to, points)
+        return data
+    elif _type == "devices":
+        data = get_json_data_devices()
+        return data
+    elif _type == "name":
+        data = json.dumps(config.config_data['cpin_data_collector']['name'])
+        return data
+    elif _type == "analytics":
+        _from = args['from']
+        _to = args.get('to', _from)
+        source = args.get('source', analytics.MINUTES)
+        bucket = args.get('bucket', "day")
+        points = args.get('points', analytics.DEFAULT_CURVE_POINTS)
+        percentiles = args.get('percentiles', "")
+        data = get_json_data_analytics(_from, _to, source, bucket, points, percentiles)
+        return data
+    raise ValueError(f"Unknown query type '{_type}'")
+
+
+# Answers several queries at once from one snapshot of the data base. The
+# body is a JSON list with the parameters of each query, e.g.
+# [{"type": "current"}, {"type": "real_time", "h": 24}], the response is
+# the list of their results in the same order.
+@app.route("/batch", methods=['POST'])
+def handle_batch():
+    '''Answers several queries at once from one snapshot of the data base.'''
+    with BATCH_SECONDS.time():
+        queries = request.get_json(silent=True)
+        if (not isinstance(queries, list) or len(queries) > MAX_BATCH_QUERIES
+                or not all(isinstance(query, dict) for query in queries)):
+            data = {"state": "error", "message": f"Expected a list of at most "
+                                                 f"{MAX_BATCH_QUERIES} queries"}
+            return json.dumps(data), 400
+        # Same parameters as in a query string
+        queries = [{key: str(value) for key, value in query.items()} for query in queries]
+        key = ("batch", json.dumps(queries, sort_keys=True))
+        response = make_response(cache.get(key, "batch", lambda: get_batch_data(queries)))
+        response.mimetype = "application/json"
+        return response
+
+
+# Returns the JSON list of the results of several queries
+def get_batch_data(queries):
+    '''Returns the JSON list of the results of several queries.'''
+    results = []
+    # All queries of the thread use its connection, so they see the same data
+    with connections.reader().read_transaction():
+        for args in queries:
+            _type = args.get('type', '')
+            label = _type if _type in QUERY_TYPES else "unknown"
+            try:
+                results.append(get_query_data(args))
+            except Exception:
+                QUERY_ERRORS.inc(label)
+                logging.exception(f"Error while answering query '{_type}' of a batch")
+                results.append(json.dumps({"state": "error"}))
+    return "[" + ",".join(results) + "]"
+
+
+# Returns the minute samples of a range of days in the compact binary
+# format of high_res, as application/octet-stream or as base64 text
+# .../high_res?from=2022-08-01&to=2022-08-31
+# .../high_res?from=2022-08-01&encoding=base64
+@app.route("/high_res", methods=['GET'])
+def handle_high_res():
+    '''Returns the minute samples of a range of days in the compact binary format.'''
+    try:
+        _from = request.args['from']
+        _to = request.args.get('to', _from)
+        encoding = request.args.get('encoding', "binary")
+        if encoding not in ("binary", "base64"):
+            raise ValueError(f"Unknown encoding '{encoding}'")
+        num_days = (date.fromisoformat(_to) - date.fromisoformat(_from)).days + 1
+        if num_days > MAX_HIGH_RES_DAYS:
+            raise ValueError(f"At most {MAX_HIGH_RES_DAYS} days per request")
+        key = ("high_res", _from, _to)
+        data = cache.get(key, "high_res", lambda: high_res.get_range_binary(
+            connections.reader(), _from, _to))
+    except Exception:
+        logging.exception("Bad high res request")
+        return json.dumps({"state": "error"}), 404
+
+    if encoding == "base64":
+        # Compressed by Flask-Compress like all text responses
+        response = make_response(base64.b64encode(data))
+        response.mimetype = "text/plain"
+        return response
+    response = make_response(data)
+    response.mimetype = "application/octet-stream"
+    # Flask-Compress leaves binary responses alone, the deltas of smooth
+    # curves compress well though
+    response.headers["Vary"] = "Accept-Encoding"
+    if request.accept_encodings["gzip"] > 0:
+        response.set_data(gzip.compress(data, export.GZIP_LEVEL))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+# Metrics of the web server and the grabber in Prometheus text format
+@app.route("/metrics", methods=['GET'])
+def handle_metrics():
+    '''Returns the metrics of the web server and the grabber.'''
+    text = metrics.render(metrics.collect(metrics.GRABBER_METRICS_FILE_NAME))
+    response = make_response(text)
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+# Returns the dashboard events of the latest tick
+def get_stream_events():
+    '''Returns the dashboard events of the latest tick.'''
+    # Shares the cached response with the /query?type=current requests
+    current = cache.get((("type", "current"),), "current", get_json_data_current)
+    events = [("current", current)]
+    rows = real_time.get_latest(connections.reader(), 2)
+    if len(rows) > 0:
+        events.append(("real_time", json.dumps(rows[0])))
+    return events
+
+
+# Pushes the current data of each tick and the real time sample of each
+# minute to the dashboard as Server-Sent Events
+@app.route("/stream", methods=['GET'])
+def handle_stream():
+    '''Pushes the dashboard data as Server-Sent Events.'''
+    subscriber = broadcaster.subscribe()
+    if subscriber is None:
+        # The dashboard falls back to polling
+        logging.warning("Server: all stream slots are taken")
+        response = make_response(json.dumps({"state": "busy"}), 503)
+        response.headers["Retry-After"] = "60"
+        return response
+    response = Response(broadcaster.messages(subscriber), mimetype="text/event-stream")
+    # Frees the slot even if the client left before the first message
+    response.call_on_close(lambda: broadcaster.unsubscribe(subscriber))
+    response.headers["Cache-Control"] = "no-cache"
+    # Keeps reverse proxies from buffering the events
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 
 @app.route("/name", methods=['GET'])
 def handle_name():
@@ -380,11 +750,24 @@ def handle_name():
         return json.dumps(data)
 
 
+# Sets the time zone environment variable
+def set_time_zone(tz):
+    '''Sets the time zone environment variable.'''
+    if tz is None:
+        logging.warning("Server: Warning: No time zone set")
+    else:
+        logging.info(f"Server: Setting time zone to {tz}")
+        os.environ['TZ'] = tz
+        time.tzset()
+        logging.info(f"Server: Time is now {time.strftime('%X %x %Z')}")
+
+
 # Main loop
 def main():
     '''Main loop.'''
 
     global config
+    global broadcaster
 
     # Set up logging
     logging.basicConfig(
@@ -406,11 +789,25 @@ def main():
     # Set log level
     logging.getLogger().setLevel(config.log_level)
 
+    # Set time zone, the current day must be the one of the grabber
+    set_time_zone(config.config_data.get("time_zone"))
+
+    # Cache lifetime of the query responses per type
+    ttls_s = config.config_data['server'].get('query_cache_ttl_s') or {}
+    cache.ttls_s.update(ttls_s)
+
+    # Each open stream occupies a thread, so their number is capped
+    max_streams = int(config.config_data['server'].get(
+        'stream_max_clients', stream.DEFAULT_MAX_SUBSCRIBERS))
+    broadcaster = stream.Broadcaster(
+        connections.get_data_version, get_stream_events, max_streams)
+
     # Start the web server
     from waitress import serve
     serve(app,
           host=config.config_data['server']['ip'],
-          port=config.config_data['server']['port'])
+          port=config.config_data['server']['port'],
+          threads=NUM_REQUEST_THREADS + max_streams)
 
     # Exit
     logging.info("Server: Exiting main loop")
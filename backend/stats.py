@@ -0,0 +1,127 @@
+import sys
+import logging
+from os.path import exists
+
+# Project imports
+from database import Database
+
+
+# Single row with everything shown on the statistics page, kept up to
+# date by the grabber so the web server does not have to scan the tables
+CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS statistics ("
+    "id INTEGER PRIMARY KEY CHECK (id = 1), "
+    "best_day_date TEXT, best_day_kwh REAL, "
+    "best_month_date TEXT, best_month_kwh REAL, "
+    "best_year_date TEXT, best_year_kwh REAL, "
+    "peak_power_date TEXT, peak_power_kw REAL, "
+    "total_produced_kwh REAL)")
+INIT_ROW = (
+    "INSERT OR IGNORE INTO statistics VALUES "
+    "(1, '...', 0.0, '...', 0.0, '...', 0.0, '...', 0.0, 0.0)")
+SELECT_PERIODS = (
+    "SELECT "
+    "(SELECT produced_b - produced_a FROM days WHERE date = ?), "
+    "(SELECT produced_b - produced_a FROM months WHERE date = ?), "
+    "(SELECT produced_b - produced_a FROM years WHERE date = ?)")
+# All expressions see the values from before the update
+UPDATE_ROW = (
+    "UPDATE statistics SET "
+    "best_day_date = CASE WHEN :day_kwh > best_day_kwh "
+    "THEN :day ELSE best_day_date END, "
+    "best_day_kwh = MAX(best_day_kwh, :day_kwh), "
+    "best_month_date = CASE WHEN :month_kwh > best_month_kwh "
+    "THEN :month ELSE best_month_date END, "
+    "best_month_kwh = MAX(best_month_kwh, :month_kwh), "
+    "best_year_date = CASE WHEN :year_kwh > best_year_kwh "
+    "THEN :year ELSE best_year_date END, "
+    "best_year_kwh = MAX(best_year_kwh, :year_kwh), "
+    "peak_power_date = CASE WHEN :power_kw > peak_power_kw "
+    "THEN :day ELSE peak_power_date END, "
+    "peak_power_kw = MAX(peak_power_kw, :power_kw), "
+    "total_produced_kwh = :total_produced_kwh "
+    "WHERE id = 1")
+
+# Periods with the most production, tables and column prefixes
+BEST_PERIODS = [
+    ("days", "best_day"),
+    ("months", "best_month"),
+    ("years", "best_year"),
+]
+
+
+# Creates the statistics table with its row if it does not exist
+def create_table(db):
+    '''Creates the statistics table with its row if it does not exist.'''
+    db.execute(CREATE_TABLE)
+    db.execute(INIT_ROW)
+
+
+# Takes the values of a tick into the statistics
+def update(db, day_string, month_string, year_string, power_kw, total_produced_kwh):
+    '''Takes the values of a tick into the statistics.'''
+    # The counter rows of the tick are written already
+    day_kwh, month_kwh, year_kwh = db.execute(
+        SELECT_PERIODS, (day_string, month_string, year_string))[0]
+    db.execute(UPDATE_ROW, {
+        "day": day_string,
+        "day_kwh": day_kwh or 0.0,
+        "month": month_string,
+        "month_kwh": month_kwh or 0.0,
+        "year": year_string,
+        "year_kwh": year_kwh or 0.0,
+        "power_kw": power_kw,
+        "total_produced_kwh": total_produced_kwh,
+    })
+
+
+# Recomputes the statistics from the counter tables and the high score
+def rebuild(db):
+    '''Recomputes the statistics from the counter tables and the high score.'''
+    db.execute("DELETE FROM statistics")
+    db.execute(INIT_ROW)
+    for table, prefix in BEST_PERIODS:
+        # The earliest period wins a tie, like MAX() over the table did
+        rows = db.execute(
+            f"SELECT date, produced_b - produced_a AS produced FROM {table} "
+            f"ORDER BY produced DESC, date LIMIT 1")
+        if rows:
+            db.execute(f"UPDATE statistics SET {prefix}_date = ?, {prefix}_kwh = ?",
+                       (rows[0][0], rows[0][1]))
+    rows = db.execute("SELECT date, value FROM highscores WHERE type = 'production'")
+    if rows:
+        db.execute("UPDATE statistics SET peak_power_date = ?, peak_power_kw = ?", rows[0])
+    rows = db.execute("SELECT produced_b FROM all_time")
+    if rows:
+        db.execute("UPDATE statistics SET total_produced_kwh = ?", rows[0])
+
+
+# Returns the statistics row
+def get(db):
+    '''Returns the statistics row.'''
+    return db.execute("SELECT * FROM statistics")[0]
+
+
+# Rebuilds the statistics of the given data base file (default: data/db.sqlite),
+# e.g. after the counter tables were fixed by hand
+def main():
+    '''Rebuilds the statistics of the given data base file (default: data/db.sqlite).'''
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S')
+    file_name = sys.argv[1] if len(sys.argv) > 1 else "data/db.sqlite"
+    if not exists(file_name):
+        logging.error(f"Statistics: data base {file_name} does not exist")
+        exit(1)
+    db = Database(file_name)
+    with db.transaction():
+        create_table(db)
+        rebuild(db)
+    logging.info(f"Statistics: rebuilt {file_name}: {get(db)}")
+    db.close()
+
+
+# Main entry point of the application
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import time
+import queue
+import logging
+import threading
+
+# Project imports
+import metrics
+
+
+# Seconds between two checks of the data base for a new tick
+POLL_INTERVAL_S = 0.5
+# Seconds between two keep-alive comments, also detects closed connections
+KEEP_ALIVE_S = 15.0
+# Open streams at most, each one occupies a web server thread
+DEFAULT_MAX_SUBSCRIBERS = 4
+# Events kept for a slow subscriber, older ones are dropped
+MAX_QUEUED_EVENTS = 16
+# Milliseconds a browser waits before it reconnects
+RETRY_MS = 5000
+
+# Metrics of the push channel
+EVENTS = metrics.counter(
+    "cpin_stream_events_total", "Events pushed to the stream subscribers", ["event"])
+REJECTED = metrics.counter(
+    "cpin_stream_rejected_total", "Stream requests rejected because all slots were taken")
+
+
+# Formats an event in the Server-Sent Events wire format
+def format_event(event, data):
+    '''Formats an event in the Server-Sent Events wire format.'''
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+# Pushes events to all subscribers of the stream. A single producer thread
+# watches the data base and fans each event out to the subscriber queues,
+# so the work per tick does not grow with the number of open dashboards.
+class Broadcaster:
+    def __init__(
+            self,
+            get_generation,
+            get_events,
+            max_subscribers=DEFAULT_MAX_SUBSCRIBERS,
+            poll_interval_s=POLL_INTERVAL_S):
+        self.get_generation = get_generation
+        self.get_events = get_events  # Returns (event, data) pairs
+        self.max_subscribers = max_subscribers
+        self.poll_interval_s = poll_interval_s
+        self.subscribers = set()
+        self.latest = {}  # Latest message of each event, queued for new subscribers
+        self.generation = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        '''Returns the queue of a new subscriber, or None if all slots are taken.'''
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                REJECTED.inc()
+                return None
+            subscriber = queue.Queue(MAX_QUEUED_EVENTS)
+            # Starts with the latest events, published ones follow in order
+            for message in self.latest.values():
+                subscriber.put_nowait(message)
+            self.subscribers.add(subscriber)
+            # The producer only runs while someone listens
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, name="stream", daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        '''Removes a subscriber.'''
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def loop(self):
+        '''Publishes the events of each new tick until the last subscriber left.'''
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+            try:
+                self.poll()
+            except Exception:
+                logging.exception("Server: producing stream events failed")
+            time.sleep(self.poll_interval_s)
+
+    def poll(self):
+        '''Publishes the events that changed, if the data base changed.'''
+        generation = self.get_generation()
+        if generation == self.generation:
+            return
+        self.generation = generation
+        for event, data in self.get_events():
+            message = format_event(event, data)
+            # A real time sample only changes once per minute
+            if self.latest.get(event) != message:
+                self.publish(event, message)
+
+    def publish(self, event, message):
+        '''Hands a message to all subscribers.'''
+        EVENTS.inc(event)
+        with self.lock:
+            self.latest[event] = message
+            for subscriber in self.subscribers:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # The client does not keep up, drop its oldest event
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+                    subscriber.put_nowait(message)
+
+    def messages(self, subscriber, keep_alive_s=KEEP_ALIVE_S):
+        '''Yields the messages of a subscriber until the client disconnects.'''
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=keep_alive_s)
+                except queue.Empty:
+                    # Writing to a closed connection ends the generator
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,165 @@
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from types import SimpleNamespace
+from datetime import date, datetime
+
+# Make the backend modules importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import grabber  # noqa: E402
+import real_time  # noqa: E402
+from database import ConnectionManager  # noqa: E402
+from devices.Dummy import Dummy  # noqa: E402
+
+
+NUM_TICKS = 2000
+INTERVAL_S = 5
+
+
+# Creates the tables as they were before the batched write path
+def legacy_create_db(file_name):
+    '''Creates the tables as they were before the batched write path.'''
+    connection = sqlite3.connect(file_name)
+    cursor = connection.cursor()
+    for name in ["days", "months", "years", "all_time"]:
+        cursor.execute(f"create table {name} ("
+                       "date STRING PRIMARY KEY,"
+                       "produced_a REAL, produced_b REAL,"
+                       "consumed_a REAL, consumed_b REAL,"
+                       "fed_in_a REAL, fed_in_b REAL)")
+    cursor.execute("create table current"
+                   "(date STRING PRIMARY KEY, "
+                   "produced REAL, consumed_grid REAL, consumed_pv REAL, "
+                   "consumed_total REAL, fed_in REAL)")
+    cursor.execute("create table real_time"
+                   "(ID INTEGER PRIMARY KEY AUTOINCREMENT, "
+                   "time STRING, produced REAL, consumed REAL, fed_in REAL)")
+    cursor.execute("create table highscores "
+                   "(type STRING PRIMARY KEY, date STRING, value REAL)")
+    cursor.execute("create table high_res "
+                   "(date STRING PRIMARY KEY, hrvalues STRING)")
+    connection.commit()
+    connection.close()
+
+
+# One tick of the old write path: new connection, SELECT-then-write
+def legacy_tick(file_name, device, capture_minute):
+    '''One tick of the old write path: new connection, SELECT-then-write.'''
+    connection = sqlite3.connect(file_name)
+    cursor = connection.cursor()
+    year_string = date.today().strftime("%Y")
+    month_string = year_string + "-" + date.today().strftime("%m")
+    day_string = month_string + "-" + date.today().strftime("%d")
+    for table, key in [("days", day_string), ("months", month_string),
+                       ("years", year_string), ("all_time", "all_time")]:
+        cursor.execute(f"SELECT * FROM {table} WHERE date='{key}'")
+        if not cursor.fetchall():
+            cursor.execute(f"INSERT INTO {table} VALUES ('{key}',"
+                           f"{device.total_energy_produced_kwh}, {device.total_energy_produced_kwh}, "
+                           f"{device.total_energy_consumed_kwh}, {device.total_energy_consumed_kwh}, "
+                           f"{device.total_energy_fed_in_kwh}, {device.total_energy_fed_in_kwh})")
+        else:
+            cursor.execute(f"UPDATE {table} SET "
+                           f"produced_b = {device.total_energy_produced_kwh}, "
+                           f"consumed_b = {device.total_energy_consumed_kwh}, "
+                           f"fed_in_b = {device.total_energy_fed_in_kwh} WHERE date='{key}'")
+    cursor.execute("SELECT * FROM current WHERE date='cur'")
+    if not cursor.fetchall():
+        cursor.execute(f"INSERT INTO current VALUES ('cur', "
+                       f"{device.current_power_produced_kw}, {device.current_power_consumed_from_grid_kw}, "
+                       f"{device.current_power_consumed_from_pv_kw}, {device.current_power_consumed_total_kw}, "
+                       f"{device.current_power_fed_in_kw})")
+    else:
+        cursor.execute(f"UPDATE current SET "
+                       f"produced = {device.current_power_produced_kw}, "
+                       f"consumed_grid = {device.current_power_consumed_from_grid_kw}, "
+                       f"consumed_pv = {device.current_power_consumed_from_pv_kw}, "
+                       f"consumed_total = {device.current_power_consumed_total_kw}, "
+                       f"fed_in = {device.current_power_fed_in_kw} WHERE date='cur'")
+    cursor.execute("CREATE TABLE IF NOT EXISTS highscores "
+                   "(type STRING PRIMARY KEY, date STRING, value REAL)")
+    cursor.execute("SELECT * FROM highscores WHERE type IS 'production'")
+    rows = cursor.fetchall()
+    if not rows:
+        cursor.execute("INSERT INTO highscores (type,date,value) VALUES('production','...',0.0);")
+        high_score = 0.0
+    else:
+        high_score = rows[0][2]
+    if device.current_power_produced_kw > high_score:
+        cursor.execute(f"UPDATE highscores SET value = {device.current_power_produced_kw}, "
+                       f"date = '{day_string}' WHERE type IS 'production'")
+    if capture_minute:
+        time_string = datetime.now().strftime("%H:%M")
+        cursor.execute(f"INSERT INTO real_time (time, produced, consumed, fed_in) "
+                       f"VALUES('{time_string}', {device.current_power_produced_kw}, "
+                       f"{device.current_power_consumed_total_kw}, {device.current_power_fed_in_kw})")
+        cursor.execute(f"DELETE FROM real_time WHERE ID IN (SELECT ID FROM real_time "
+                       f"ORDER BY ID DESC LIMIT -1 OFFSET {real_time.NUM_REAL_TIME_VALUES})")
+        cursor.execute("create table if not exists high_res (date STRING PRIMARY KEY, hrvalues STRING)")
+        cursor.execute(f"SELECT * FROM high_res WHERE date='{day_string}'")
+        rows = cursor.fetchall()
+        old_values = ""
+        if not rows:
+            cursor.execute(f"INSERT INTO high_res (date,hrvalues) VALUES ('{day_string}', '');")
+        else:
+            old_values = rows[0][1]
+        old_values += (f"[\"{time_string}\",{round(device.current_power_produced_kw, 3)},"
+                       f"{round(device.current_power_consumed_total_kw, 3)},"
+                       f"{round(device.current_power_fed_in_kw, 3)}],")
+        cursor.execute(f"UPDATE high_res SET hrvalues = '{old_values}' WHERE date='{day_string}'")
+    connection.commit()
+    connection.close()
+
+
+# Runs the old write path and returns ticks per second
+def benchmark_legacy():
+    '''Runs the old write path and returns ticks per second.'''
+    legacy_create_db(grabber.DB_FILE_NAME)
+    device = Dummy(None)
+    ticks_per_minute = 60 // INTERVAL_S
+    start = time.perf_counter()
+    for i in range(NUM_TICKS):
+        device.update()
+        legacy_tick(grabber.DB_FILE_NAME, device, i % ticks_per_minute == 0)
+    return NUM_TICKS / (time.perf_counter() - start)
+
+
+# Runs the current grabber write path and returns ticks per second
+def benchmark_current():
+    '''Runs the current grabber write path and returns ticks per second.'''
+    grabber.config = SimpleNamespace(config_data={"grabber": {"interval_s": INTERVAL_S}})
+    grabber.connections = ConnectionManager(grabber.DB_FILE_NAME)
+    grabber.create_new_db()
+    grabber.db = grabber.connections.writer()
+    device = Dummy(None)
+    # Simulated tick times, so minute samples are taken every 60 s as well
+    tick_time = time.time()
+    start = time.perf_counter()
+    for i in range(NUM_TICKS):
+        device.update()
+        with grabber.db.transaction():
+            grabber.write_tick(device, tick_time + i * INTERVAL_S)
+    ticks_per_second = NUM_TICKS / (time.perf_counter() - start)
+    grabber.connections.close()
+    return ticks_per_second
+
+
+# Main entry point of the benchmark
+def main():
+    '''Main entry point of the benchmark.'''
+    for name, benchmark in [("before (legacy)", benchmark_legacy),
+                            ("after (batched)", benchmark_current)]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            os.mkdir("data")
+            ticks_per_second = benchmark()
+            os.chdir("/")
+        print(f"{name:>16}: {ticks_per_second:8.1f} ticks/s")
+
+
+# Main entry point of the application
+if __name__ == "__main__":
+    main()
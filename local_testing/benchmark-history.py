@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import tempfile
+from datetime import date, timedelta
+
+# Make the backend modules importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import history  # noqa: E402
+import schema  # noqa: E402
+from database import Database  # noqa: E402
+
+
+NUM_YEARS = 20
+NUM_RUNS = 1000
+
+
+# Fills the counter tables with NUM_YEARS of daily data (old layout)
+def create_legacy_db(db):
+    '''Fills the counter tables with NUM_YEARS of daily data (old layout).'''
+    with db.transaction():
+        for name in ["days", "months", "years", "all_time"]:
+            db.execute(f"create table {name} (date STRING PRIMARY KEY,"
+                       "produced_a REAL, produced_b REAL,"
+                       "consumed_a REAL, consumed_b REAL,"
+                       "fed_in_a REAL, fed_in_b REAL)")
+        db.execute("create table high_res (date STRING PRIMARY KEY, hrvalues STRING)")
+        db.execute("create table real_time (ID INTEGER PRIMARY KEY AUTOINCREMENT, "
+                   "time STRING, produced REAL, consumed REAL, fed_in REAL)")
+        day = date.today() - timedelta(days=365 * NUM_YEARS)
+        while day <= date.today():
+            for table, key in [("days", day.strftime("%Y-%m-%d")),
+                               ("months", day.strftime("%Y-%m")),
+                               ("years", day.strftime("%Y"))]:
+                db.execute(f"INSERT OR REPLACE INTO {table} VALUES (?, 0, 1, 0, 1, 0, 1)", (key,))
+            day += timedelta(days=1)
+
+
+# Returns the average duration of a query in milliseconds
+def measure(query):
+    '''Returns the average duration of a query in milliseconds.'''
+    start = time.perf_counter()
+    for i in range(NUM_RUNS):
+        query()
+    return (time.perf_counter() - start) * 1000.0 / NUM_RUNS
+
+
+# Main entry point of the benchmark
+def main():
+    '''Main entry point of the benchmark.'''
+    year = str(date.today().year - NUM_YEARS // 2)
+    month = year + "-06"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = Database(os.path.join(tmp_dir, "db.sqlite"))
+        create_legacy_db(db)
+        like_month = measure(lambda: db.execute(f"SELECT * FROM days WHERE date LIKE '{month}%'"))
+        like_year = measure(lambda: db.execute(f"SELECT * FROM months WHERE date LIKE '{year}%'"))
+        schema.upgrade(db)
+        range_month = measure(lambda: history.get_rows(db, "days", month))
+        range_year = measure(lambda: history.get_rows(db, "months", year))
+    print(f"days_in_month:  LIKE {like_month:.3f} ms, key range {range_month:.3f} ms")
+    print(f"months_in_year: LIKE {like_year:.3f} ms, key range {range_year:.3f} ms")
+
+
+# Main entry point of the application
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+
+from pymodbus.constants import Endian
+from pymodbus.payload import BinaryPayloadDecoder
+
+# Make the backend modules importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from devices import modbus_plan  # noqa: E402
+
+
+NUM_RUNS = 20000
+BYTE_ORDER = "big"
+WORD_ORDER = "little"
+
+# Register map of a typical inverter
+REGISTER_MAP = {
+    'total_energy_produced': {'address': 3000, 'length': 2, 'type': 'uint32', 'scale': 0.001},
+    'total_energy_consumed': {'address': 3004, 'length': 2, 'type': 'uint32', 'scale': 0.001},
+    'total_energy_fed_in': {'address': 3008, 'length': 2, 'type': 'uint32', 'scale': 0.001},
+    'current_power_produced': {'address': 3012, 'length': 1, 'type': 'uint16', 'scale': 0.001},
+    'current_power_consumed_grid': {'address': 3014, 'length': 1, 'type': 'int16', 'scale': 0.001},
+    'current_power_fed_in': {'address': 3016, 'length': 1, 'type': 'uint16', 'scale': 0.001},
+}
+REGISTERS = list(range(100, 117))  # Response of a block read from 3000
+
+
+# Converts string endian specification to Endian enum (old code path)
+def legacy_get_endian(order):
+    '''Converts string endian specification to Endian enum (old code path).'''
+    if order.lower() == 'big':
+        return Endian.BIG
+    elif order.lower() == 'little':
+        return Endian.LITTLE
+    else:
+        raise ValueError(f"Invalid endian order: {order}")
+
+
+# Decodes one value with a new payload decoder (old code path)
+def legacy_decode(registers, register_config):
+    '''Decodes one value with a new payload decoder (old code path).'''
+    data_type = register_config['type']
+    decoder = BinaryPayloadDecoder.fromRegisters(
+        registers,
+        byteorder=legacy_get_endian(BYTE_ORDER),
+        wordorder=legacy_get_endian(WORD_ORDER)
+    )
+    if data_type == 'uint16':
+        value = decoder.decode_16bit_uint()
+    elif data_type == 'int16':
+        value = decoder.decode_16bit_int()
+    elif data_type == 'uint32':
+        value = decoder.decode_32bit_uint()
+    elif data_type == 'int32':
+        value = decoder.decode_32bit_int()
+    elif data_type == 'float32':
+        value = decoder.decode_32bit_float()
+    else:
+        raise ValueError(f"Unsupported data type: {data_type}")
+    return value * register_config.get('scale', 1.0)
+
+
+# Decodes all values of the map the old way
+def legacy_decode_all():
+    '''Decodes all values of the map the old way.'''
+    values = {}
+    for name, register_config in REGISTER_MAP.items():
+        offset = register_config['address'] - 3000
+        values[name] = legacy_decode(
+            REGISTERS[offset:offset + register_config['length']], register_config)
+    return values
+
+
+# Returns the average duration of a call in microseconds
+def measure(function):
+    '''Returns the average duration of a call in microseconds.'''
+    start = time.perf_counter()
+    for i in range(NUM_RUNS):
+        function()
+    return (time.perf_counter() - start) * 1000000.0 / NUM_RUNS
+
+
+# Main entry point of the benchmark
+def main():
+    '''Main entry point of the benchmark.'''
+    blocks = modbus_plan.plan_reads(REGISTER_MAP)
+    modbus_plan.compile_blocks(blocks, BYTE_ORDER, WORD_ORDER)
+    block = blocks[0]
+    assert modbus_plan.decode_block(block, REGISTERS) == legacy_decode_all()
+    legacy_us = measure(legacy_decode_all)
+    plan_us = measure(lambda: modbus_plan.decode_block(block, REGISTERS))
+    print(f"decode {len(REGISTER_MAP)} values: payload decoder {legacy_us:.1f} us, "
+          f"decode plan {plan_us:.1f} us ({legacy_us / plan_us:.0f}x)")
+
+
+# Main entry point of the application
+if __name__ == "__main__":
+    main()
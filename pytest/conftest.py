@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+import pytest
+
+import grabber
+from database import ConnectionManager
+
+
+# Creates a fresh data base of the grabber in a temporary data folder
+@pytest.fixture
+def grabber_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    monkeypatch.setattr(grabber, "config", SimpleNamespace(config_data={"grabber": {"interval_s": 5}}))
+    monkeypatch.setattr(grabber, "last_minute_id", None)
+    monkeypatch.setattr(grabber, "enqueued_hour_string", None)
+    monkeypatch.setattr(grabber, "packed_date_string", None)
+    monkeypatch.setattr(grabber, "connections", ConnectionManager(grabber.DB_FILE_NAME))
+    grabber.create_new_db()
+    monkeypatch.setattr(grabber, "db", grabber.connections.writer())
+    yield grabber.db
+    grabber.connections.close()
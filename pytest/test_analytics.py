@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+import analytics
+import high_res
+import schema
+from database import Database
+
+PRICES = {"price_per_grid_kwh": 0.3, "revenue_per_fed_in_kwh": 0.1}
+
+
+# Creates a data base with minute samples around the turn of a month
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        schema.create(db)
+        for day_string in ["2024-01-31", "2024-02-01"]:
+            for minute in range(0, 1440, 10):
+                produced = 2.0 if 600 <= minute < 900 else 0.0
+                high_res.insert_sample(db, day_string, minute, produced, 0.5 + minute / 1440, max(0.0, produced - 1.0))
+    yield db
+    db.close()
+
+
+# Test if the vectorized KPIs match the ones computed sample by sample
+def test_minute_kpis(db):
+    columns = analytics.load(db, analytics.MINUTES, "2024-01-30", "2024-02-01", today_string="2024-02-02")
+    rows = db.execute("SELECT date, minute, produced, consumed, fed_in FROM high_res_samples ORDER BY date, minute")
+    data = analytics.compute(columns, "month", PRICES, [0, 50, 100], points=3)
+    assert data["num_samples"] == len(rows) == 288
+    assert [bucket["date"] for bucket in data["buckets"]] == ["2024-01", "2024-02"]
+
+    january = [row for row in rows if row[0] == "2024-01-31"]
+    produced = sum(row[2] for row in january) / 60.0
+    consumed = sum(row[3] for row in january) / 60.0
+    fed_in = sum(row[4] for row in january) / 60.0
+    consumed_self = sum(min(row[2] - row[4], row[3]) for row in january) / 60.0
+    bucket = data["buckets"][0]
+    assert bucket["produced_kwh"] == pytest.approx(produced)
+    assert bucket["consumed_from_pv_kwh"] == pytest.approx(consumed_self)
+    assert bucket["autarky"] == pytest.approx(consumed_self / consumed * 100.0)
+    assert bucket["self_consumption_percent"] == pytest.approx(consumed_self / produced * 100.0)
+    assert bucket["earned_total"] == pytest.approx(
+        fed_in * 0.1 + consumed_self * 0.2)
+    assert bucket["peak_production_w"] == 2000.0
+    assert data["total"]["produced_kwh"] == pytest.approx(2 * produced)
+
+    consumed_w = np.array([row[3] for row in rows]) * 1000.0
+    assert data["percentiles"]["consumption_w"] == pytest.approx(
+        np.percentile(consumed_w, [0, 50, 100]), abs=0.1)
+    curve = data["load_duration"]["consumption"]
+    assert curve["hours"] == pytest.approx([1 / 60, 145 / 60, 288 / 60])
+    assert curve["power_w"][0] == data["total"]["peak_consumption_w"]
+
+    hours = analytics.compute(columns, "hour", PRICES)["buckets"]
+    assert len(hours) == 48
+    assert hours[10]["date"] == "2024-01-31 10"
+    assert sum(hour["produced_kwh"] for hour in hours) == pytest.approx(2 * produced)
+    with pytest.raises(ValueError):
+        analytics.compute(columns, "week", PRICES)
+
+
+# Test if only the days that are over are kept in the cache
+def test_day_cache(db):
+    day_cache = analytics.DayCache()
+    analytics.load(db, analytics.MINUTES, "2024-01-31", "2024-02-01", day_cache, "2024-02-01")
+    assert list(day_cache.days) == ["2024-01-31"]
+    with db.transaction():
+        db.execute("DELETE FROM high_res_samples")
+    columns = analytics.load(db, analytics.MINUTES, "2024-01-31", "2024-02-01", day_cache, "2024-02-01")
+    assert columns["days"] == ["2024-01-31"]
+    day_cache.drop_before("2024-02-01")
+    columns = analytics.load(db, analytics.MINUTES, "2024-01-31", "2024-02-01", day_cache, "2024-02-01")
+    assert analytics.compute(columns, "day", PRICES) == {"state": "nodata"}
+
+
+# Test if packed days give the same columns as the minute samples
+def test_packed_days(db):
+    columns = analytics.load(db, analytics.MINUTES, "2024-01-31", "2024-02-01", today_string="2024-02-02")
+    with db.transaction():
+        high_res.pack_days(db, None, "2024-02-01")
+        db.execute("DELETE FROM high_res_samples WHERE date = '2024-01-31'")
+    day_cache = analytics.DayCache()
+    packed = analytics.load(db, analytics.MINUTES, "2024-01-31", "2024-02-01", day_cache, "2024-02-02")
+    assert packed["days"] == columns["days"]
+    for name in ["minute", "produced", "consumed", "fed_in"]:
+        assert np.array_equal(packed[name], columns[name])
+    assert list(day_cache.days) == ["2024-01-31", "2024-02-01"]
+
+
+# Test if only the days that are not cached are read, run by run
+def test_day_cache_reads_missing_runs(db, monkeypatch):
+    day_cache = analytics.DayCache()
+    analytics.load(db, analytics.MINUTES, "2024-01-31", "2024-01-31", day_cache, "2024-02-05")
+    reads = []
+    read_packed = analytics.read_packed
+
+    def read_packed_logged(db, first, last):
+        reads.append((first, last))
+        return read_packed(db, first, last)
+
+    monkeypatch.setattr(analytics, "read_packed", read_packed_logged)
+    analytics.load(db, analytics.MINUTES, "2024-01-30", "2024-02-01", day_cache, "2024-02-05")
+    assert reads == [("2024-01-30", "2024-01-30"), ("2024-02-01", "2024-02-01")]
+    assert analytics.get_runs(["2024-02-28", "2024-02-29", "2024-03-01", "2024-03-03"]) == [
+        ["2024-02-28", "2024-02-29", "2024-03-01"], ["2024-03-03"]]
+
+
+# Test the KPIs of the daily energy counters
+def test_day_kpis(db):
+    with db.transaction():
+        db.execute("INSERT INTO days VALUES ('2024-01-31', 0, 10, 0, 8, 0, 4)")
+        db.execute("INSERT INTO days VALUES ('2024-02-01', 10, 12, 8, 12, 4, 4)")
+    columns = analytics.load(db, analytics.DAYS, "2024-01-01", "2024-12-31")
+    data = analytics.compute(columns, "all", PRICES)
+    assert [bucket["date"] for bucket in data["buckets"]] == ["all"]
+    assert data["total"]["produced_kwh"] == 12.0
+    assert data["total"]["consumed_from_pv_kwh"] == 8.0
+    assert data["total"]["autarky"] == pytest.approx(8.0 / 12.0 * 100.0)
+    assert data["percentiles"] is None
+    with pytest.raises(ValueError):
+        analytics.compute(columns, "hour", PRICES)
@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+
+import pytest
+
+from database import ConnectionManager
+
+
+# Test if readers see committed data while the writer holds a transaction
+def test_readers_do_not_block_writer(tmp_path):
+    connections = ConnectionManager(str(tmp_path / "db.sqlite"))
+    writer = connections.writer()
+    assert writer.execute("PRAGMA journal_mode")[0][0] == "wal"
+    with writer.transaction():
+        writer.execute("CREATE TABLE t (v INTEGER)")
+        writer.execute("INSERT INTO t VALUES (1)")
+
+    with writer.transaction():
+        writer.execute("INSERT INTO t VALUES (2)")
+        # Uncommitted data is invisible, but reading does not block
+        assert connections.reader().execute("SELECT COUNT(*) FROM t")[0][0] == 1
+    assert connections.reader().execute("SELECT COUNT(*) FROM t")[0][0] == 2
+    connections.close()
+
+
+# Test if every thread gets its own read-only connection
+def test_reader_is_thread_local_and_read_only(tmp_path):
+    connections = ConnectionManager(str(tmp_path / "db.sqlite"))
+    with connections.writer().transaction() as db:
+        db.execute("CREATE TABLE t (v INTEGER)")
+    readers = []
+    thread = threading.Thread(target=lambda: readers.append(connections.reader()))
+    thread.start()
+    thread.join()
+    assert readers[0] is not connections.reader()
+    assert connections.reader() is connections.reader()
+    with pytest.raises(sqlite3.OperationalError):
+        connections.reader().execute("INSERT INTO t VALUES (1)")
+
+
+# Test if the data version changes when another connection commits
+def test_data_version_follows_commits(tmp_path):
+    file_name = str(tmp_path / "db.sqlite")
+    grabber_connections = ConnectionManager(file_name)
+    with grabber_connections.writer().transaction() as db:
+        db.execute("CREATE TABLE t (v INTEGER)")
+    server_connections = ConnectionManager(file_name)
+    version = server_connections.get_data_version()
+    assert server_connections.get_data_version() == version
+    with grabber_connections.writer().transaction() as db:
+        db.execute("INSERT INTO t VALUES (1)")
+    assert server_connections.get_data_version() != version
+    server_connections.close()
+    grabber_connections.close()
+
+
+# Test if a read transaction does not see commits made while it runs
+def test_read_transaction_is_a_snapshot(tmp_path):
+    file_name = str(tmp_path / "db.sqlite")
+    grabber_connections = ConnectionManager(file_name)
+    with grabber_connections.writer().transaction() as db:
+        db.execute("CREATE TABLE t (v INTEGER)")
+        db.execute("INSERT INTO t VALUES (1)")
+    server_connections = ConnectionManager(file_name)
+    reader = server_connections.reader()
+    with reader.read_transaction():
+        assert reader.execute("SELECT SUM(v) FROM t")[0][0] == 1
+        with grabber_connections.writer().transaction() as db:
+            db.execute("INSERT INTO t VALUES (2)")
+        assert reader.execute("SELECT SUM(v) FROM t")[0][0] == 1
+    assert reader.execute("SELECT SUM(v) FROM t")[0][0] == 3
+    server_connections.close()
+    grabber_connections.close()
@@ -0,0 +1,113 @@
+import time
+import threading
+
+import pytest
+
+import device_pool
+from device_pool import DevicePool
+from devices.Dummy import Dummy
+
+
+# Dummy device that blocks in update() until it is released
+class SlowDummy(Dummy):
+    def __init__(self):
+        super().__init__(None)
+        self.release = threading.Event()
+
+    def update(self):
+        self.release.wait()
+        super().update()
+
+
+# Dummy device whose update() fails
+class BrokenDummy(Dummy):
+    def update(self):
+        raise ConnectionError("device not reachable")
+
+
+# Test if the values of all devices are added up
+def test_pool_adds_up_devices():
+    pool = DevicePool([("a", "Dummy", Dummy(None), 1.0), ("b", "Dummy", Dummy(None), 1.0)])
+    pool.update()
+    assert pool.total_energy_produced_kwh == 882.0
+    assert pool.current_power_produced_kw == 6.0
+    assert all(state.online for state in pool.states)
+    pool.close()
+
+
+# Test if a slow device only delays the tick up to its timeout
+def test_slow_device_does_not_block_others():
+    slow = SlowDummy()
+    pool = DevicePool([("fast", "Dummy", Dummy(None), 1.0), ("slow", "Dummy", slow, 0.1)])
+    start = time.monotonic()
+    pool.update()
+    assert time.monotonic() - start < 0.5
+    assert [state.online for state in pool.states] == [True, False]
+    # Counters are unknown until the slow device answered, so is its power
+    assert not pool.energy_complete
+    assert pool.total_energy_produced_kwh is None
+    assert pool.current_power_produced_kw == 3.0
+
+    # The late result is picked up by the next tick
+    slow.release.set()
+    pool.states[1].future.result()
+    pool.update()
+    assert [state.online for state in pool.states] == [True, True]
+    assert pool.total_energy_produced_kwh == 442.0 + 442.0
+    pool.close()
+
+
+# Test if a tick fails only when no device answers at all
+def test_failing_devices():
+    pool = DevicePool([("ok", "Dummy", Dummy(None), 1.0), ("broken", "Dummy", BrokenDummy(None), 1.0)])
+    pool.update()
+    assert [state.online for state in pool.states] == [True, False]
+    pool.close()
+
+    pool = DevicePool([("broken", "Dummy", BrokenDummy(None), 1.0)])
+    with pytest.raises(RuntimeError):
+        pool.update()
+    pool.close()
+
+
+# Dummy device that fails until it is repaired
+class FlakyDummy(Dummy):
+    def __init__(self):
+        super().__init__(None)
+        self.broken = True
+
+    def update(self):
+        if self.broken:
+            raise ConnectionError("device not reachable")
+        super().update()
+
+
+# Test if a device that comes online late does not make the totals jump
+def test_device_recovers():
+    flaky = FlakyDummy()
+    pool = DevicePool([("ok", "Dummy", Dummy(None), 1.0), ("flaky", "Dummy", flaky, 1.0)])
+    pool.update()
+    assert not pool.energy_complete
+    assert pool.total_energy_produced_kwh is None
+    assert pool.current_power_produced_kw == 3.0
+
+    flaky.broken = False
+    pool.update()
+    assert pool.energy_complete
+    assert pool.total_energy_produced_kwh == 442.0 + 441.0
+
+    # Afterwards a failing device keeps its last good counter
+    flaky.broken = True
+    pool.update()
+    assert pool.total_energy_produced_kwh == 443.0 + 441.0
+    assert pool.current_power_produced_kw == 3.0
+    pool.close()
+
+
+# Test if a device gets at least the own timeout of its adapter
+def test_timeout_of_adapter():
+    slow = Dummy(None)
+    slow.poll_timeout_s = 5
+    assert device_pool.get_timeout_s(Dummy(None)) == device_pool.DEFAULT_TIMEOUT_S
+    assert device_pool.get_timeout_s(slow) == 5 + device_pool.TIMEOUT_MARGIN_S
+    assert device_pool.get_timeout_s(slow, 2) == 2.0
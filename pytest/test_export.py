@@ -0,0 +1,50 @@
+import gzip
+
+import pytest
+
+import export
+import high_res
+import schema
+from database import Database
+
+
+# Creates a new data base with some daily rows and minute samples
+def open_export_db(tmp_path):
+    db = Database(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        schema.create(db)
+        db.executemany("INSERT INTO months VALUES (?, 0, ?, 0, 2, 0, 1)", [
+            ("2024-04", 10.0), ("2024-05", 20.0), ("2024-06", 30.0)])
+        for day in ("2024-05-01", "2024-05-02"):
+            for minute in range(3):
+                high_res.insert_sample(db, day, minute, 1.5, 0.5, 0.25)
+    return db
+
+
+# Test if ranges select whole keys of the table
+def test_ranges(tmp_path):
+    db = open_export_db(tmp_path)
+    text = "".join(export.generate_csv(db, "months", "2024-05-17", "2024-06"))
+    assert text == "date;production;consumption;feed_in\n2024-05;20.0;2.0;1.0\n2024-06;30.0;2.0;1.0\n"
+    text = "".join(export.generate_csv(db, "months", "2024"))
+    assert text.count("\n") == 4
+
+    text = "".join(export.generate_csv(db, export.MINUTES, "2024-05-02", "2024-05-02"))
+    assert text.splitlines() == [
+        "date;time;production;consumption;feed_in",
+        "2024-05-02;00:00;1.5;0.5;0.25",
+        "2024-05-02;00:01;1.5;0.5;0.25",
+        "2024-05-02;00:02;1.5;0.5;0.25"]
+
+    with pytest.raises(ValueError):
+        export.generate_csv(db, "sqlite_master")
+
+
+# Test if the chunks are read and compressed piecewise into one gzip stream
+def test_gzip_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_ROWS", 2)
+    db = open_export_db(tmp_path)
+    chunks = list(export.generate_csv(db, export.MINUTES))
+    assert len(chunks) == 1 + 3  # Header and six rows in chunks of two
+    data = b"".join(export.gzip_chunks(chunks))
+    assert gzip.decompress(data).decode() == "".join(chunks)
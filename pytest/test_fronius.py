@@ -0,0 +1,63 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from devices import Fronius as fronius
+from devices.Fronius import Fronius
+
+
+# Delay of the simulated datamanager per request in seconds
+DELAY_S = 0.2
+
+INVERTER_DATA = {"Body": {"Data": {"Site": {"E_Total": 5000.0, "P_PV": 2000.0, "P_Grid": -500.0}}}}
+METER_DATA = {"Body": {"Data": {"0": {
+    "EnergyReal_WAC_Plus_Absolute": 3000.0, "EnergyReal_WAC_Minus_Absolute": 1000.0}}}}
+
+
+# Simulated Fronius datamanager answering slowly
+class Handler(BaseHTTPRequestHandler):
+    connections = set()
+
+    def do_GET(self):
+        Handler.connections.add(self.client_address)
+        time.sleep(DELAY_S)
+        data = METER_DATA if "Meter" in self.path else INVERTER_DATA
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Test if inverter and meter are fetched concurrently over kept alive connections
+def test_update_fetches_in_parallel():
+    Handler.protocol_version = "HTTP/1.1"  # Keep-alive
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    config = SimpleNamespace(config_data={"fronius": {
+        "host_name": f"127.0.0.1:{server.server_port}", "has_meter": True}})
+    counts = {endpoint: sum(fronius.REQUEST_SECONDS.values.get((endpoint,), [0])[:-1])
+              for endpoint in ["inverter", "meter"]}
+    try:
+        device = Fronius(config)
+        start = time.perf_counter()
+        device.update()
+        duration_s = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert duration_s < 2 * DELAY_S
+    assert device.latency_ms["inverter"] >= DELAY_S * 1000.0
+    assert device.latency_ms["meter"] >= DELAY_S * 1000.0
+    for endpoint, count in counts.items():
+        assert sum(fronius.REQUEST_SECONDS.values[(endpoint,)][:-1]) == count + 2
+    assert len(Handler.connections) <= 2  # Two updates over the same connections
+    assert device.total_energy_produced_kwh == 5.0
+    assert device.current_power_fed_in_kw == 0.5
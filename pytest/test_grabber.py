@@ -1,7 +1,91 @@
 # import sys
 # import pytest
 # import backend.grabber
+from datetime import datetime
+
+import grabber
+from device_pool import DevicePool
+from devices.Dummy import Dummy
 
 
 def test_equality():
     assert 11 == 11
+
+
+# Test if a tick upserts the counters in a single transaction
+def test_update_data_upserts_counters(grabber_db, monkeypatch):
+    db = grabber_db
+    pool = DevicePool([("dummy", "Dummy", Dummy(None), 1.0)])
+    monkeypatch.setattr(grabber.time, "time", lambda: 1717243200.0)
+    grabber.update_data(pool)
+    grabber.update_data(pool)
+    pool.close()
+    assert not db.connection.in_transaction
+    rows = db.execute("SELECT * FROM days")
+    assert len(rows) == 1
+    assert rows[0][1] == 441.0  # produced_a from the first tick
+    assert rows[0][2] == 442.0  # produced_b from the last tick
+    rows = db.execute("SELECT * FROM hours")
+    assert len(rows) == 1
+    assert len(rows[0][0]) == len("YYYY-MM-DD-HH")
+    rows = db.execute("SELECT * FROM all_time")
+    assert rows[0][1:3] == (0.0, 442.0)
+    rows = db.execute("SELECT value FROM highscores WHERE type='production'")
+    assert rows[0][0] == 3.0
+    rows = db.execute("SELECT * FROM high_res_samples")
+    assert len(rows) == 1  # One sample per minute
+    rows = db.execute("SELECT name, online, total_produced FROM device_current")
+    assert rows == [("dummy", 1, 442.0)]
+
+
+# Test if minute samples follow the wall clock minutes
+def test_one_sample_per_wall_clock_minute(grabber_db):
+    db = grabber_db
+    dev = Dummy(None)
+    start = 1717243200.0  # Start of a minute
+    with db.transaction():
+        for tick_time in [start + 50.0, start + 55.0, start + 61.0, start + 66.0, start + 185.0]:
+            grabber.write_tick(dev, tick_time)
+    rows = db.execute("SELECT ID FROM real_time WHERE ID > 0 ORDER BY ID")
+    minute = int(start // 60)
+    assert [row[0] for row in rows] == [minute, minute + 1, minute + 3]
+
+
+# Test if each hour is queued for the peaq storage once it is completed
+def test_completed_hours_are_queued(grabber_db):
+    db = grabber_db
+    dev = Dummy(None)
+    start = 1717243200.0 - 3600.0  # Start of an hour
+    with db.transaction():
+        for tick_time in [start + 3590.0, start + 3595.0]:
+            grabber.write_tick(dev, tick_time)
+        grabber.write_tick(dev, start + 3600.0, write_energy=False)
+    assert db.execute("SELECT key FROM outbox") == []
+    with db.transaction():
+        grabber.write_tick(dev, start + 3605.0)
+        grabber.write_tick(dev, start + 3610.0)
+    hour_string = datetime.fromtimestamp(start).strftime("%Y-%m-%d-%H")
+    assert db.execute("SELECT key, status FROM outbox") == [
+        (f"cpin-production-{hour_string}", "pending")]
+
+
+# Test if each entry of the device list gets its own device section
+def test_load_devices_from_list(grabber_db):
+    grabber.config.config_data["devices"] = [
+        {"type": "Dummy", "name": "east", "dummy": {"foo": 1}},
+        {"type": "Dummy", "name": "west", "timeout_s": 0.5}]
+    pool = grabber.load_devices()
+    assert [(state.name, state.timeout_s) for state in pool.states] == [("east", 3.0), ("west", 0.5)]
+    # Totals are only known after a poll
+    assert pool.total_energy_produced_kwh is None
+    pool.update()
+    assert pool.total_energy_produced_kwh == 882.0
+    pool.close()
+
+
+# Test if the timeout of a single device can be configured
+def test_load_single_device(grabber_db):
+    grabber.config.config_data["device"] = {"type": "Dummy", "timeout_s": 6}
+    pool = grabber.load_devices()
+    assert [(state.name, state.timeout_s) for state in pool.states] == [("Dummy", 6.0)]
+    pool.close()
@@ -0,0 +1,60 @@
+import json
+import base64
+from array import array
+
+import high_res
+import rollup
+import schema
+from database import Database
+
+
+# Test if the compact format gives the same samples as the JSON one
+def test_binary_round_trip():
+    rows = [
+        ("2024-05-01", 0, 0.0, 0.35, 0.0),
+        ("2024-05-01", 1, 1.234, 0.567, 0.667),
+        ("2024-05-01", 7, 0.5, 0.0, 0.0),  # Gap and falling values
+        ("2024-05-02", 1439, 250.001, 1.5, 248.5),
+    ]
+    data = high_res.encode_binary(rows)
+    assert data.startswith(high_res.BINARY_MAGIC)
+    assert high_res.decode_binary(data) == {
+        "2024-05-01": [["00:00", 0.0, 0.35, 0.0], ["00:01", 1.234, 0.567, 0.667],
+                       ["00:07", 0.5, 0.0, 0.0]],
+        "2024-05-02": [["23:59", 250.001, 1.5, 248.5]],
+    }
+    assert high_res.decode_binary(high_res.encode_binary([])) == {}
+
+
+# Test if a day in base64 matches the JSON samples of the day
+def test_day_base64(tmp_path):
+    db = Database(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        schema.create(db)
+        for minute in range(0, 600, 3):
+            high_res.insert_sample(db, "2024-05-01", minute, minute / 100.0, 0.5, 0.25)
+    text = rollup.get_day_base64(db, "2024-05-01")
+    days = high_res.decode_binary(base64.b64decode(text))
+    assert days["2024-05-01"] == json.loads(rollup.get_day_json(db, "2024-05-01"))
+    assert len(text) < len(rollup.get_day_json(db, "2024-05-01")) / 2
+    assert rollup.get_day_base64(db, "2024-05-02") == ""
+
+
+# Test if the days that are over are packed once, a few per call
+def test_pack_days(tmp_path):
+    db = Database(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        schema.create(db)
+        for day in range(1, 5):
+            for minute in [0, 7, 1439]:
+                high_res.insert_sample(db, f"2024-05-0{day}", minute, minute / 1000.0, 0.5, 0.25)
+        assert high_res.pack_days(db, None, "2024-05-04", limit=2) == "2024-05-02"
+        assert high_res.pack_days(db, "2024-05-02", "2024-05-04", limit=2) == "2024-05-03"
+        assert high_res.pack_days(db, "2024-05-03", "2024-05-04", limit=2) == "2024-05-03"
+        db.execute("DELETE FROM high_res_samples WHERE date = '2024-05-01'")
+        assert high_res.pack_days(db, None, "2024-05-04") == "2024-05-03"
+    rows = db.execute("SELECT date, num_samples FROM high_res_packed ORDER BY date")
+    assert rows == [("2024-05-01", 3), ("2024-05-02", 3), ("2024-05-03", 3)]
+    minutes, samples = db.execute("SELECT minutes, samples FROM high_res_packed WHERE date = '2024-05-03'")[0]
+    assert list(array("h", minutes)) == [0, 7, 1439]
+    assert list(array("f", samples))[3:6] == [0.007000000216066837, 0.5, 0.25]
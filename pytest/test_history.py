@@ -0,0 +1,48 @@
+from datetime import datetime
+
+import pytest
+
+import history
+import schema
+from database import Database
+
+
+# Creates a new data base with some hourly rows
+def open_history_db(tmp_path):
+    db = Database(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        schema.create(db)
+        db.executemany("INSERT INTO hours VALUES (?, 0, ?, 0, 0, 0, 0)", [
+            ("2024-05-01-22", 1.0),
+            ("2024-05-01-23", 2.0),
+            ("2024-05-02-00", 3.0),
+        ])
+    return db
+
+
+# Test if the hour in progress is not reported as completed
+def test_latest_completed_hour(tmp_path):
+    db = open_history_db(tmp_path)
+    assert history.get_latest_completed_hour(db, datetime(2024, 5, 2, 0, 30))[0] == "2024-05-01-23"
+    assert history.get_latest_completed_hour(db, datetime(2024, 5, 3, 0, 30))[0] == "2024-05-02-00"
+    assert history.get_latest_completed_hour(db, datetime(2024, 5, 1, 22, 0)) is None
+
+
+# Test if hours since a key are returned in order
+def test_hours_since(tmp_path):
+    db = open_history_db(tmp_path)
+    rows = history.get_hours_since(db, "2024-05-01-22", datetime(2024, 5, 3))
+    assert [row[0] for row in rows] == ["2024-05-01-23", "2024-05-02-00"]
+
+
+# Test if prefix queries return exactly the rows of the period
+def test_get_rows_by_prefix(tmp_path):
+    db = open_history_db(tmp_path)
+    with db.transaction():
+        db.executemany("INSERT INTO months VALUES (?, 0, 0, 0, 0, 0, 0)",
+                       [("2023-12",), ("2024-01",), ("2024-12",), ("2025-01",)])
+    assert [row[0] for row in history.get_rows(db, "months", "2024")] == ["2024-01", "2024-12"]
+    assert [row[0] for row in history.get_rows(db, "hours", "2024-05-01")] == ["2024-05-01-22", "2024-05-01-23"]
+    assert len(history.get_rows(db, "months")) == 4
+    with pytest.raises(ValueError):
+        history.get_rows(db, "sqlite_master")
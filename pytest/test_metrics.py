@@ -0,0 +1,37 @@
+import metrics
+
+
+# Test if histograms are rendered with cumulative buckets
+def test_histogram_render():
+    histogram = metrics.Histogram("test_seconds", "Test durations", ["stage"])
+    histogram.observe("a", seconds=0.003)
+    histogram.observe("a", seconds=0.2)
+    histogram.observe("a", seconds=20.0)
+    lines = metrics.render([histogram]).splitlines()
+    assert lines[:2] == ["# HELP test_seconds Test durations", "# TYPE test_seconds histogram"]
+    assert 'test_seconds_bucket{stage="a",le="0.0025"} 0' in lines
+    assert 'test_seconds_bucket{stage="a",le="0.005"} 1' in lines
+    assert 'test_seconds_bucket{stage="a",le="0.25"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="a"} 3' in lines
+
+
+# Test if the metrics of another process are merged in through the snapshot file
+def test_save_and_collect(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "registry", {})
+    file_name = str(tmp_path / "metrics.json")
+    counter = metrics.counter("test_errors_total", "Test errors", ["reason"])
+    counter.inc("timeout")
+    counter.inc("timeout", amount=2)
+    metrics.histogram("test_seconds", "Test durations").observe(seconds=0.1)
+    metrics.save(file_name, force=True)
+
+    # Other process: same metrics registered, but nothing recorded
+    monkeypatch.setattr(metrics, "registry", {})
+    metrics.counter("test_errors_total", "Test errors", ["reason"])
+    metrics.counter("test_queries_total", "Test queries").inc()
+    text = metrics.render(metrics.collect(file_name))
+    assert text.count("# TYPE test_errors_total counter") == 1
+    assert 'test_errors_total{reason="timeout"} 3' in text
+    assert "test_queries_total 1" in text
+    assert "test_seconds_count 1" in text
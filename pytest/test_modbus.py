@@ -0,0 +1,150 @@
+from types import SimpleNamespace
+
+import pytest
+
+from devices import modbus_plan
+from devices.Modbus import Modbus
+
+
+REGISTER_MAP = {
+    'total_energy_produced': {'address': 3000, 'length': 2, 'type': 'uint32', 'scale': 0.001},
+    'total_energy_consumed': {'address': 3004, 'length': 2, 'type': 'uint32', 'scale': 0.001},
+    'current_power_produced': {'address': 3012, 'length': 1, 'type': 'uint16', 'scale': 0.001},
+    'current_power_consumed_grid': {'address': 3014, 'length': 1, 'type': 'int16', 'scale': 0.001},
+    'total_energy_fed_in': {'address': 30, 'length': 2, 'type': 'uint32', 'scale': 0.001, 'table': 'input'},
+}
+
+
+# Simulated Modbus client, counting the read requests
+class FakeClient:
+    def __init__(self, registers, rejected=()):
+        self.registers = registers
+        self.rejected = rejected  # Unmapped addresses that fail to read
+        self.reads = []
+        self.connected = True
+        self.timing_out = False
+
+    def read(self, table, address, count):
+        self.reads.append((table, address, count))
+        addresses = range(address, address + count)
+        if self.timing_out:
+            return SimpleNamespace(isError=lambda: True)
+        if any(address in self.rejected for address in addresses):
+            return SimpleNamespace(isError=lambda: True, exception_code=modbus_plan.ILLEGAL_DATA_ADDRESS)
+        return SimpleNamespace(isError=lambda: False, registers=[
+            self.registers.get((table, address), 0) for address in addresses])
+
+    def read_holding_registers(self, address, count, slave):
+        return self.read("holding", address, count)
+
+    def read_input_registers(self, address, count, slave):
+        return self.read("input", address, count)
+
+    def close(self):
+        self.connected = False
+
+
+# Modbus device talking to the simulated client
+class FakeModbus(Modbus):
+    client_to_use = None
+
+    def _create_client(self):
+        return self.client_to_use
+
+
+# Creates a device on a simulated client with some register values
+def create_device(rejected=(), max_gap=10):
+    FakeModbus.client_to_use = FakeClient({
+        ("holding", 3000): 0x0001, ("holding", 3001): 0x86A0,  # 100000 Wh
+        ("holding", 3004): 0x0000, ("holding", 3005): 0xC350,  # 50000 Wh
+        ("holding", 3012): 2500,
+        ("holding", 3014): 0xFC18,  # -1000 W
+        ("input", 30): 0x0000, ("input", 31): 0x7530,  # 30000 Wh
+    }, rejected)
+    config = SimpleNamespace(config_data={"modbus": {"register_map": REGISTER_MAP, "max_gap": max_gap}})
+    return FakeModbus(config)
+
+
+# Test if nearby registers are joined and tables are kept apart
+def test_plan_reads():
+    blocks = modbus_plan.plan_reads(REGISTER_MAP, max_gap=10)
+    assert [(block.table, block.address, block.count) for block in blocks] == [
+        ("holding", 3000, 15), ("input", 30, 2)]
+    blocks = modbus_plan.plan_reads(REGISTER_MAP, max_gap=2)
+    assert [(block.address, block.count) for block in blocks] == [(3000, 6), (3012, 3), (30, 2)]
+    blocks = modbus_plan.plan_reads(REGISTER_MAP, max_gap=10, max_block_size=6)
+    assert [(block.address, block.count) for block in blocks] == [(3000, 6), (3012, 3), (30, 2)]
+
+
+# Test if all values are decoded from the block reads
+def test_update_reads_blocks():
+    device = create_device()
+    client = device.client
+    assert client.reads == [("holding", 3000, 15), ("input", 30, 2)]
+    assert device.poll_timeout_s == 2 * device.timeout
+    assert device.total_energy_produced_kwh == 100.0
+    assert device.total_energy_consumed_kwh == 50.0
+    assert device.total_energy_fed_in_kwh == 30.0
+    assert device.current_power_produced_kw == 2.5
+    assert device.current_power_fed_in_kw == 1.0
+    assert device.current_power_consumed_from_grid_kw == 0
+
+
+# Test if a block that covers rejected registers is read one by one
+def test_rejected_gap_splits_block():
+    device = create_device(rejected=[3008])
+    assert device.total_energy_consumed_kwh == 50.0
+    device.client.reads.clear()
+    device.update()
+    assert device.client.reads == [
+        ("holding", 3000, 2), ("holding", 3004, 2), ("holding", 3012, 1),
+        ("holding", 3014, 1), ("input", 30, 2)]
+
+
+# Test if a timeout fails the update but keeps the blocks
+def test_timeout_keeps_blocks():
+    device = create_device()
+    device.client.timing_out = True
+    with pytest.raises(Exception, match="Error reading register at address 3000"):
+        device.update()
+    assert [(block.address, block.count) for block in device.read_plan] == [(3000, 15), (30, 2)]
+
+
+# Test if the decode plan matches the pymodbus payload decoder
+def test_decode_plan_matches_payload_decoder():
+    from pymodbus.constants import Endian
+    from pymodbus.payload import BinaryPayloadDecoder
+
+    register_map = {
+        'a': {'address': 0, 'length': 1, 'type': 'int16'},
+        'b': {'address': 1, 'length': 2, 'type': 'int32', 'scale': 0.1},
+        'c': {'address': 3, 'length': 2, 'type': 'float32'},
+        'd': {'address': 5, 'length': 4, 'type': 'uint64'},
+        'e': {'address': 9, 'length': 4, 'type': 'float64'},
+    }
+    registers = [0xFF38, 0x1234, 0xABCD, 0x4049, 0x0FDB, 0x0102, 0x0304, 0x0506, 0x0708,
+                 0x4005, 0xBF0A, 0x8B14, 0x5769]
+    for byte_order in ['big', 'little']:
+        for word_order in ['big', 'little']:
+            block = modbus_plan.compile_blocks(modbus_plan.plan_reads(register_map), byte_order, word_order)[0]
+            values = modbus_plan.decode_block(block, registers)
+            endian = {'big': Endian.BIG, 'little': Endian.LITTLE}
+            for name, register_config in register_map.items():
+                address = register_config['address']
+                decoder = BinaryPayloadDecoder.fromRegisters(
+                    registers[address:address + register_config['length']],
+                    byteorder=endian[byte_order], wordorder=endian[word_order])
+                size = {'int16': '16bit_int', 'int32': '32bit_int', 'float32': '32bit_float',
+                        'uint64': '64bit_uint', 'float64': '64bit_float'}[register_config['type']]
+                expected = getattr(decoder, 'decode_' + size)() * register_config.get('scale', 1.0)
+                assert values[name] == expected
+
+
+# Test if the word order can be set per register
+def test_per_register_word_order():
+    register_map = {
+        'big': {'address': 0, 'length': 2, 'type': 'uint32'},
+        'little': {'address': 2, 'length': 2, 'type': 'uint32', 'word_order': 'little'},
+    }
+    block = modbus_plan.compile_blocks(modbus_plan.plan_reads(register_map), 'big', 'big')[0]
+    assert modbus_plan.decode_block(block, [1, 2, 1, 2]) == {'big': 0x10002, 'little': 0x20001}
@@ -0,0 +1,137 @@
+import time
+import socket
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext, ModbusSlaveContext
+from pymodbus.server import ModbusTcpServer
+
+from devices import modbus_async
+from devices.Modbus import Modbus
+
+
+# Returns a free TCP port on localhost
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Runs a pymodbus server on localhost in its own thread
+@pytest.fixture
+def server_port():
+    port = get_free_port()
+    holding = [0] * 3020
+    holding[3000:3002] = [0x0001, 0x86A0]  # 100000 Wh
+    holding[3012] = 2500
+    inputs = [0] * 40
+    inputs[30:32] = [0x0000, 0x7530]  # 30000 Wh
+    # The data blocks start at 1, pymodbus adds 1 to the request address
+    context = ModbusServerContext(slaves=ModbusSlaveContext(
+        hr=ModbusSequentialDataBlock(1, holding), ir=ModbusSequentialDataBlock(1, inputs)), single=True)
+    loop = asyncio.new_event_loop()
+    servers = []
+
+    async def serve():
+        servers.append(ModbusTcpServer(context, address=("127.0.0.1", port)))
+        await servers[0].serve_forever()
+
+    threading.Thread(target=loop.run_until_complete, args=(serve(),), daemon=True).start()
+    for i in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    yield port
+    asyncio.run_coroutine_threadsafe(servers[0].shutdown(), loop).result(5)
+
+
+# Test if the async device reads all values over one persistent connection
+def test_async_device_reads_values(server_port):
+    config = SimpleNamespace(config_data={"modbus": {
+        "connection_type": "tcp_async", "host": "127.0.0.1", "port": server_port, "max_gap": 2,
+        "register_map": {
+            'total_energy_produced': {'address': 3000, 'length': 2, 'type': 'uint32', 'scale': 0.001},
+            'current_power_produced': {'address': 3012, 'length': 1, 'type': 'uint16', 'scale': 0.001},
+            'total_energy_fed_in': {'address': 30, 'length': 2, 'type': 'uint32', 'scale': 0.001,
+                                    'table': 'input'},
+        }}})
+    device = Modbus(config)
+    device.update()
+    assert len(device.read_plan) == 3
+    assert device.total_energy_produced_kwh == 100.0
+    assert device.current_power_produced_kw == 2.5
+    assert device.total_energy_fed_in_kwh == 30.0
+    assert device.client.num_connects == 1
+    modbus_async.run(device.client.close())
+
+
+# Test if pipelined requests are matched to their responses
+def test_pipelined_requests(server_port):
+    connection = modbus_async.AsyncModbusConnection("127.0.0.1", server_port, 3.0, max_pipeline=8)
+
+    async def read_all():
+        return await asyncio.gather(*(
+            connection.read_registers(modbus_async.READ_HOLDING_REGISTERS, 1, address, 2)
+            for address in [3012, 3000, 3001, 2999]))
+
+    assert modbus_async.run(read_all()) == [[2500, 0], [1, 0x86A0], [0x86A0, 0], [0, 1]]
+    assert connection.num_requests == 4
+    modbus_async.run(connection.close())
+
+
+# Test if failed connection attempts back off exponentially
+def test_reconnect_backoff():
+    clock = SimpleNamespace(now=100.0)
+    connection = modbus_async.AsyncModbusConnection(
+        "127.0.0.1", get_free_port(), 1.0, clock=lambda: clock.now, jitter=lambda low, high: high)
+
+    def read():
+        return modbus_async.run(connection.read_registers(3, 1, 0, 1))
+
+    with pytest.raises(ConnectionError, match="failed"):
+        read()
+    assert connection.next_attempt == 100.0 + modbus_async.BACKOFF_MIN_S
+    with pytest.raises(ConnectionError, match="next attempt"):
+        read()  # Fails fast while backing off
+    clock.now += 1.0
+    with pytest.raises(ConnectionError, match="failed"):
+        read()
+    assert connection.backoff_s == 2 * modbus_async.BACKOFF_MIN_S
+
+
+# Test if a connection to a device that stopped answering is reopened
+def test_silent_server_reconnects():
+    listener = socket.create_server(("127.0.0.1", 0))
+    accepted = []
+
+    def accept():
+        while True:
+            try:
+                accepted.append(listener.accept()[0])  # Reads nothing, answers nothing
+            except OSError:
+                return
+
+    threading.Thread(target=accept, daemon=True).start()
+    connection = modbus_async.AsyncModbusConnection(
+        "127.0.0.1", listener.getsockname()[1], 0.1, jitter=lambda low, high: 0.0)
+
+    def read():
+        return modbus_async.run(connection.read_registers(3, 1, 0, 1))
+
+    for i in range(modbus_async.MAX_CONSECUTIVE_TIMEOUTS - 1):
+        with pytest.raises(TimeoutError):
+            read()
+    assert connection.connected
+    with pytest.raises(TimeoutError):
+        read()
+    assert not connection.connected
+    with pytest.raises(TimeoutError):
+        read()
+    assert connection.num_connects == 2
+    assert connection.consecutive_timeouts == 1
+    modbus_async.run(connection.close())
+    listener.close()
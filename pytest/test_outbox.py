@@ -0,0 +1,154 @@
+from datetime import datetime
+from types import SimpleNamespace
+from collections.abc import Mapping
+
+import pytest
+
+import outbox
+import schema
+from database import Database
+
+
+# Stands in for sdk.storage of the peaq SDK
+class MockStorage:
+    def __init__(self):
+        self.online = True
+        self.status = 1
+        self.items = {}
+        self.calls = []
+
+    def add_item(self, item_type, item):
+        self.calls.append(item_type)
+        if not self.online:
+            raise ConnectionError("Connection error")
+        if self.status == 1:
+            self.items[item_type] = item
+        return SimpleNamespace(message="", receipt={
+            "status": self.status, "transactionHash": bytes([len(self.calls)])})
+
+    def get_item(self, item_type, wss_base_url=None):
+        if item_type not in self.items:
+            raise LookupError(f"Item type of {item_type} was not found")
+        return {item_type: self.items[item_type]}
+
+
+# Read only mapping like the AttributeDict receipts of web3
+class AttributeDict(Mapping):
+    def __init__(self, items):
+        self.items = dict(items)
+
+    def __getitem__(self, key):
+        return self.items[key]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+# Creates a data base with the counters of some hours
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        schema.create(db)
+        for hour in range(10, 17):
+            produced = hour * 2.0
+            db.execute("INSERT INTO hours VALUES (?, ?, ?, 0, 1, ?, ?)",
+                       (f"2024-05-01-{hour}", produced, produced + 2.0, produced / 2, produced / 2 + 0.5))
+    yield db
+    db.close()
+
+
+# Returns the state of all items
+def get_items(db):
+    return db.execute("SELECT key, status, attempts, last_error, confirmation FROM outbox ORDER BY hour")
+
+
+# Test if completed hours are queued once, starting with the latest one
+def test_enqueue(db):
+    assert outbox.enqueue_completed_hours(db, datetime(2024, 5, 1, 13, 30)) == 1
+    assert db.execute("SELECT key, payload FROM outbox") == [
+        ("cpin-production-2024-05-01-12", '{"outputAC": 0.5, "outputDC": 2.0}')]
+    assert outbox.enqueue_completed_hours(db, datetime(2024, 5, 1, 16, 5)) == 3
+    assert outbox.enqueue_completed_hours(db, datetime(2024, 5, 1, 16, 5)) == 0
+    assert [item[0][-2:] for item in get_items(db)] == ["12", "13", "14", "15"]
+
+
+# Test if items are retried with backoff and sent in bulk after an outage
+def test_drain(db):
+    outbox.enqueue_completed_hours(db, datetime(2024, 5, 1, 14, 30))
+    outbox.enqueue_completed_hours(db, datetime(2024, 5, 2))
+    storage = MockStorage()
+    storage.online = False
+    now = 1000.0
+    assert outbox.drain(db, storage, clock=lambda: now) == (0, outbox.MAX_FAILURES_PER_DRAIN)
+    assert get_items(db)[0] == ("cpin-production-2024-05-01-13", "pending", 1, "Connection error", None)
+    # The last item follows with the next drain, then nothing is due
+    assert outbox.drain(db, storage, clock=lambda: now) == (0, 1)
+    assert outbox.drain(db, storage, clock=lambda: now) == (0, 0)
+
+    storage.online = True
+    now += outbox.BACKOFF_BASE_S
+    assert outbox.drain(db, storage, clock=lambda: now) == (4, 0)
+    items = get_items(db)
+    assert [item[1] for item in items] == ["confirmed"] * 4
+    assert items[0][3:] == (None, "0x05")
+    assert list(storage.items) == [item[0] for item in items]
+    assert outbox.get_status(db) == ({"confirmed": 4}, None)
+
+
+# Test if a drain stops once it should not continue
+def test_drain_stops(db):
+    outbox.enqueue_completed_hours(db, datetime(2024, 5, 1, 14, 30))
+    outbox.enqueue_completed_hours(db, datetime(2024, 5, 2))
+    storage = MockStorage()
+
+    def should_continue():
+        return len(storage.calls) < 2
+
+    assert outbox.drain(db, storage, clock=lambda: 0.0, should_continue=should_continue) == (2, 0)
+    assert [item[1] for item in get_items(db)] == ["confirmed"] * 2 + ["pending"] * 2
+
+
+# Test if the receipts of EVM and substrate transactions are recognised
+def test_get_confirmation():
+    evm = AttributeDict({"status": 1, "transactionHash": bytes([0xab, 0x01]), "blockNumber": 5})
+    assert outbox.get_confirmation(SimpleNamespace(message="", receipt=evm)) == "0xab01"
+    substrate = {"extrinsic_hash": "0x1234", "block_hash": "0x5678", "finalized": False}
+    assert outbox.get_confirmation(SimpleNamespace(message="", receipt=substrate)) == "0x1234"
+    for result, error in [
+            (SimpleNamespace(message="", tx={}), "no signer"),
+            (SimpleNamespace(message="", receipt=AttributeDict({"status": 0, "transactionHash": b"\x01"})),
+             "reverted"),
+            (SimpleNamespace(message="", receipt={"blockNumber": 5}), "Unrecognised transaction receipt"),
+            (SimpleNamespace(message="", receipt="0x1234"), "Unrecognised transaction receipt"),
+            (SimpleNamespace(message="", receipt={"extrinsic_hash": None}), "Unrecognised transaction hash")]:
+        with pytest.raises(RuntimeError, match=error):
+            outbox.get_confirmation(result)
+
+
+# Test if a reverted transaction is retried with a growing delay
+def test_reverted(db):
+    outbox.enqueue_completed_hours(db, datetime(2024, 5, 1, 14, 30))
+    storage = MockStorage()
+    storage.status = 0
+    assert outbox.drain(db, storage, clock=lambda: 0.0) == (0, 1)
+    assert outbox.drain(db, storage, clock=lambda: 60.0) == (0, 1)
+    assert db.execute("SELECT attempts, next_attempt FROM outbox") == [(2, 180.0)]
+    assert outbox.get_backoff_s(100) == outbox.BACKOFF_MAX_S
+
+
+# Test if an item whose transaction was interrupted is not sent twice
+def test_interrupted(db):
+    outbox.enqueue_completed_hours(db, datetime(2024, 5, 1, 14, 30))
+    storage = MockStorage()
+    key, payload = db.execute("SELECT key, payload FROM outbox")[0]
+    storage.items[key] = payload
+    db.execute("UPDATE outbox SET status = 'sending', attempts = 1")
+    assert outbox.drain(db, storage, "wss://test") == (0, 0)
+    outbox.reset_interrupted(db)
+    assert outbox.drain(db, storage, "wss://test") == (1, 0)
+    assert storage.calls == []
+    assert get_items(db)[0][4] == "found on chain"
@@ -0,0 +1,69 @@
+import time
+import threading
+
+from query_cache import QueryCache
+
+
+# Test if responses are reused until the TTL ends or the data base changes
+def test_cache_invalidation():
+    state = {"generation": 1, "now": 0.0, "computed": 0}
+
+    def compute():
+        state["computed"] += 1
+        return f"response {state['computed']}"
+
+    cache = QueryCache(lambda: state["generation"], {"current": 3}, clock=lambda: state["now"])
+    assert cache.get(("current",), "current", compute) == "response 1"
+    assert cache.get(("current",), "current", compute) == "response 1"
+    state["generation"] = 2  # The grabber committed
+    assert cache.get(("current",), "current", compute) == "response 2"
+    state["now"] = 3.5  # TTL is over
+    assert cache.get(("current",), "current", compute) == "response 3"
+    assert cache.get(("other",), "other", compute) == "response 4"  # Not cached
+    assert cache.get(("other",), "other", compute) == "response 5"
+
+
+# Test if concurrent identical requests share one computation
+def test_single_flight():
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "response"
+
+    cache = QueryCache(lambda: 1, {"statistics": 60})
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.get(("statistics",), "statistics", compute))) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["response"] * 8
+    assert len(calls) == 1
+
+
+# Test if the cache keeps its size by dropping old, unused and large responses
+def test_size_limit():
+    state = {"generation": 1, "now": 0.0}
+    cache = QueryCache(lambda: state["generation"], {"power": 60, "current": 3},
+                       clock=lambda: state["now"], max_bytes=8000)
+    for i in range(5):
+        cache.get(("power", i), "power", lambda: "x" * 900)
+    assert cache.num_bytes == 4500
+    cache.get(("power", 5), "power", lambda: "x" * 2000)  # Too large to keep
+    assert cache.num_bytes == 4500
+    cache.get(("power", 6), "power", lambda: "x" * 900)
+    cache.get(("power", 7), "power", lambda: "x" * 900)
+    cache.get(("power", 8), "power", lambda: "x" * 900)
+    cache.get(("power", 9), "power", lambda: "x" * 900)
+    assert [key[1] for key in cache.entries] == [1, 2, 3, 4, 6, 7, 8, 9]
+    assert cache.num_bytes == 7200
+    state["generation"] = 2  # The old responses are of no use anymore
+    cache.get(("current",), "current", lambda: "current")
+    assert list(cache.entries) == [("current",)]
+    assert cache.num_bytes == len("current")
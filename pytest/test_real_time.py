@@ -0,0 +1,51 @@
+import real_time
+from database import Database
+
+
+# Creates a data base containing only the ring buffer
+def open_ring_buffer(tmp_path):
+    db = Database(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        real_time.create_table(db)
+    return db
+
+
+# Test if the ring buffer has a fixed number of slots
+def test_ring_buffer_is_updated_in_place(tmp_path):
+    db = open_ring_buffer(tmp_path)
+    with db.transaction():
+        for minute_id in range(1000, 1000 + 3 * real_time.NUM_REAL_TIME_VALUES):
+            real_time.insert_sample(db, minute_id, "12:00", 1.0, 2.0, 3.0)
+    assert db.execute("SELECT COUNT(*) FROM real_time")[0][0] == real_time.NUM_REAL_TIME_VALUES
+
+
+# Test if a window wrapping around the last slot is read newest first
+def test_get_latest_wraps_around(tmp_path):
+    db = open_ring_buffer(tmp_path)
+    last_id = 10 * real_time.NUM_REAL_TIME_VALUES + 5  # Slot 5
+    with db.transaction():
+        for minute_id in range(last_id - 20, last_id + 1):
+            real_time.insert_sample(db, minute_id, str(minute_id), 1.0, 2.0, 3.0)
+    rows = real_time.get_latest(db, 10, last_id)
+    assert [row[0] for row in rows] == list(range(last_id, last_id - 10, -1))
+    # Stale slots from an older day are skipped
+    rows = real_time.get_latest(db, 60, last_id + 30)
+    assert [row[0] for row in rows] == list(range(last_id, last_id - 21, -1))
+
+
+# Test if a cursor only returns the samples that are new to the client
+def test_get_since(tmp_path):
+    db = open_ring_buffer(tmp_path)
+    last_id = 20000000
+    with db.transaction():
+        for minute_id in range(last_id - 100, last_id + 1):
+            real_time.insert_sample(db, minute_id, str(minute_id), 1.0, 2.0, 3.0)
+    rows, cursor = real_time.get_since(db, last_id - 2, 60, last_id)
+    assert [row[0] for row in rows] == [last_id, last_id - 1]
+    assert cursor == last_id
+    rows, cursor = real_time.get_since(db, 0, 60, last_id)  # Limited to the window
+    assert len(rows) == 60
+    rows, cursor = real_time.get_since(db, last_id * 60 - 90, 60, last_id)  # Unix timestamp
+    assert [row[0] for row in rows] == [last_id, last_id - 1]
+    # Nothing new, the sample of the next minute may still come
+    assert real_time.get_since(db, last_id, 60, last_id + 1) == ([], last_id)
@@ -0,0 +1,69 @@
+import json
+from datetime import date
+
+import high_res
+import rollup
+import schema
+from database import Database
+
+
+# Creates a new data base containing two days of minute samples
+def open_rollup_db(tmp_path):
+    db = Database(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        schema.create(db)
+        for day_string in ["2024-05-01", "2024-05-02"]:
+            for minute in range(24 * 60):
+                db.execute("INSERT INTO high_res_samples VALUES (?, ?, ?, 1.0, 0.5)",
+                           (day_string, minute, float(minute % 2)))
+                rollup.update_buckets(db, day_string, minute)
+    return db
+
+
+# Test if incremental rollups match a rebuild from the minute samples
+def test_incremental_rollups_match_rebuild(tmp_path):
+    db = open_rollup_db(tmp_path)
+    incremental = db.execute("SELECT * FROM rollups ORDER BY 1, 2, 3")
+    with db.transaction():
+        rollup.rebuild(db)
+    assert db.execute("SELECT * FROM rollups ORDER BY 1, 2, 3") == incremental
+    series = rollup.get_series(db, rollup.HOUR, "2024-05-01", "2024-05-01")
+    assert len(series) == 24
+    assert series[13] == ["2024-05-01", "13:00", 0.5, 1.0, 0.5]
+
+
+# Test if a minute that is stored twice is counted once
+def test_repeated_minute(tmp_path):
+    db = open_rollup_db(tmp_path)
+    before = db.execute("SELECT * FROM rollups ORDER BY 1, 2, 3")
+    with db.transaction():
+        for minute in [121, 121, 1439]:
+            high_res.insert_sample(db, "2024-05-01", minute, 1.0, 1.0, 0.5)
+            rollup.update_buckets(db, "2024-05-01", minute)
+    rows = db.execute("SELECT * FROM rollups ORDER BY 1, 2, 3")
+    assert len(rows) == len(before)
+    assert db.execute("SELECT num_samples, produced FROM rollups "
+                      "WHERE resolution = ? AND date = '2024-05-01' AND slot = 2", (rollup.HOUR,)) == [(60, 30.0)]
+    with db.transaction():
+        rollup.rebuild(db)
+    assert db.execute("SELECT * FROM rollups ORDER BY 1, 2, 3") == rows
+
+
+# Test if expired minute data falls back to the rollups
+def test_retention_and_resolution_choice(tmp_path):
+    db = open_rollup_db(tmp_path)
+    retention = rollup.get_retention({"rollup": {"minute_retention_days": 1}})
+    today = date(2024, 5, 3)
+    with db.transaction():
+        high_res.pack_days(db, None, str(today))
+        rollup.apply_retention(db, retention, today)
+    assert db.execute("SELECT date FROM high_res_packed") == [("2024-05-02",)]
+    assert rollup.get_series(db, rollup.MINUTE, "2024-05-01", "2024-05-01") == []
+    assert len(rollup.get_series(db, rollup.MINUTE, "2024-05-02", "2024-05-02")) == 1440
+    assert len(json.loads(rollup.get_day_json(db, "2024-05-01"))) == 96
+
+    day1, day2 = date(2024, 5, 1), date(2024, 5, 2)
+    assert rollup.pick_resolution(retention, day2, day2, 1440, today) == rollup.MINUTE
+    assert rollup.pick_resolution(retention, day2, day2, 96, today) == rollup.QUARTER_HOUR
+    assert rollup.pick_resolution(retention, day1, day2, 1440, today) == rollup.QUARTER_HOUR
+    assert rollup.pick_resolution(retention, day1, day2, 10, today) == rollup.HOUR
@@ -0,0 +1,126 @@
+from types import SimpleNamespace
+
+import pytest
+
+from devices import modbus_plan
+from devices import rtu_bus
+
+
+# Simulated serial client that takes 10 ms per request
+class FakeClient:
+    def __init__(self, clock):
+        self.clock = clock
+        self.connected = True
+        self.reads = []
+        self.failing_units = []
+        self.rejected = []  # Unmapped addresses that fail to read
+
+    def read_holding_registers(self, address, count, slave):
+        self.reads.append((round(self.clock.now, 4), slave, address))
+        self.clock.now += 0.01
+        if slave in self.failing_units:
+            return SimpleNamespace(isError=lambda: True)
+        if any(address in self.rejected for address in range(address, address + count)):
+            return SimpleNamespace(isError=lambda: True, exception_code=modbus_plan.ILLEGAL_DATA_ADDRESS)
+        return SimpleNamespace(isError=lambda: False, registers=[slave] * count)
+
+
+# Simulated monotonic clock
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+REGISTER_MAP = {
+    'total_energy_produced': {'address': 0, 'length': 1, 'type': 'uint16', 'poll_s': 60},
+    'current_power_produced': {'address': 100, 'length': 1, 'type': 'uint16', 'poll_s': 1},
+}
+
+
+# Creates a bus with two units, unit 2 having the higher priority
+def create_bus():
+    clock = FakeClock()
+    client = FakeClient(clock)
+    bus = rtu_bus.RtuBus(client, 9600, clock=lambda: clock.now, sleep=clock.sleep)
+    units = [bus.add_unit(unit_id, REGISTER_MAP, priority, 5, 10, 125, 'big', 'big')
+             for unit_id, priority in [(1, 0), (2, 5)]]
+    return bus, client, clock, units
+
+
+# Runs the bus until the given time
+def run_until(bus, clock, end):
+    while clock.now < end:
+        clock.sleep(bus.step())
+
+
+# Test if power registers are polled more often than energy counters
+def test_poll_rates():
+    bus, client, clock, units = create_bus()
+    run_until(bus, clock, 10.0)
+    power_reads = [read for read in client.reads if read[1:] == (1, 100)]
+    energy_reads = [read for read in client.reads if read[1:] == (1, 0)]
+    assert len(power_reads) == 10
+    assert len(energy_reads) == 1
+    assert units[0].get_values() == {'total_energy_produced': 1, 'current_power_produced': 1}
+    assert units[0].ready.is_set()
+
+
+# Test if due jobs run by priority with the silent interval between frames
+def test_priority_and_silent_interval():
+    bus, client, clock, units = create_bus()
+    bus.step()
+    bus.step()
+    bus.step()
+    assert [read[1] for read in client.reads] == [2, 2, 1]
+    silent_s = rtu_bus.get_silent_interval_s(9600)
+    assert round(client.reads[1][0] - client.reads[0][0], 4) == round(0.01 + silent_s, 4)
+
+
+# Test if the latency and error rate are tracked per unit
+def test_unit_statistics():
+    bus, client, clock, units = create_bus()
+    client.failing_units = [1]
+    run_until(bus, clock, 3.0)
+    assert units[0].get_error_rate() == 1.0
+    assert units[1].get_error_rate() == 0.0
+    assert round(units[1].latency_ms) == 10
+    assert not units[0].ready.is_set()
+
+
+# Test if a unit that stops answering does not report frozen values
+def test_stale_values():
+    bus, client, clock, units = create_bus()
+    run_until(bus, clock, 10.0)
+    client.failing_units = [1]
+    run_until(bus, clock, 12.0)
+    assert units[0].get_values()['current_power_produced'] == 1
+    run_until(bus, clock, 14.0)
+    with pytest.raises(ConnectionError, match="has not answered for"):
+        units[0].get_values()
+    assert units[1].get_values()['current_power_produced'] == 2
+    client.failing_units = []
+    run_until(bus, clock, 15.0)
+    assert units[0].get_values()['current_power_produced'] == 1
+
+
+# Test if only a rejected address splits a block, not a timeout
+def test_split_on_illegal_address():
+    clock = FakeClock()
+    client = FakeClient(clock)
+    bus = rtu_bus.RtuBus(client, 9600, clock=lambda: clock.now, sleep=clock.sleep)
+    register_map = {
+        'total_energy_produced': {'address': 0, 'length': 1, 'type': 'uint16'},
+        'current_power_produced': {'address': 4, 'length': 1, 'type': 'uint16'},
+    }
+    unit = bus.add_unit(1, register_map, 0, 1, 10, 125, 'big', 'big')
+    client.failing_units = [1]
+    run_until(bus, clock, 3.0)
+    assert len(unit.jobs) == 1
+    client.failing_units = []
+    client.rejected = [2]
+    run_until(bus, clock, 5.0)
+    assert [job.block.address for job in unit.jobs] == [0, 4]
+    assert unit.get_values() == {'total_energy_produced': 1, 'current_power_produced': 1}
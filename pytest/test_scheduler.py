@@ -0,0 +1,61 @@
+from scheduler import Scheduler, POLICY_CATCH_UP
+
+
+# Simulated monotonic clock
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+
+# Creates a scheduler whose first deadline is the current time
+def create_scheduler(fake, policy="skip"):
+    return Scheduler(5, policy, clock=fake.clock, sleep=fake.sleep, wall_clock=lambda: 100.0)
+
+
+# Test if the tick duration does not shift the following deadlines
+def test_deadlines_do_not_drift():
+    fake = FakeClock()
+    scheduler = create_scheduler(fake)
+    for duration in [0.5, 1.25, 4.0]:
+        fake.now += duration  # Simulated poll and DB time
+        assert scheduler.wait() == 0
+    assert fake.now == 1015.0
+    assert fake.sleeps == [4.5, 3.75, 1.0]
+
+
+# Test if the first deadline is aligned to the wall clock
+def test_first_deadline_is_aligned():
+    fake = FakeClock()
+    scheduler = Scheduler(5, clock=fake.clock, sleep=fake.sleep, wall_clock=lambda: 103.0)
+    scheduler.wait_for_first_tick()
+    assert fake.now == 1002.0
+
+
+# Test if overruns skip to the next deadline on the grid
+def test_overrun_skips_missed_ticks():
+    fake = FakeClock()
+    scheduler = create_scheduler(fake)
+    fake.now += 12.0  # Overruns the deadlines at +5 and +10
+    assert scheduler.wait() == 2
+    assert fake.now == 1015.0
+    assert scheduler.num_overruns == 1
+    assert scheduler.last_overrun_s == 7.0
+
+
+# Test if overruns are caught up with back to back ticks
+def test_overrun_catches_up():
+    fake = FakeClock()
+    scheduler = create_scheduler(fake, POLICY_CATCH_UP)
+    fake.now += 12.0
+    assert scheduler.wait() == 0  # Tick of +5 runs right away
+    assert scheduler.wait() == 0  # Tick of +10 runs right away
+    assert scheduler.wait() == 0  # Back on the grid
+    assert fake.now == 1015.0
@@ -0,0 +1,83 @@
+import json
+
+import schema
+import high_res
+import history
+import real_time
+from database import Database
+
+
+# Creates a data base with the tables of the first release
+def create_legacy_db(file_name):
+    db = Database(file_name)
+    with db.transaction():
+        for name in ["days", "months", "years", "all_time"]:
+            db.execute(f"create table {name} (date STRING PRIMARY KEY,"
+                       "produced_a REAL, produced_b REAL,"
+                       "consumed_a REAL, consumed_b REAL,"
+                       "fed_in_a REAL, fed_in_b REAL)")
+        db.execute("INSERT INTO all_time VALUES ('all_time',0,0,0,0,0,0)")
+        db.execute("create table current (date STRING PRIMARY KEY, "
+                   "produced REAL, consumed_grid REAL, consumed_pv REAL, "
+                   "consumed_total REAL, fed_in REAL)")
+        db.execute("create table real_time (ID INTEGER PRIMARY KEY AUTOINCREMENT, "
+                   "time STRING, produced REAL, consumed REAL, fed_in REAL)")
+        db.execute("create table high_res (date STRING PRIMARY KEY, hrvalues STRING)")
+    return db
+
+
+# Test if a new data base is created at the current version
+def test_create_sets_current_version(tmp_path):
+    db = Database(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        schema.create(db)
+    assert schema.get_version(db) == schema.SCHEMA_VERSION
+    schema.upgrade(db)  # Nothing to do
+    assert schema.get_version(db) == schema.SCHEMA_VERSION
+
+
+# Test if legacy high res strings are converted to per minute rows
+def test_upgrade_converts_legacy_high_res(tmp_path):
+    db = create_legacy_db(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        db.execute("INSERT INTO high_res VALUES (?, ?)", (
+            "2024-05-01",
+            '["0:05",1.5,0.25,1.0],["13:07",2.0,1.0,0.5],["13:07",2.5,1.0,1.0],'))
+        db.execute("INSERT INTO high_res VALUES ('2024-05-02', '')")
+
+    schema.upgrade(db)
+
+    assert schema.get_version(db) == schema.SCHEMA_VERSION
+    assert not db.execute("SELECT name FROM sqlite_master WHERE name='high_res'")
+    assert db.execute("SELECT * FROM highscores")[0][0] == "production"
+    samples = json.loads(high_res.get_day_json(db, "2024-05-01"))
+    assert samples == [["00:05", 1.5, 0.25, 1.0], ["13:07", 2.5, 1.0, 1.0]]
+    assert high_res.get_day_json(db, "2024-05-02") == ""
+
+
+# Test if the legacy real time rows end up in the ring buffer
+def test_upgrade_converts_legacy_real_time(tmp_path):
+    db = create_legacy_db(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        db.executemany("INSERT INTO real_time (time, produced, consumed, fed_in) "
+                       "VALUES (?, ?, 0.0, 0.0)",
+                       [("...", 0.0)] * 5 + [("12:00", 1.0), ("12:01", 2.0)])
+
+    schema.upgrade(db)
+
+    assert db.execute("SELECT COUNT(*) FROM real_time")[0][0] == real_time.NUM_REAL_TIME_VALUES
+    rows = real_time.get_latest(db, 60)
+    assert [row[1:3] for row in rows] == [("12:01", 2.0), ("12:00", 1.0)]
+
+
+# Test if integer year keys are converted to text keys
+def test_upgrade_converts_year_keys(tmp_path):
+    db = create_legacy_db(str(tmp_path / "db.sqlite"))
+    with db.transaction():
+        db.execute("INSERT INTO years VALUES ('2024', 1, 2, 3, 4, 5, 6)")
+    assert db.execute("SELECT typeof(date) FROM years")[0][0] == "integer"
+
+    schema.upgrade(db)
+
+    assert db.execute("SELECT date, typeof(date), produced_b FROM years") == [("2024", "text", 2.0)]
+    assert history.get_row(db, "years", "2024")[6] == 6.0
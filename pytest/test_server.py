@@ -0,0 +1,217 @@
+import os
+import gzip
+import time
+import base64
+from datetime import date
+
+import pytest
+
+import grabber
+import high_res
+import server
+import query_cache
+from database import ConnectionManager
+from device_pool import DevicePool
+from devices.Dummy import Dummy
+
+
+# Creates a data base with some ticks and a test client of the web server
+@pytest.fixture
+def client(grabber_db, monkeypatch):
+    grabber.config.config_data["prices"] = {"price_per_grid_kwh": 0.3, "revenue_per_fed_in_kwh": 0.1}
+    pool = DevicePool([("dummy", "Dummy", Dummy(None), 1.0)])
+    grabber.update_data(pool)
+
+    monkeypatch.setattr(server, "config", grabber.config)
+    monkeypatch.setattr(server, "config_hash", None)
+    monkeypatch.setattr(server, "connections", ConnectionManager(grabber.DB_FILE_NAME))
+    monkeypatch.setattr(server, "cache", query_cache.QueryCache(server.connections.get_data_version))
+    yield server.app.test_client(), pool
+    server.connections.close()
+    pool.close()
+
+
+# Test if the available years are answered for an empty and a filled data base
+def test_dates(client):
+    client, pool = client
+    year = date.today().year
+    assert client.get("/query?type=dates").get_json(force=True) == {
+        "state": "ok", "year_min": year, "year_max": year}
+    with grabber.db.transaction():
+        grabber.db.execute("DELETE FROM years")
+    assert client.get("/query?type=dates").get_json(force=True) == {
+        "state": "ok", "year_min": None, "year_max": year}
+
+
+# Test if unchanged data is answered with 304 until the grabber commits
+def test_etag_of_current_data(client):
+    client, pool = client
+    response = client.get("/query?type=current")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-cache"
+    etag = response.headers["ETag"]
+
+    response = client.get("/query?type=current", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+
+    grabber.update_data(pool)
+    response = client.get("/query?type=current", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+# Test if closed periods can be cached by the browser
+def test_etag_of_closed_period(client):
+    client, pool = client
+    url = "/query?type=days_in_month&date=2020-01"
+    response = client.get(url)
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+    etag = response.headers["ETag"]
+    grabber.update_data(pool)
+    # Compressed responses carry the algorithm in the ETag
+    response = client.get(url, headers={"If-None-Match": etag[:-1] + ':gzip"'})
+    assert response.status_code == 304
+
+    month = date.today().strftime("%Y-%m")
+    response = client.get(f"/query?type=days_in_month&date={month}")
+    assert response.headers["Cache-Control"] == "no-cache"
+
+
+# Test if the ETag of old power samples changes when the retention removes them
+def test_etag_after_retention(client):
+    client, pool = client
+    with grabber.db.transaction():
+        for day_string in ["2020-01-01", "2020-01-02"]:
+            grabber.insert_high_res_values(grabber.db, day_string, 600, 1.0, 0.5, 0.25)
+            grabber.insert_historical_values(grabber.db, "days", day_string, 1.0, 1.0, 1.0)
+    urls = ["/query?type=power&from=2020-01-02&to=2020-01-02&points=1440",
+            "/query?type=historical&table=days&date=2020-01-01"]
+    etags = [client.get(url).headers["ETag"] for url in urls]
+    for url, etag in zip(urls, etags):
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    with grabber.db.transaction():
+        retention = server.rollup.get_retention({"rollup": {"minute_retention_days": 1}})
+        server.rollup.apply_retention(grabber.db, retention, date(2020, 1, 3))
+    for url, etag in zip(urls, etags):
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+
+# Test if the current day is the one of the configured time zone
+def test_closed_period_in_time_zone(client, monkeypatch):
+    client, pool = client
+    # 2024-06-01 03:00 UTC is still May 31 west of UTC
+    monkeypatch.setattr(server.time, "time", lambda: 1717210800.0)
+    time_zone = os.environ.get("TZ")
+    os.environ["TZ"] = "America/New_York"
+    time.tzset()
+    try:
+        assert server.get_today() == date(2024, 5, 31)
+        response = client.get("/query?type=power&from=2024-05-31&to=2024-05-31")
+        assert response.headers["Cache-Control"] == "no-cache"
+        response = client.get("/query?type=power&from=2024-05-30&to=2024-05-30")
+        assert response.headers["Cache-Control"].startswith("public")
+    finally:
+        if time_zone is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = time_zone
+        time.tzset()
+
+
+# Test if the stream pushes the current data and refuses too many clients
+def test_stream(client, monkeypatch):
+    client, pool = client
+    broadcaster = server.stream.Broadcaster(
+        server.connections.get_data_version, server.get_stream_events,
+        max_subscribers=1, poll_interval_s=0.01)
+    monkeypatch.setattr(server, "broadcaster", broadcaster)
+    response = client.get("/stream", buffered=False)
+    assert response.mimetype == "text/event-stream"
+    messages = iter(response.response)
+    assert next(messages).startswith(b"retry: ")
+    message = next(messages).decode()
+    assert message.startswith("event: current\ndata: {")
+    assert '"state": "ok"' in message
+
+    assert client.get("/stream").status_code == 503
+    response.close()
+    response = client.get("/stream", buffered=False)
+    assert response.status_code == 200  # The slot is free again
+    response.close()
+
+
+# Test if a batch answers each query like /query does
+def test_batch(client):
+    client, pool = client
+    response = client.post("/batch", json=[
+        {"type": "current"}, {"type": "real_time", "h": 1}, {"type": "unknown"}])
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    current, real_time, unknown = response.get_json()
+    assert current == client.get("/query?type=current").get_json(force=True)
+    assert real_time == client.get("/query?type=real_time&h=1").get_json(force=True)
+    assert unknown == {"state": "error"}
+
+    assert client.post("/batch", json={"type": "current"}).status_code == 400
+
+
+# Test if the CSV export is streamed and compressed on the fly
+def test_csv(client):
+    client, pool = client
+    today = str(date.today())
+    response = client.get(f"/csv?table=minutes&from={today}&to={today}",
+                          headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers["Content-Encoding"] == "gzip"
+    text = gzip.decompress(response.get_data()).decode()
+    assert text.startswith("date;time;production;consumption;feed_in\n" + today)
+
+    response = client.get(f"/csv?table=days&date={today}")
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data(as_text=True).splitlines()[1].startswith(today + ";")
+    assert client.get("/csv?table=sqlite_master").status_code == 404
+
+
+# Test if the real time cursor only returns new samples
+def test_real_time_since(client):
+    client, pool = client
+    data = client.get("/query?type=real_time&h=1&since=0").get_json(force=True)
+    assert len(data["values"]) == 1
+    assert data["cursor"] == data["values"][0][0]
+    data = client.get(f"/query?type=real_time&h=1&since={data['cursor']}").get_json(force=True)
+    assert data["values"] == []
+
+
+# Test if the minute samples of a range are served in the compact format
+def test_high_res(client):
+    client, pool = client
+    today = str(date.today())
+    response = client.get(f"/high_res?from={today}&to={today}", headers={"Accept-Encoding": "gzip"})
+    assert response.mimetype == "application/octet-stream"
+    days = high_res.decode_binary(gzip.decompress(response.get_data()))
+    assert len(days[today]) == 1
+
+    response = client.get(f"/high_res?from={today}&encoding=base64")
+    assert high_res.decode_binary(base64.b64decode(response.get_data())) == days
+    assert client.get("/high_res?from=2020-01-01&to=2024-01-01").status_code == 404
+
+    data = client.get(f"/query?type=historical&table=days&date={today}&high_res=base64").get_json(force=True)
+    assert high_res.decode_binary(base64.b64decode(data["high_res"]))[today] == days[today]
+
+
+# Test if the analytics query answers the KPIs of a range
+def test_analytics(client):
+    client, pool = client
+    today = str(date.today())
+    data = client.get(f"/query?type=analytics&from={today}&bucket=hour").get_json(force=True)
+    assert data["state"] == "ok"
+    assert data["num_samples"] == 1
+    assert len(data["buckets"]) == 1
+    data = client.get(f"/query?type=analytics&from={today}&source=days&bucket=all").get_json(force=True)
+    assert data["state"] == "ok"
+    data = client.get(f"/query?type=analytics&from={today}&bucket=week").get_json(force=True)
+    assert data["state"] == "error"
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+import grabber
+import stats
+
+
+# Test if the statistics kept by the ticks match a rebuild from the tables
+def test_update_matches_rebuild(grabber_db):
+    db = grabber_db
+
+    # Production of 3, 7 and 5 kWh on three days, peak power on the second
+    device = SimpleNamespace(
+        total_energy_produced_kwh=100.0, total_energy_consumed_kwh=0.0,
+        total_energy_fed_in_kwh=0.0, current_power_produced_kw=0.0,
+        current_power_consumed_from_grid_kw=0.0, current_power_consumed_from_pv_kw=0.0,
+        current_power_consumed_total_kw=0.0, current_power_fed_in_kw=0.0)
+    day_s = 86400.0
+    start = 1717243200.0 + 6 * 3600.0  # 2024-06-01 morning
+    with db.transaction():
+        for day, (produced, peak) in enumerate([(3.0, 1.0), (7.0, 4.5), (5.0, 2.0)]):
+            grabber.write_tick(device, start + day * day_s)
+            device.total_energy_produced_kwh += produced
+            device.current_power_produced_kw = peak
+            grabber.write_tick(device, start + day * day_s + 3600.0)
+            device.current_power_produced_kw = 0.0
+
+    row = stats.get(db)
+    assert row[1:3] == (grabber.datetime.fromtimestamp(start + day_s).strftime("%Y-%m-%d"), 7.0)
+    assert row[4] == 15.0  # Best month
+    assert row[6] == 15.0  # Best year
+    assert row[8] == 4.5
+    assert row[9] == 115.0
+    with db.transaction():
+        stats.rebuild(db)
+    assert stats.get(db) == row
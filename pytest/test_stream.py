@@ -0,0 +1,39 @@
+from stream import Broadcaster, format_event
+
+
+# Test if each subscriber gets an event only when its data changed
+def test_fan_out():
+    state = {"generation": 1, "minute": 100}
+
+    def events():
+        return [("current", f"gen {state['generation']}"), ("real_time", str(state["minute"]))]
+
+    broadcaster = Broadcaster(lambda: state["generation"], events, max_subscribers=2)
+    broadcaster.thread = object()  # Polled by the test, not by a thread
+
+    first = broadcaster.subscribe()
+    second = broadcaster.subscribe()
+    assert broadcaster.subscribe() is None  # All slots taken
+    broadcaster.poll()
+    broadcaster.poll()  # No new tick
+    state["generation"] = 2
+    broadcaster.poll()  # New tick in the same minute
+    for subscriber in (first, second):
+        assert [subscriber.get_nowait() for i in range(subscriber.qsize())] == [
+            format_event("current", "gen 1"),
+            format_event("real_time", "100"),
+            format_event("current", "gen 2")]
+
+
+# Test if a new subscriber starts with the latest events and leaves on close
+def test_messages():
+    broadcaster = Broadcaster(lambda: 1, lambda: [("current", "{}")], max_subscribers=1)
+    broadcaster.thread = object()
+    broadcaster.poll()
+    subscriber = broadcaster.subscribe()
+    messages = broadcaster.messages(subscriber, keep_alive_s=0.01)
+    assert next(messages).startswith("retry: ")
+    assert next(messages) == format_event("current", "{}")
+    assert next(messages) == ": keep-alive\n\n"
+    messages.close()
+    assert broadcaster.subscribe() is not None  # The slot is free again
@@ -6,6 +6,9 @@ let gChartHistoryDetailsProduced = null
 let gChartHistoryDetailsConsumed = null
 let gChartHistoryHighRes = null
 
+// Minute IDs of the points of the dashboard chart, oldest first
+let gChartDashboardIds = [];
+
 // Colors
 const FILL_OPACITY = "20";
 
@@ -151,8 +154,10 @@ function createDashboardChart(canvasId, data) {
         };
 
         let max = 0.0;
+        gChartDashboardIds = [];
         for (index = data.length - 1; index >= 0; index--) { // Reverse data
             labels.push(data[index][1]); // Element 1 = time
+            gChartDashboardIds.push(data[index][0]); // Element 0 = minute ID
             for (i = 0; i < 3; ++i) {
                 let value = data[index][2 + i] * 1000.0;
                 chart_data.datasets[i].data.push(value);
@@ -227,8 +232,10 @@ function createDashboardChart(canvasId, data) {
         gChartDashboard.data.datasets[2].data = [];
 
         let max = 0.0;
+        gChartDashboardIds = [];
         for (index = data.length - 1; index >= 0; index--) { // Reverse data
             gChartDashboard.data.labels.push(data[index][1]); // Element 1 = time
+            gChartDashboardIds.push(data[index][0]); // Element 0 = minute ID
             for (i = 0; i < 3; ++i) {
                 let value = data[index][2 + i] * 1000.0;
                 gChartDashboard.data.datasets[i].data.push(value);
@@ -241,6 +248,33 @@ function createDashboardChart(canvasId, data) {
     }
 }
 
+// Appends new samples (newest first) to the dashboard chart in place and
+// drops the points before the given minute ID
+function appendDashboardChart(data, firstId) {
+    if (gChartDashboard == null) return;
+    const chartData = gChartDashboard.data;
+    for (let index = data.length - 1; index >= 0; index--) { // Reverse data
+        chartData.labels.push(data[index][1]); // Element 1 = time
+        gChartDashboardIds.push(data[index][0]); // Element 0 = minute ID
+        for (let i = 0; i < 3; ++i)
+            chartData.datasets[i].data.push(data[index][2 + i] * 1000.0);
+    }
+    while (gChartDashboardIds.length > 0 && gChartDashboardIds[0] < firstId) {
+        gChartDashboardIds.shift();
+        chartData.labels.shift();
+        for (let i = 0; i < 3; ++i)
+            chartData.datasets[i].data.shift();
+    }
+
+    let max = 0.0;
+    for (let i = 0; i < 3; ++i)
+        for (const value of chartData.datasets[i].data)
+            if (value > max) max = value;
+    max = (Math.ceil(max) + 100) - (Math.ceil(max) % 100);
+    gChartDashboard.options.scales.y.max = max;
+    gChartDashboard.update('none');
+}
+
 // Creates a chart for the history daily/high res view
 function createHighResChart(canvasId, data) {
 
@@ -2,7 +2,9 @@
 function downloadCsv() {
     // Get the table
     let table = "days";
-    if (document.getElementById("csv_res_rad_month").checked == true)
+    if (document.getElementById("csv_res_rad_minute").checked == true)
+        table = "minutes";
+    else if (document.getElementById("csv_res_rad_month").checked == true)
         table = "months";
     else if (document.getElementById("csv_res_rad_year").checked == true)
         table = "years";
@@ -22,10 +24,10 @@ function downloadCsv() {
     else if (document.getElementById("csv_range_rad_day").checked == true)
         date = year + "-" + month + "-" + day;
 
-    // Buildquery
+    // Build query, the range covers the whole day, month or year
     url = document.baseURI + "/csv?table=" + table;
     if (date.length > 0)
-        url += "&date=" + date;
+        url += "&from=" + date + "&to=" + date;
 
     console.log("Executing CSV query: " + url);
     window.open(url);
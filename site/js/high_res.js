@@ -0,0 +1,68 @@
+// Decoder of the compact high res format of the backend (see high_res.py):
+// header "CPHR", u8 version, u16 scale, u16 number of days, then per day
+// the date, u16 number of samples and the minute, produced, consumed and
+// fed_in columns as zigzag varint deltas. All numbers are little endian.
+
+const HIGH_RES_MAGIC = "CPHR";
+const HIGH_RES_VERSION = 1;
+
+// Decodes a compact high res block (ArrayBuffer) into the samples of each
+// day: { "YYYY-MM-DD": [["HH:MM", produced, consumed, fed_in], ...] }
+function decodeHighRes(buffer) {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    const magic = String.fromCharCode(...bytes.subarray(0, 4));
+    if (magic != HIGH_RES_MAGIC || view.getUint8(4) != HIGH_RES_VERSION)
+        throw new Error("Not a compact high res data block");
+    const scale = view.getUint16(5, true);
+    const numDays = view.getUint16(7, true);
+    let offset = 9;
+
+    // Reads a column of delta encoded values
+    function readColumn(count) {
+        const values = new Array(count);
+        let previous = 0;
+        for (let i = 0; i < count; i++) {
+            let delta = 0;
+            let factor = 1;
+            let byte;
+            do {
+                byte = bytes[offset++];
+                delta += (byte & 0x7F) * factor;
+                factor *= 128;
+            } while (byte >= 0x80);
+            // Zigzag: even numbers are positive, odd ones negative
+            previous += (delta % 2 == 0) ? delta / 2 : -(delta + 1) / 2;
+            values[i] = previous;
+        }
+        return values;
+    }
+
+    const days = {};
+    for (let day = 0; day < numDays; day++) {
+        const date = String.fromCharCode(...bytes.subarray(offset, offset + 10));
+        const count = view.getUint16(offset + 10, true);
+        offset += 12;
+        const minutes = readColumn(count);
+        const produced = readColumn(count);
+        const consumed = readColumn(count);
+        const fedIn = readColumn(count);
+        const samples = new Array(count);
+        for (let i = 0; i < count; i++) {
+            const time = String(Math.floor(minutes[i] / 60)).padStart(2, "0") + ":" +
+                String(minutes[i] % 60).padStart(2, "0");
+            samples[i] = [time, produced[i] / scale, consumed[i] / scale, fedIn[i] / scale];
+        }
+        days[date] = samples;
+    }
+    return days;
+}
+
+// Decodes a compact high res block sent as base64 text
+function decodeHighResBase64(text) {
+    const binary = atob(text);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++)
+        bytes[i] = binary.charCodeAt(i);
+    return decodeHighRes(bytes.buffer);
+}
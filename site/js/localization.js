@@ -81,6 +81,7 @@ let translations = [
     ["csv_range_rad_lbl_month", "A month", "Ein Monat"],
     ["csv_range_rad_lbl_year", "A year", "Ein jahr"],
     ["csv_range_rad_lbl_all", "All time", "Alles"],
+    ["csv_res_rad_lbl_minute", "Minutes (power)", "Minuten (Leistung)"],
     ["csv_res_rad_lbl_day", "Single days", "Einzelne Tage"],
     ["csv_res_rad_lbl_month", "Summed up by months", "Auf Monate summiert"],
     ["csv_res_rad_lbl_year", "Summed up by years", "Auf Jahre summiert"],
@@ -21,6 +21,11 @@ let gMinDate = null
 
 let gDahboardGraphTimespan = 24
 
+// Push channel of the dashboard values and the polling fallback
+let gStream = null;
+let gPollingTimers = [];
+let gRealTimeCursor = null;  // Minute ID of the newest sample in the graph
+
 
 // Called when index.html has finished loading
 window.addEventListener('DOMContentLoaded', event => {
@@ -28,29 +33,44 @@ window.addEventListener('DOMContentLoaded', event => {
     console.log("Setting base URI to " + gBaseUrl);
     restoreLanguage();
     setInterval(updateTime, 1000);
-    setInterval(updateCurrentStats, 3000);
-    setInterval(updateRealTimeGraph, 5000);
     restoreSettings();
     showViewDashboard();
-    updateCurrentStats();
-    updateRealTimeGraph();
-    initSelectionBoxes();
+    loadInitialData();
+    openStream();
     updateCsvDateSelector();
     setVersion();
-    setName();
 });
 
-function setName() {
-    fetchNameJSON().then(name =>{
-        document.getElementById("instance-name").innerHTML = "Cpin Data Collector "+name;
-        document.title ="Cpin Data Collector "+ name;
-    })    
-  }
+// Loads all data shown at start with one request, which also makes the
+// values consistent with each other
+function loadInitialData() {
+    fetchBatchJSON([
+        {type: "name"},
+        {type: "current"},
+        {type: "real_time", h: gDahboardGraphTimespan, since: 0},
+        {type: "dates"}
+    ]).then(results => {
+        setName(results[0]);
+        showCurrentStats(results[1]);
+        showRealTimeGraph(results[2]);
+        initSelectionBoxes(results[3]);
+    });
+}
+
+// Async function to answer several queries with one request
+async function fetchBatchJSON(queries) {
+    const response = await fetch(gBaseUrl + 'batch', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(queries)
+    });
+    const results = await response.json();
+    return results;
+}
 
-  async function fetchNameJSON() {
-    const response = await fetch(gBaseUrl + 'name');
-    const name = await response.json();
-    return name;
+function setName(name) {
+    document.getElementById("instance-name").innerHTML = "Cpin Data Collector "+name;
+    document.title ="Cpin Data Collector "+ name;
 }
 
 function restoreSettings() {
@@ -59,35 +79,87 @@ function restoreSettings() {
         gDahboardGraphTimespan = parseInt(ts);
 }
 
-// Called cyclically to update the current stats
+// Opens the push channel for the dashboard values. The server sends the
+// current stats after each grabber tick and a real time sample each minute.
+function openStream() {
+    if (typeof EventSource === "undefined") {
+        startPolling();
+        return;
+    }
+    gStream = new EventSource(gBaseUrl + 'stream');
+    gStream.addEventListener("current", event => {
+        showCurrentStats(JSON.parse(event.data));
+    });
+    gStream.addEventListener("real_time", event => {
+        addRealTimeSample(JSON.parse(event.data));
+    });
+    gStream.onerror = () => {
+        // The browser reconnects by itself unless the server refused
+        // the stream, e.g. because all slots are taken
+        if (gStream.readyState == EventSource.CLOSED) {
+            console.log("Stream refused, falling back to polling");
+            gStream = null;
+            startPolling();
+        }
+    };
+}
+
+// Polls the dashboard values if the push channel is not available
+function startPolling() {
+    if (gPollingTimers.length > 0) return;
+    gPollingTimers.push(setInterval(updateCurrentStats, 3000));
+    gPollingTimers.push(setInterval(pollRealTimeGraph, 5000));
+}
+
+// Closes the push channel while the page is hidden to free its slot
+document.addEventListener("visibilitychange", () => {
+    if (gPollingTimers.length > 0) return;
+    if (document.hidden) {
+        if (gStream != null) gStream.close();
+        gStream = null;
+    } else if (gStream == null) {
+        // Catch up on what was missed, then continue with pushed values
+        updateCurrentStats();
+        pollRealTimeGraph();
+        openStream();
+    }
+});
+
+// Called to update the current stats
 function updateCurrentStats() {
     if (!gDashboardVisible) return;
     //console.log("Refreshing dashbard");
     fetchCurrentStatsJSON().then(stats => {
-        //console.log(stats);
-        const d = new Date();
-        document.getElementById("dashboard_subtitle_time").innerHTML = d.toLocaleTimeString('de-DE');
-
-        document.getElementById("dash_today_produced").innerHTML = numFormat(stats["today_produced_kwh"] * 1000.0, 0);
-        document.getElementById("dash_today_consumed").innerHTML = numFormat(stats["today_consumed_kwh"] * 1000.0, 0);
-        document.getElementById("dash_today_fed_in").innerHTML = numFormat(stats["today_fed_in_kwh"] * 1000.0, 0);
-        document.getElementById("dash_today_earned").innerHTML = numFormat(stats["today_earned"], 2);
-        document.getElementById("dash_today_autarky").innerHTML = numFormat(stats["today_autarky"], 0);
-
-        document.getElementById("dash_all_time_produced").innerHTML = numFormat(stats["all_time_produced_kwh"], 0);
-        document.getElementById("dash_all_time_consumed").innerHTML = numFormat(stats["all_time_consumed_kwh"], 0);
-        document.getElementById("dash_all_time_fed_in").innerHTML = numFormat(stats["all_time_fed_in_kwh"], 0);
-        document.getElementById("dash_all_time_earned").innerHTML = numFormat(stats["all_time_earned"], 2);
-        document.getElementById("dash_all_time_autarky").innerHTML = numFormat(stats["all_time_autarky"], 0);
-
-        // Info graphic
-        updateInfoGraphic(
-            Math.floor(stats["currently_produced_w"]), 
-            Math.floor(stats["currently_consumed_grid_w"]),
-            Math.floor(stats["currently_fed_in_w"]));
+        showCurrentStats(stats);
     });
 }
 
+// Shows the current stats on the dashboard
+function showCurrentStats(stats) {
+    if (!gDashboardVisible) return;
+    //console.log(stats);
+    const d = new Date();
+    document.getElementById("dashboard_subtitle_time").innerHTML = d.toLocaleTimeString('de-DE');
+
+    document.getElementById("dash_today_produced").innerHTML = numFormat(stats["today_produced_kwh"] * 1000.0, 0);
+    document.getElementById("dash_today_consumed").innerHTML = numFormat(stats["today_consumed_kwh"] * 1000.0, 0);
+    document.getElementById("dash_today_fed_in").innerHTML = numFormat(stats["today_fed_in_kwh"] * 1000.0, 0);
+    document.getElementById("dash_today_earned").innerHTML = numFormat(stats["today_earned"], 2);
+    document.getElementById("dash_today_autarky").innerHTML = numFormat(stats["today_autarky"], 0);
+
+    document.getElementById("dash_all_time_produced").innerHTML = numFormat(stats["all_time_produced_kwh"], 0);
+    document.getElementById("dash_all_time_consumed").innerHTML = numFormat(stats["all_time_consumed_kwh"], 0);
+    document.getElementById("dash_all_time_fed_in").innerHTML = numFormat(stats["all_time_fed_in_kwh"], 0);
+    document.getElementById("dash_all_time_earned").innerHTML = numFormat(stats["all_time_earned"], 2);
+    document.getElementById("dash_all_time_autarky").innerHTML = numFormat(stats["all_time_autarky"], 0);
+
+    // Info graphic
+    updateInfoGraphic(
+        Math.floor(stats["currently_produced_w"]), 
+        Math.floor(stats["currently_consumed_grid_w"]),
+        Math.floor(stats["currently_fed_in_w"]));
+}
+
 // Called cyclically to update the time
 function updateTime() {
     const d = new Date();
@@ -102,39 +174,66 @@ async function fetchCurrentStatsJSON() {
     return stats;
 }
 
-// Called cyclically to update the current stats
+// Called to reload the whole real time graph
 function updateRealTimeGraph() {
-    if (!gDashboardVisible) return;
-    //console.log("Refreshing dashbard");
-    fetchRealTimeStatsJSON().then(stats => {
-        createDashboardChart("chart_dashboard", stats);
+    fetchRealTimeStatsJSON(0).then(stats => {
+        showRealTimeGraph(stats);
     });
 }
 
-// Async function to get the real time stats
-async function fetchRealTimeStatsJSON() {
-    const response = await fetch(gBaseUrl + 'query?type=real_time&h=' + gDahboardGraphTimespan);
+// Shows all samples of the time span in the real time graph
+function showRealTimeGraph(stats) {
+    createDashboardChart("chart_dashboard", stats["values"]);
+    gRealTimeCursor = stats["cursor"];
+}
+
+// Called to add the samples written since the last request to the graph
+function pollRealTimeGraph() {
+    if (gRealTimeCursor == null) return;
+    fetchRealTimeStatsJSON(gRealTimeCursor).then(stats => {
+        addRealTimeSamples(stats["values"], stats["cursor"]);
+    });
+}
+
+// Adds a pushed real time sample to the graph
+function addRealTimeSample(sample) {
+    // Element 0 = minute ID, samples missed while reconnecting are fetched
+    if (gRealTimeCursor != null && sample[0] > gRealTimeCursor + 1)
+        pollRealTimeGraph();
+    else
+        addRealTimeSamples([sample], sample[0]);
+}
+
+// Adds new samples (newest first) to the graph, dropping the samples that
+// left the time span
+function addRealTimeSamples(samples, cursor) {
+    if (gRealTimeCursor == null || cursor <= gRealTimeCursor) return;
+    samples = samples.filter(sample => sample[0] > gRealTimeCursor);
+    gRealTimeCursor = cursor;
+    appendDashboardChart(samples, cursor - gDahboardGraphTimespan * 60 + 1);
+}
+
+// Async function to get the real time stats newer than the cursor
+async function fetchRealTimeStatsJSON(since) {
+    const response = await fetch(gBaseUrl + 'query?type=real_time&h=' + gDahboardGraphTimespan + '&since=' + since);
     const stats = await response.json();
     return stats;
 }
 
-function initSelectionBoxes() {
+function initSelectionBoxes(dates) {
     // Days: numbers 1 to 31
     for (let i = 1; i <= 31; i++) {
         addSelectionItem("selection_day2", i.toString(), i.toString());
         addSelectionItem("csv_selection_day2", i.toString(), i.toString());
     }
-    // Years: query from DB
-    fetchDatesJSON().then(dates => {
-        //console.log(stats);
-        gMinDate = new Date(dates["year_min"] + "-01-01");
-        for (let i = dates["year_min"]; i <= dates["year_max"]; i++) {
-            addSelectionItem("selection_year2", i.toString(), i.toString());
-            addSelectionItem("csv_selection_year2", i.toString(), i.toString());
-        }
-        // Initial selection
-        selectDate(new Date());
-    });
+    // Years: range of the data in the DB
+    gMinDate = new Date(dates["year_min"] + "-01-01");
+    for (let i = dates["year_min"]; i <= dates["year_max"]; i++) {
+        addSelectionItem("selection_year2", i.toString(), i.toString());
+        addSelectionItem("csv_selection_year2", i.toString(), i.toString());
+    }
+    // Initial selection
+    selectDate(new Date());
 }
 
 function selectDate(date) {
@@ -149,13 +248,6 @@ function selectDate(date) {
     document.getElementById('csv_selection_day2').value = date.getDate();
 }
 
-// Async function to get the important dates
-async function fetchDatesJSON() {
-    const response = await fetch(gBaseUrl + 'query?type=dates');
-    const stats = await response.json();
-    return stats;
-}
-
 
 // Called cyclically to update the current stats
 function updateHistoryStats() {
@@ -201,7 +293,8 @@ function updateHistoryStats() {
 
             // Create high res chart
             if(stats["high_res"] != "") {
-                data = JSON.parse(stats["high_res"])
+                // Compact format of the only day in the response
+                data = Object.values(decodeHighResBase64(stats["high_res"]))[0];
                 createHighResChart("chart_history_high_res", data);
                 setElementVisible("history_card_high_res", true);
             } else {
@@ -233,6 +326,7 @@ async function fetchHistoryStatsJSON() {
             query += padStr(document.getElementById('selection_month2').value.toString());
             query += "-";
             query += padStr(document.getElementById('selection_day2').value.toString());
+            query += "&high_res=base64";
             break;
         case histories.MONTH:
             query += "months&date=";
@@ -327,6 +421,9 @@ function showViewDashboard() {
     setElementVisible("view_csv", false);
     setInfoGraphicEnabled(true);
     gDashboardVisible = true;
+    // Pushed values are not shown while the dashboard is hidden
+    if (gRealTimeCursor != null)
+        updateCurrentStats();
 }
 
 function showViewStatistics() {